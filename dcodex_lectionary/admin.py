@@ -106,3 +106,17 @@ class LectionarySystemAdmin(SortableAdminBase, admin.ModelAdmin):
 @admin.register(Lectionary)    
 class LectionaryAdmin(ManuscriptChildAdmin):
     pass
+
+
+@admin.register(SimilarityJob)
+class SimilarityJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'kind', 'base_ms', 'comparison_sigla', 'status', 'processed', 'total', 'created')
+    list_filter = ('kind', 'status')
+    raw_id_fields = ('base_ms', 'system')
+    exclude = ('result',)
+
+
+@admin.register(SimilarityParameters)
+class SimilarityParametersAdmin(admin.ModelAdmin):
+    list_display = ('name', 'weights', 'gotoh_param', 'prior_log_odds', 'ignore_incipits', 'created')
+    search_fields = ('name', 'description')
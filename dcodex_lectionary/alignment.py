@@ -0,0 +1,287 @@
+"""
+Alignment routines that work only on strings that have already been loaded from the database.
+
+Nothing in this module imports Django models so that the functions can be sent to worker processes.
+"""
+import os
+import time
+from collections import Counter
+import numpy as np
+import gotoh
+
+from . import backends
+
+LECTION_SEPARATOR = " " # Joins the verses of a lection when whole lections are aligned. It does not share its lowest byte with any Greek letter.
+
+
+def resolve_n_jobs( n_jobs ):
+    """
+    Returns the number of worker processes to use.
+
+    None or 1 means to run serially. Negative numbers count back from the number of CPUs so that -1 uses all of them.
+    """
+    if n_jobs is None:
+        return 1
+    if n_jobs < 0:
+        n_jobs = (os.cpu_count() or 1) + 1 + n_jobs
+    return max(1, n_jobs)
+
+
+def transcription_pairs( transcriptions ):
+    """ Yields each pair of base and comparison transcription which needs to be aligned. """
+    for base_transcription, comparison_transcriptions in transcriptions:
+        if not base_transcription:
+            continue
+        for comparison_transcription in comparison_transcriptions:
+            if comparison_transcription:
+                yield (base_transcription, comparison_transcription)
+
+
+def verse_counts( transcriptions, comparison_count, gotoh_param, known_counts=None, backend=None ):
+    """
+    Aligns the base transcription of each verse with the transcriptions of the comparison manuscripts.
+
+    `transcriptions` has an item for each verse which is a tuple of the base transcription and a list of the comparison transcriptions.
+    Verses without a base transcription and missing comparison transcriptions are skipped.
+    `known_counts` is an optional dictionary of counts for pairs of transcriptions which do not need to be aligned again.
+    `backend` is an AlignmentBackend or the name of one (see `backends.get_backend`).
+
+    Returns an integer array of shape (verses, comparison_count, 4) with the number of matches, mismatches, gap openings and gap extensions.
+    """
+    return lections_verse_counts( [transcriptions], comparison_count, gotoh_param, known_counts, backend )[0]
+
+
+def lections_verse_counts( lections_transcriptions, comparison_count, gotoh_param, known_counts=None, backend=None ):
+    """
+    Returns a list with the result of `verse_counts` for the transcriptions of each lection.
+
+    The pairs of transcriptions which need to be aligned in all the lections are sent to the backend together so that it can batch them.
+    """
+    lections_counts = [np.zeros( (len(transcriptions), comparison_count, 4), dtype=np.int32 ) for transcriptions in lections_transcriptions]
+    positions = []
+    pairs = []
+    for lection_index, transcriptions in enumerate(lections_transcriptions):
+        for verse_index, (base_transcription, comparison_transcriptions) in enumerate(transcriptions):
+            if not base_transcription:
+                continue
+            for ms_index, comparison_transcription in enumerate(comparison_transcriptions):
+                if not comparison_transcription:
+                    continue
+                pair = (base_transcription, comparison_transcription)
+                if known_counts and pair in known_counts:
+                    lections_counts[lection_index][verse_index, ms_index] = known_counts[pair]
+                else:
+                    positions.append( (lection_index, verse_index, ms_index) )
+                    pairs.append( pair )
+
+    if pairs:
+        pairs_counts = backends.get_backend( backend ).counts( pairs, gotoh_param )
+        for (lection_index, verse_index, ms_index), counts in zip(positions, pairs_counts):
+            lections_counts[lection_index][verse_index, ms_index] = counts
+
+    return lections_counts
+
+
+def paired_separator( separator ):
+    """
+    Returns the separator which joins the verses of the comparison texts when the base texts are joined with `separator`.
+
+    Each character has the same lowest byte as the character of `separator` but is a different character. `gotoh.counts` only compares the lowest byte
+    when it fills in the matrix so the alignment is the same as if both texts used `separator`, but it compares the whole characters
+    when it counts the matches so separators aligned with each other are counted as mismatches rather than as matches.
+    """
+    return "".join( chr( ord(character) + 0x100 ) for character in separator )
+
+
+def concatenated_pairs( transcriptions, comparison_count, separator=LECTION_SEPARATOR ):
+    """
+    Joins the verses of a lection into a single pair of texts for each comparison manuscript.
+
+    The base texts are joined with `separator` and the comparison texts with `paired_separator( separator )` so that the separators are never counted as matches.
+    Only the verses where both the base and comparison manuscript have a transcription are joined so that the texts cover the same verses as `verse_counts`.
+    Returns a list with a tuple of the base and comparison texts for each comparison manuscript (or None if there are no verses in common).
+    """
+    comparison_separator = paired_separator( separator )
+    pairs = []
+    for ms_index in range(comparison_count):
+        verse_pairs = [
+            (base_transcription, comparison_transcriptions[ms_index])
+            for base_transcription, comparison_transcriptions in transcriptions
+            if base_transcription and comparison_transcriptions[ms_index]
+        ]
+        if verse_pairs:
+            base_texts, comparison_texts = zip(*verse_pairs)
+            pairs.append( (separator.join( base_texts ), comparison_separator.join( comparison_texts )) )
+        else:
+            pairs.append( None )
+    return pairs
+
+
+def lections_counts( lections_transcriptions, comparison_count, gotoh_param, separator=LECTION_SEPARATOR, backend=None ):
+    """
+    Aligns whole lections rather than verse by verse so that text which moves across the boundary of a verse is aligned with itself.
+
+    The verses of each lection are joined with `concatenated_pairs` and all the pairs are sent to the backend in a single call.
+    The separators are left out of the counts: the verses of both texts are the same so each separator is taken to be aligned with its counterpart,
+    which is counted as a mismatch (see `paired_separator`) and so the number of separators is taken from the mismatches.
+    Returns an integer array of shape (lections, comparison_count, 4) with the counts for each lection.
+    """
+    counts = np.zeros( (len(lections_transcriptions), comparison_count, 4), dtype=np.int64 )
+    positions = []
+    pairs = []
+    for lection_index, transcriptions in enumerate(lections_transcriptions):
+        for ms_index, pair in enumerate(concatenated_pairs( transcriptions, comparison_count, separator )):
+            if pair:
+                positions.append( (lection_index, ms_index) )
+                pairs.append( pair )
+
+    if pairs:
+        pairs_counts = backends.get_backend( backend ).counts( pairs, gotoh_param )
+        comparison_separator = paired_separator( separator )
+        for (lection_index, ms_index), pair, pair_counts in zip(positions, pairs, pairs_counts):
+            counts[lection_index, ms_index] = pair_counts
+            separator_count = pair[1].count( comparison_separator ) * len(separator)
+            counts[lection_index, ms_index, 1] -= min( separator_count, pair_counts[1] )
+
+    return counts
+
+
+def benchmark_alignment_modes( lections_transcriptions, comparison_count, gotoh_param, separator=LECTION_SEPARATOR, backend=None, repeat=1 ):
+    """
+    Times aligning lections verse by verse and as whole lections and compares the similarity percentages of the two modes.
+
+    Returns a dictionary keyed by the mode ('verses' or 'lections') with the best time in seconds and the number of lections per second,
+    and the mean and maximum absolute difference between the similarity percentages of the two modes for the lections aligned in both.
+    """
+    def verse_mode():
+        return np.array( [counts.sum( axis=0 ) for counts in lections_verse_counts( lections_transcriptions, comparison_count, gotoh_param, backend=backend )] )
+
+    def lection_mode():
+        return lections_counts( lections_transcriptions, comparison_count, gotoh_param, separator, backend )
+
+    results = {}
+    similarities = {}
+    for mode, function in [('verses', verse_mode), ('lections', lection_mode)]:
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            counts = function()
+            times.append( time.perf_counter() - start )
+        seconds = min(times)
+        similarities[mode] = similarity_percentages( counts.reshape( (-1, 4) ) )
+        results[mode] = dict(
+            seconds=seconds,
+            lections_per_second=len(lections_transcriptions)/seconds if seconds > 0 else float('inf'),
+        )
+
+    differences = np.abs( similarities['verses'] - similarities['lections'] )
+    differences = differences[~np.isnan(differences)]
+    results['mean_difference'] = float(differences.mean()) if len(differences) else 0.0
+    results['max_difference'] = float(differences.max()) if len(differences) else 0.0
+    return results
+
+
+def encoded_pair_lection_counts( texts_a, texts_b, lection_offsets, gotoh_param ):
+    """
+    Aligns the texts of two manuscripts (as EncodedTexts) verse by verse and sums the counts for each lection.
+
+    The verses of lection i are from `lection_offsets[i]` up to `lection_offsets[i+1]`.
+    The texts of each manuscript are decoded into strings for `gotoh.counts` once (see `EncodedTexts.decoded`) rather than for each pair of verses,
+    so aligning one manuscript with many others in the same process reuses its strings. Returns an integer array of shape (lections, 4).
+    """
+    both = (texts_a.lengths() > 0) & (texts_b.lengths() > 0)
+    strings_a = texts_a.decoded()
+    strings_b = texts_b.decoded()
+    counts = np.zeros( (len(lection_offsets) - 1, 4), dtype=np.int64 )
+    for lection_index in range(len(counts)):
+        for verse_index in np.flatnonzero( both[lection_offsets[lection_index]:lection_offsets[lection_index+1]] ) + lection_offsets[lection_index]:
+            counts[lection_index] += gotoh.counts( strings_a[verse_index], strings_b[verse_index], *gotoh_param )
+    return counts
+
+
+def encoded_self_lection_counts( texts, lection_offsets ):
+    """ Returns the counts from aligning EncodedTexts with themselves (i.e. every character matches) for each lection. """
+    cumulative_lengths = np.concatenate( [[0], np.cumsum( texts.lengths() )] )
+    counts = np.zeros( (len(lection_offsets) - 1, 4), dtype=np.int64 )
+    counts[:,0] = np.diff( cumulative_lengths[lection_offsets] )
+    return counts
+
+
+def similarity_percentages( counts ):
+    """ Returns the similarity percentage for each row of Gotoh counts (NaN where nothing was aligned). """
+    counts = np.asarray(counts)
+    length = counts.sum( axis=-1 )
+    with np.errstate( divide='ignore', invalid='ignore' ):
+        return np.where( length > 0, 100.0 * counts[...,0]/length, np.nan )
+
+
+def similarity_upper_bounds( transcriptions, comparison_count ):
+    """
+    Returns an upper bound for the similarity percentage of each comparison manuscript without aligning the texts.
+
+    The number of matches in an alignment cannot be more than the number of characters the two texts have in common (counted with multiplicity)
+    and the length of the alignment cannot be less than the length of the longer text.
+    The bound is NaN for manuscripts which do not have any text to align.
+    """
+    common = np.zeros( (comparison_count,), dtype=np.int64 )
+    longest = np.zeros( (comparison_count,), dtype=np.int64 )
+    for base_transcription, comparison_transcriptions in transcriptions:
+        if not base_transcription:
+            continue
+        base_characters = Counter( base_transcription )
+        for ms_index, comparison_transcription in enumerate(comparison_transcriptions):
+            if not comparison_transcription:
+                continue
+            common[ms_index] += sum( (base_characters & Counter( comparison_transcription )).values() )
+            longest[ms_index] += max( len(base_transcription), len(comparison_transcription) )
+
+    with np.errstate( divide='ignore', invalid='ignore' ):
+        return np.where( longest > 0, 100.0 * common/longest, np.nan )
+
+
+def best_match( transcriptions, comparison_count, gotoh_param, threshold=None, prune=True ):
+    """
+    Finds the comparison manuscript with the highest similarity over all the verses of a lection.
+
+    Ties go to the manuscript earlier in the list and a similarity must be greater than zero to count.
+    If `prune` is True then the upper bounds from `similarity_upper_bounds` are used to skip the alignments for manuscripts
+    which cannot beat the best similarity found so far or the threshold. This gives the same result as aligning every manuscript.
+
+    Returns a tuple with the index of the best manuscript, its similarity and the number of manuscripts aligned.
+    If `threshold` is given then the index is None unless the best similarity is greater than the threshold.
+    """
+    def exact_similarity( ms_index ):
+        ms_transcriptions = [
+            (base_transcription, [comparison_transcriptions[ms_index]]) if base_transcription else (None, [])
+            for base_transcription, comparison_transcriptions in transcriptions
+        ]
+        return similarity_percentages( verse_counts( ms_transcriptions, 1, gotoh_param ).sum( axis=0 ) )[0]
+
+    best_index = None
+    best_similarity = 0.0
+    aligned_count = 0
+
+    if prune:
+        bounds = similarity_upper_bounds( transcriptions, comparison_count )
+        candidates = sorted( (ms_index for ms_index in range(comparison_count) if not np.isnan(bounds[ms_index])), key=lambda ms_index: (-bounds[ms_index], ms_index) )
+    else:
+        candidates = range(comparison_count)
+
+    for ms_index in candidates:
+        if prune:
+            bound = bounds[ms_index]
+            if bound < best_similarity or (threshold is not None and bound <= threshold):
+                break
+            if bound == best_similarity and best_index is not None and ms_index > best_index:
+                continue
+
+        similarity = exact_similarity( ms_index )
+        aligned_count += 1
+        if similarity > best_similarity or (similarity == best_similarity and best_index is not None and ms_index < best_index):
+            best_index = ms_index
+            best_similarity = similarity
+
+    if threshold is not None and best_similarity <= threshold:
+        best_index = None
+
+    return best_index, best_similarity, aligned_count
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class DcodexLectionaryConfig(AppConfig):
     name = 'dcodex_lectionary'
+
+    def ready(self):
+        from . import signals
+        signals.connect_signals()
@@ -0,0 +1,49 @@
+"""
+Interchangeable implementations of the alignment which gives the Gotoh counts for pairs of transcriptions.
+
+Nothing in this module imports Django models so that the backends can be sent to worker processes.
+"""
+import numpy as np
+import gotoh
+
+
+class AlignmentBackend():
+    """
+    The interface for aligning pairs of texts.
+
+    Subclasses implement `counts` which aligns a list of pairs of strings in a single call.
+    """
+    name = None
+
+    def __str__(self):
+        return self.name
+
+    def counts( self, pairs, gotoh_param ):
+        """ Returns an integer array of shape (pairs, 4) with the number of matches, mismatches, gap openings and gap extensions for each pair of texts. """
+        raise NotImplementedError
+
+
+class GotohBackend(AlignmentBackend):
+    """ Aligns each pair of texts separately with `gotoh.counts`. """
+    name = 'gotoh'
+
+    def counts( self, pairs, gotoh_param ):
+        counts = np.zeros( (len(pairs), 4), dtype=np.int64 )
+        for pair_index, (text_a, text_b) in enumerate(pairs):
+            counts[pair_index] = gotoh.counts( text_a, text_b, *gotoh_param )
+        return counts
+
+
+BACKENDS = {
+    GotohBackend.name: GotohBackend,
+}
+
+
+def get_backend( backend=None ):
+    """ Returns an AlignmentBackend from an instance, the name of a backend in BACKENDS or None for the default `gotoh` backend. """
+    if isinstance( backend, AlignmentBackend ):
+        return backend
+    backend = backend or GotohBackend.name
+    if backend not in BACKENDS:
+        raise ValueError( f"Unknown alignment backend '{backend}'. Use one of: {', '.join(BACKENDS)}" )
+    return BACKENDS[backend]()
@@ -0,0 +1,176 @@
+"""
+Benchmarks of the similarity functions on synthetic lectionary systems.
+
+The synthetic data is committed before the stages are timed so that they run as they do in the views, with the batches fetched
+in a separate thread (which has its own database connection and would not see uncommitted rows). It is deleted again afterwards.
+"""
+import time
+import tracemalloc
+
+import pandas as pd
+from django.db import transaction
+from django.db.models import Max
+from django.test.utils import override_settings
+
+from .models import Lection, LectionaryVerse, LectionaryVerseMembership, LectionInSystem, LectionarySystem, Lectionary, TranscriptionsVersion, DEFAULT_LECTIONARY_VERSE_MASS
+from .synthetic import SyntheticTradition
+from . import alignment
+from .similarity import (
+    DEFAULT_GOTOH_PARAM,
+    LectionVerses,
+    lection_transcriptions,
+    similarity_counts,
+    score_similarity_counts,
+    similarity_probabilities_df,
+    similarity_dict,
+    pipeline_options,
+)
+
+
+def create_synthetic_system( tradition, name="Synthetic" ):
+    """
+    Creates a lectionary system with the lections of a SyntheticTradition and a Lectionary with the transcriptions of each of its manuscripts.
+
+    Returns the system and the list of manuscripts.
+    """
+    system = LectionarySystem.objects.create( name=name )
+    rank = (LectionaryVerse.objects.aggregate( Max('rank') )['rank__max'] or 0) + 1
+
+    lections_verses = []
+    for lection_index in range(tradition.lection_count):
+        lection = Lection.objects.create( description=f"{name} {lection_index + 1}" )
+        verses = []
+        for verse_index in range(tradition.verses_per_lection):
+            text = tradition.texts[0][lection_index][verse_index]
+            verse = LectionaryVerse.objects.create(
+                rank=rank,
+                unique_string=f"{name} {lection_index + 1}:{verse_index + 1}",
+                mass=len(text) if text else DEFAULT_LECTIONARY_VERSE_MASS,
+            )
+            rank += 1
+            LectionaryVerseMembership.objects.create( lection=lection, verse=verse, order=verse_index )
+            verses.append( verse )
+        lection.maintenance()
+        LectionInSystem.objects.create( system=system, lection=lection, order=lection_index )
+        lections_verses.append( verses )
+
+    mss = []
+    for ms_index, ms_texts in enumerate(tradition.texts):
+        ms = Lectionary.objects.create( name=f"{name} Lectionary {ms_index + 1}", siglum=f"{name} L{ms_index + 1}", system=system )
+        transcription_class = ms.transcription_class()
+        for lection_texts, verses in zip(ms_texts, lections_verses):
+            for text, verse in zip(lection_texts, verses):
+                if text:
+                    transcription_class.objects.create( manuscript=ms, verse=verse, transcription=text )
+        mss.append( ms )
+
+    return system, mss
+
+
+def delete_synthetic_system( system, mss ):
+    """ Deletes a lectionary system made by `create_synthetic_system` with its lections, verses, manuscripts and their transcriptions. """
+    lections = list(system.lections.all())
+    verse_ids = list(LectionaryVerseMembership.objects.filter( lection__in=lections ).values_list( 'verse_id', flat=True ))
+    for ms in mss:
+        ms.transcription_class().objects.filter( manuscript=ms ).delete()
+    # Deleting the transcriptions bumps the versions of the manuscripts so these are deleted afterwards
+    TranscriptionsVersion.objects.filter( manuscript__in=mss ).delete()
+    Lectionary.objects.filter( id__in=[ms.id for ms in mss] ).delete()
+    system.delete()
+    Lection.objects.filter( id__in=[lection.id for lection in lections] ).delete()
+    LectionaryVerse.objects.filter( id__in=verse_ids ).delete()
+
+
+def measure( function, *args, trace_memory=True, **kwargs ):
+    """
+    Calls a function once and returns a tuple with its result, the time in seconds and the peak memory in bytes allocated while it ran.
+
+    If `trace_memory` is True then the memory is traced with tracemalloc during the timed call, which slows down every allocation
+    so the times are longer than without tracing. Otherwise the peak memory is NaN.
+    The memory is only what Python allocates in this process: worker processes (with `n_jobs` above 1) and the fetch thread's database driver are not traced.
+    """
+    started_tracing = trace_memory and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    if trace_memory:
+        tracemalloc.reset_peak()
+        baseline, _ = tracemalloc.get_traced_memory()
+    try:
+        start = time.perf_counter()
+        result = function( *args, **kwargs )
+        seconds = time.perf_counter() - start
+        peak = float('nan')
+        if trace_memory:
+            _, peak = tracemalloc.get_traced_memory()
+            peak = max( 0, peak - baseline )
+    finally:
+        if started_tracing:
+            tracemalloc.stop()
+    return result, seconds, peak
+
+
+def benchmark_similarity( sizes=(10, 50), verses_per_lection=5, manuscript_count=4, variation_rate=0.05, seed=0, n_jobs=1, threshold=80.0, trace_memory=True ):
+    """
+    Times the stages of the similarity calculations on synthetic systems with each number of lections in `sizes`.
+
+    The first synthetic manuscript is the base and the others are the comparison manuscripts.
+    Returns a DataFrame with a row for each size and stage with the time, the number of pairs of verses compared,
+    the throughput in alignments per second, the peak memory of this process (see `measure`), whether the memory was traced during the timed call
+    and whether the batches of transcriptions were fetched in a separate thread (see `similarity.pipeline_options`).
+    """
+    records = []
+    for size in sizes:
+        tradition = SyntheticTradition( size, verses_per_lection, manuscript_count, variation_rate=variation_rate, seed=seed )
+        # The derived similarity data is updated in this thread so that no updates are still running on the job thread pool while the stages are timed
+        with override_settings( DCODEX_LECTIONARY_SIMILARITY_JOB_THREADS=0 ), transaction.atomic():
+            system, mss = create_synthetic_system( tradition, name=f"Synthetic {size}" )
+
+        try:
+            base_ms, comparison_mss = mss[0], mss[1:]
+            lections = [lection_in_system.lection for lection_in_system in system.lections_in_system().select_related( 'lection' )]
+            _, fetch_thread = pipeline_options()
+
+            def record( stage, seconds, peak, pair_count ):
+                records.append( dict(
+                    lections=size,
+                    verses=size * verses_per_lection,
+                    manuscripts=manuscript_count,
+                    stage=stage,
+                    seconds=seconds,
+                    alignments=pair_count,
+                    alignments_per_second=pair_count/seconds if seconds > 0 else float('nan'),
+                    peak_memory_mb=peak/2**20,
+                    memory_traced=trace_memory,
+                    fetch_thread=fetch_thread,
+                ) )
+
+            def load_transcriptions():
+                lection_verses = LectionVerses( system )
+                return [lection_transcriptions( base_ms, lection, comparison_mss, verses=lection_verses.verses[lection.id] ) for lection in lections]
+
+            transcriptions, seconds, peak = measure( load_transcriptions, trace_memory=trace_memory )
+            pair_count = sum( 1 for lection in transcriptions for _ in alignment.transcription_pairs( lection ) )
+            record( 'transcription loading', seconds, peak, pair_count )
+
+            _, seconds, peak = measure( alignment.lections_verse_counts, transcriptions, len(comparison_mss), DEFAULT_GOTOH_PARAM, trace_memory=trace_memory )
+            record( 'alignment', seconds, peak, pair_count )
+
+            counts, seconds, peak = measure( similarity_counts, system, base_ms, comparison_mss, n_jobs=n_jobs, trace_memory=trace_memory )
+            record( 'similarity_counts', seconds, peak, pair_count )
+
+            _, seconds, peak = measure( score_similarity_counts, counts, trace_memory=trace_memory )
+            record( 'scoring', seconds, peak, pair_count )
+
+            _, seconds, peak = measure( similarity_probabilities_df, system, base_ms, comparison_mss, n_jobs=n_jobs, trace_memory=trace_memory )
+            record( 'similarity_probabilities_df', seconds, peak, pair_count )
+
+            _, seconds, peak = measure( similarity_dict, base_ms, comparison_mss, system=system, n_jobs=n_jobs, trace_memory=trace_memory )
+            record( 'similarity_dict', seconds, peak, pair_count )
+
+            _, seconds, peak = measure( base_ms.lections_agreeing_with, comparison_mss, threshold, trace_memory=trace_memory )
+            record( 'lections_agreeing_with', seconds, peak, pair_count )
+        finally:
+            with override_settings( DCODEX_LECTIONARY_SIMILARITY_JOB_THREADS=0 ), transaction.atomic():
+                delete_synthetic_system( system, mss )
+
+    return pd.DataFrame( records )
@@ -0,0 +1,164 @@
+"""
+Change-point detection for series of similarities such as where a lectionary switches from one exemplar to another.
+
+The changes are in the mean of a multivariate series (one column for each comparison manuscript) which may have missing values.
+The segmentation is found with PELT (Killick, Fearnhead and Eckley 2012) which gives the optimal segmentation for a penalized cost
+and, with its pruning, takes close to linear time in the length of the series.
+Nothing in this module imports Django models.
+"""
+import numpy as np
+
+
+def normalized_ranks( values ):
+    """
+    Returns the rank of each value divided by the number of values, with tied values given the mean of their ranks.
+
+    Missing values (NaN) stay missing. Ranks bound the influence of outliers and do not depend on how the values are distributed,
+    which matters for similarities where many are tied at 100 and the rest have a long tail.
+    """
+    values = np.asarray( values, dtype=float )
+    ranks = np.full( values.shape, np.nan )
+    present = ~np.isnan( values )
+    if not present.any():
+        return ranks
+    _, inverse, counts = np.unique( values[present], return_inverse=True, return_counts=True )
+    mean_ranks = np.cumsum( counts ) - (counts - 1)/2
+    ranks[present] = mean_ranks[inverse]/present.sum()
+    return ranks
+
+
+def robust_scale( values ):
+    """
+    Estimates the standard deviation of the noise in a series with changes in the mean from the root mean square difference of consecutive values.
+
+    The few differences across the changes add little to the estimate, so it is close to the standard deviation of the noise
+    as long as the values are bounded (such as the ranks from `normalized_ranks`). Unlike the median absolute difference it is not zero when most values are tied.
+    Missing values (NaN) are skipped. Returns 1 if there are too few values or they do not vary.
+    """
+    values = np.asarray( values, dtype=float )
+    values = values[~np.isnan(values)]
+    if len(values) < 3:
+        return 1.0
+    scale = np.sqrt( np.mean( np.diff( values )**2 )/2 )
+    return float(scale) if scale > 0 else 1.0
+
+
+class MeanChangeCost():
+    """
+    The cost of a segment of a series is the sum over the columns of the squared differences from the mean of the column in that segment.
+
+    Missing values have no weight. The cumulative sums are computed once so that the cost of any segment takes constant time.
+    """
+    def __init__( self, series ):
+        series = np.asarray( series, dtype=float )
+        if series.ndim == 1:
+            series = series[:,None]
+        present = ~np.isnan( series )
+        values = np.where( present, series, 0.0 )
+
+        shape = (len(series) + 1, series.shape[1])
+        self.cumulative_weights = np.zeros( shape )
+        self.cumulative_values = np.zeros( shape )
+        self.cumulative_squares = np.zeros( shape )
+        np.cumsum( present, axis=0, out=self.cumulative_weights[1:] )
+        np.cumsum( values, axis=0, out=self.cumulative_values[1:] )
+        np.cumsum( values**2, axis=0, out=self.cumulative_squares[1:] )
+
+    def sums( self, starts, end ):
+        weights = self.cumulative_weights[end] - self.cumulative_weights[starts]
+        values = self.cumulative_values[end] - self.cumulative_values[starts]
+        squares = self.cumulative_squares[end] - self.cumulative_squares[starts]
+        return weights, values, squares
+
+    def cost( self, starts, end ):
+        """ Returns the cost of the segments from each of `starts` up to (but not including) `end`. """
+        weights, values, squares = self.sums( starts, end )
+        with np.errstate( divide='ignore', invalid='ignore' ):
+            costs = squares - np.where( weights > 0, values**2/weights, 0.0 )
+        return costs.sum( axis=-1 )
+
+    def mean( self, start, end ):
+        """ Returns the mean of each column over a segment (NaN for columns without any values). """
+        weights, values, _ = self.sums( start, end )
+        with np.errstate( divide='ignore', invalid='ignore' ):
+            return np.where( weights > 0, values/weights, np.nan )
+
+
+def pelt( cost, length, penalty, min_size=2 ):
+    """
+    Returns the sorted indexes where new segments begin in the optimal segmentation of a series of `length` values with PELT.
+
+    `cost` is a MeanChangeCost (or any object with a `cost(starts, end)` method where splitting a segment never increases the cost)
+    and each segment adds `penalty` to the total cost. Segments have at least `min_size` values.
+    """
+    best = np.full( (length + 1,), np.inf )
+    best[0] = -penalty
+    previous = np.zeros( (length + 1,), dtype=np.int64 )
+    candidates = np.zeros( (1,), dtype=np.int64 )
+
+    for end in range(1, length + 1):
+        admissible = end - candidates >= min_size
+        if admissible.any():
+            starts = candidates[admissible]
+            totals = best[starts] + cost.cost( starts, end )
+            index = np.argmin( totals )
+            best[end] = totals[index] + penalty
+            previous[end] = starts[index]
+
+            # A start point whose cost is already worse than the best can never be optimal for a later end
+            keep = np.ones( (len(candidates),), dtype=bool )
+            keep[admissible] = totals <= best[end]
+            candidates = candidates[keep]
+
+        candidates = np.append( candidates, end )
+
+    change_points = []
+    end = length
+    while end > 0 and np.isfinite( best[end] ):
+        end = int(previous[end])
+        if end > 0:
+            change_points.append( end )
+    return sorted( change_points )
+
+
+def detect_change_points( series, penalty=None, min_size=2, scale=True, ranks=True ):
+    """
+    Finds the changes in the mean of a series of shape (values, columns) where values may be missing (NaN).
+
+    If `ranks` is True then the changes are found in the `normalized_ranks` of each column, which keeps ties and outliers from being segmented on their own.
+    If `scale` is True then each column is divided by the noise estimated with `robust_scale`.
+    The default penalty is the BIC for a change in the means of all the columns: (columns + 1) times the log of the length of the series
+    (after scaling, which is when the penalty is comparable to the cost).
+
+    Returns a list with a dictionary for each change point with the `index` where the new segment starts,
+    the `score` which is the decrease in the cost from splitting the segments on either side at this point (in the units of the ranked and scaled series)
+    and the `before` and `after` means of each column in these segments (in the units of the original series).
+    """
+    series = np.asarray( series, dtype=float )
+    if series.ndim == 1:
+        series = series[:,None]
+    length, columns = series.shape
+    if length == 0:
+        return []
+
+    transformed = np.column_stack( [normalized_ranks( series[:,column] ) for column in range(columns)] ) if ranks else series
+    scales = np.array( [robust_scale( transformed[:,column] ) for column in range(columns)] ) if scale else np.ones( (columns,) )
+    if penalty is None:
+        penalty = (columns + 1) * np.log( max( length, 2 ) )
+
+    cost = MeanChangeCost( transformed/scales )
+    original = MeanChangeCost( series )
+    change_points = pelt( cost, length, penalty, min_size )
+
+    boundaries = [0] + change_points + [length]
+    results = []
+    for position, index in enumerate(change_points):
+        start, end = boundaries[position], boundaries[position + 2]
+        score = cost.cost( start, end ) - cost.cost( start, index ) - cost.cost( index, end )
+        results.append( dict(
+            index=index,
+            score=float(score),
+            before=original.mean( start, index ),
+            after=original.mean( index, end ),
+        ) )
+    return results
@@ -0,0 +1,119 @@
+"""
+Hierarchical clustering of manuscripts from their similarity profiles.
+
+A profile is a vector for each manuscript, such as its similarity with a set of reference manuscripts in each lection, where missing values are NaN.
+The distance between two manuscripts is the root mean square difference over the values both have, computed for all pairs with matrix products.
+Nothing in this module imports Django models.
+"""
+import numpy as np
+import pandas as pd
+from scipy.cluster import hierarchy
+from scipy.spatial.distance import squareform
+
+
+def profile_distances( profiles, min_overlap=1 ):
+    """
+    Returns the condensed distance matrix (as from `scipy.spatial.distance.pdist`) between the rows of `profiles`.
+
+    Each distance is the root mean square difference over the columns where neither row is missing.
+    Pairs with fewer than `min_overlap` columns in common have a distance of NaN.
+    """
+    profiles = np.asarray( profiles, dtype=float )
+    present = (~np.isnan( profiles )).astype( float )
+    values = np.where( present > 0, profiles, 0.0 )
+
+    # The sum of (x_i - x_j)^2 over the shared columns expands into three matrix products
+    overlap = present @ present.T
+    squares = (values**2) @ present.T
+    sum_squares = squares + squares.T - 2.0 * values @ values.T
+    with np.errstate( divide='ignore', invalid='ignore' ):
+        distances = np.sqrt( np.maximum( sum_squares, 0.0 )/overlap )
+    distances[overlap < max( min_overlap, 1 )] = np.nan
+    np.fill_diagonal( distances, 0.0 )
+    return squareform( distances, checks=False )
+
+
+def cluster_linkage( distances, method='average' ):
+    """
+    Returns the linkage matrix from hierarchical clustering of a condensed distance matrix with `scipy.cluster.hierarchy.linkage`.
+
+    Missing distances (between manuscripts without enough in common) are replaced by twice the largest distance so that those manuscripts are joined last.
+    """
+    distances = np.array( distances, dtype=float )
+    missing = np.isnan( distances )
+    if missing.any():
+        largest = distances[~missing].max() if (~missing).any() else 0.0
+        distances[missing] = 2.0 * largest if largest > 0 else 1.0
+    return hierarchy.linkage( distances, method=method )
+
+
+def cluster_assignments( linkage, cluster_count=None, threshold=None ):
+    """
+    Returns the cluster number (starting at 1) of each manuscript by cutting the dendrogram.
+
+    The dendrogram is cut into `cluster_count` clusters or, if that is not given, at the distance `threshold`.
+    """
+    if cluster_count is not None:
+        return hierarchy.fcluster( linkage, cluster_count, criterion='maxclust' )
+    if threshold is not None:
+        return hierarchy.fcluster( linkage, threshold, criterion='distance' )
+    raise ValueError( "Either the number of clusters or a distance threshold is needed." )
+
+
+def newick_label( label ):
+    """ Quotes a label for Newick format so that spaces, parentheses, colons and other punctuation in sigla are kept (quotes in the label are doubled). """
+    label = str(label).replace( "'", "''" )
+    return f"'{label}'"
+
+
+def newick( linkage, labels ):
+    """ Returns the dendrogram in Newick format with quoted labels and branch lengths from the linkage heights. """
+    def subtree( node, parent_height ):
+        if node.is_leaf():
+            return f"{newick_label( labels[node.id] )}:{parent_height:.6g}"
+        return f"({subtree( node.left, node.dist )},{subtree( node.right, node.dist )}):{parent_height - node.dist:.6g}"
+
+    root = hierarchy.to_tree( linkage )
+    return f"({subtree( root.left, root.dist )},{subtree( root.right, root.dist )});"
+
+
+class ProfileClustering():
+    """
+    Hierarchical clustering of the rows of an array of profiles of shape (manuscripts, values) with NaN for missing values.
+
+    `labels` names each manuscript (such as its siglum). The distances and linkage are computed once when the object is created
+    and the dendrogram can then be cut and exported in different ways.
+    """
+    def __init__( self, profiles, labels, method='average', min_overlap=1 ):
+        profiles = np.asarray( profiles, dtype=float )
+        self.labels = [str(label) for label in labels]
+        if len(self.labels) != len(profiles):
+            raise ValueError( f"There are {len(self.labels)} labels for {len(profiles)} profiles." )
+        if len(profiles) < 2:
+            raise ValueError( "At least two profiles are needed for clustering." )
+        self.method = method
+        self.distances = profile_distances( profiles.reshape( len(profiles), -1 ), min_overlap=min_overlap )
+        self.linkage = cluster_linkage( self.distances, method=method )
+
+    def __len__(self):
+        return len(self.labels)
+
+    def distance_matrix( self ):
+        """ Returns the distances as a square DataFrame indexed by the labels. """
+        return pd.DataFrame( squareform( self.distances, checks=False ), index=self.labels, columns=self.labels )
+
+    def assignments( self, cluster_count=None, threshold=None ):
+        """ Returns a DataFrame with the label and cluster of each manuscript in the order of the leaves of the dendrogram (see `cluster_assignments`). """
+        clusters = cluster_assignments( self.linkage, cluster_count=cluster_count, threshold=threshold )
+        order = hierarchy.leaves_list( self.linkage )
+        return pd.DataFrame( dict(
+            label=[self.labels[index] for index in order],
+            cluster=clusters[order],
+        ) )
+
+    def newick( self ):
+        return newick( self.linkage, self.labels )
+
+    def dendrogram( self, ax=None, **kwargs ):
+        """ Draws the dendrogram with `scipy.cluster.hierarchy.dendrogram` (on the matplotlib axes `ax` if given) and returns its dictionary. """
+        return hierarchy.dendrogram( self.linkage, labels=self.labels, ax=ax, **kwargs )
@@ -0,0 +1,231 @@
+"""
+Majority (consensus) texts reconstructed from a group of witnesses.
+
+Each verse is reconstructed by aligning every witness to a pivot text and voting on the reading at each position of the pivot with NumPy.
+The witnesses are aligned to the pivot together: the dynamic programming goes down the characters of the pivot
+and each row is computed for every character of every witness at once. The gaps along a row are found with a cumulative maximum.
+The alignments are scored with the Gotoh parameters in the same way as `gotoh.counts` (the first character of a gap is an opening and the rest are extensions).
+Nothing in this module imports Django models.
+"""
+from collections import Counter
+import numpy as np
+
+from .alignment import LECTION_SEPARATOR
+
+GAP = 0 # The code for a gap in the aligned readings. Code point 0 does not occur in the transcriptions.
+
+# The states of the cells in the alignment
+DIAGONAL, UP, LEFT = 0, 1, 2
+
+
+def code_points( text ):
+    return np.frombuffer( text.encode( 'utf-32-le' ), dtype=np.int32 )
+
+
+def align_to_pivot( pivot, witnesses, gotoh_param ):
+    """
+    Aligns each witness text to the pivot text with affine gap penalties and returns the readings of the witnesses at each position of the pivot.
+
+    Returns an integer array of shape (witnesses, pivot length) with the code point of the character of each witness aligned to each character of the pivot
+    (GAP where the witness omits it) and a list for each witness of the text it inserts before each position of the pivot (with one more slot for the end).
+    """
+    match, mismatch, gap_open, gap_extend = (float(value) for value in gotoh_param)
+    pivot_codes = code_points( pivot )
+    pivot_length = len(pivot_codes)
+    witness_count = len(witnesses)
+    lengths = np.array( [len(witness) for witness in witnesses], dtype=np.int64 )
+    width = int(lengths.max( initial=0 )) + 1
+
+    witness_codes = np.full( (witness_count, width), -1, dtype=np.int32 )
+    for witness_index, witness in enumerate(witnesses):
+        witness_codes[witness_index,1:lengths[witness_index]+1] = code_points( witness )
+
+    columns = np.arange( width )
+    gap_scores = np.where( columns > 0, gap_open + (columns - 1) * gap_extend, 0.0 )
+
+    # The state of each cell, the state of the best path to it which does not end in a gap along the witness,
+    # whether the gaps down the pivot are extended and where the gaps along the witnesses start
+    state = np.zeros( (pivot_length + 1, witness_count, width), dtype=np.uint8 )
+    best_states = np.zeros( (pivot_length + 1, witness_count, width), dtype=np.uint8 )
+    up_extends = np.zeros( (pivot_length + 1, witness_count, width), dtype=bool )
+    left_starts = np.zeros( (pivot_length + 1, witness_count, width), dtype=np.int32 )
+    state[0,:,1:] = LEFT
+    state[1:,:,0] = UP
+    best_states[1:,:,0] = UP
+    up_extends[2:,:,0] = True
+
+    scores = np.broadcast_to( gap_scores, (witness_count, width) ).copy()
+    up_scores = np.full( (witness_count, width), -np.inf )
+    for i in range(1, pivot_length + 1):
+        previous = scores
+        diagonal_scores = np.full( (witness_count, width), -np.inf )
+        diagonal_scores[:,1:] = previous[:,:-1] + np.where( witness_codes[:,1:] == pivot_codes[i-1], match, mismatch )
+
+        extended = up_scores + gap_extend
+        opened = previous + gap_open
+        up_extends[i,:,1:] = (extended > opened)[:,1:]
+        up_scores = np.maximum( extended, opened )
+        up_scores[:,0] = gap_open + (i - 1) * gap_extend
+
+        # The best score which does not end in a gap along the witness
+        best = np.maximum( diagonal_scores, up_scores )
+        best_states[i] = np.where( diagonal_scores >= up_scores, DIAGONAL, UP )
+        best_states[i,:,0] = UP
+
+        # A gap along the witness from column k to column j scores best[k] + gap_open + (j - k - 1) * gap_extend
+        shifted = best - columns * gap_extend
+        running = np.maximum.accumulate( shifted, axis=1 )
+        starts = np.maximum.accumulate( np.where( shifted >= running, columns, 0 ), axis=1 )
+        left_scores = np.full( (witness_count, width), -np.inf )
+        left_scores[:,1:] = running[:,:-1] + gap_open + (columns[1:] - 1) * gap_extend
+        left_starts[i,:,1:] = starts[:,:-1]
+
+        scores = np.maximum( best, left_scores )
+        state[i] = np.where( left_scores > best, LEFT, best_states[i] )
+
+    readings = np.full( (witness_count, pivot_length), GAP, dtype=np.int32 )
+    insertions = []
+    for witness_index in range(witness_count):
+        witness_insertions = [""] * (pivot_length + 1)
+        i, j = pivot_length, int(lengths[witness_index])
+        current = state[i, witness_index, j]
+        while i > 0 or j > 0:
+            if i == 0:
+                current = LEFT
+            if current == DIAGONAL:
+                readings[witness_index, i-1] = witness_codes[witness_index, j]
+                i, j = i - 1, j - 1
+                current = state[i, witness_index, j]
+            elif current == UP:
+                extends = up_extends[i, witness_index, j]
+                i -= 1
+                current = UP if extends else state[i, witness_index, j]
+            else:
+                start = int(left_starts[i, witness_index, j]) if i > 0 else 0
+                witness_insertions[i] = witnesses[witness_index][start:j] + witness_insertions[i]
+                j = start
+                current = best_states[i, witness_index, j]
+        insertions.append( witness_insertions )
+
+    return readings, insertions
+
+
+def majority_readings( readings, tie_breaker=None ):
+    """
+    Returns the most common code in each column of an array of shape (witnesses, positions) and the number of witnesses with it.
+
+    Ties go to the reading of the witness with the index `tie_breaker` if it is given and otherwise to the lowest code.
+    """
+    witness_count, position_count = readings.shape
+    unique_codes, indexes = np.unique( readings, return_inverse=True )
+    indexes = indexes.reshape( readings.shape )
+    votes = np.zeros( (position_count, len(unique_codes)) )
+    np.add.at( votes, (np.broadcast_to( np.arange( position_count ), readings.shape ), indexes), 1.0 )
+    if tie_breaker is not None:
+        votes[np.arange( position_count ), indexes[tie_breaker]] += 0.5
+    majority = np.argmax( votes, axis=1 )
+    return unique_codes[majority], np.floor( votes[np.arange( position_count ), majority] ).astype( np.int64 )
+
+
+class VerseConsensus():
+    """
+    The majority text of the witnesses of a verse and how well they agree with it.
+
+    `witness_agreement` has the fraction of the positions of the pivot where each witness has the majority reading (NaN for witnesses without the verse).
+    `agreement` is the mean fraction of the witnesses with the majority reading at each position and `unanimity` is the fraction of positions where they all agree.
+    The statistics are over the positions of the pivot. Insertions are voted on as a whole in each slot between them.
+    """
+    def __init__( self, text, witness_count, position_count=0, agreement=np.nan, unanimity=np.nan, witness_agreement=None ):
+        self.text = text
+        self.witness_count = witness_count
+        self.position_count = position_count
+        self.agreement = agreement
+        self.unanimity = unanimity
+        self.witness_agreement = witness_agreement
+
+    def __str__(self):
+        return self.text or ""
+
+
+def verse_consensus( texts, gotoh_param, pivot_index=None, iterations=1 ):
+    """
+    Reconstructs the majority text of a verse from the texts of the witnesses (where None is a missing text).
+
+    The pivot is the witness at `pivot_index` or, by default, the witness with the median length. After the first iteration
+    the consensus of the previous iteration is the pivot, which lessens the dependence on the choice of the first pivot.
+    Returns a VerseConsensus (with None for the text if no witness has the verse).
+    """
+    present = np.array( [bool(text) for text in texts], dtype=bool )
+    witness_agreement = np.full( (len(texts),), np.nan )
+    if not present.any():
+        return VerseConsensus( None, 0, witness_agreement=witness_agreement )
+
+    witnesses = [text for text in texts if text]
+    if pivot_index is None:
+        lengths = np.array( [len(text) for text in witnesses] )
+        tie_breaker = int(np.argsort( lengths, kind='stable' )[(len(lengths) - 1)//2])
+    else:
+        if not texts[pivot_index]:
+            raise ValueError( "The pivot witness does not have a text." )
+        tie_breaker = int(np.count_nonzero( present[:pivot_index] ))
+    pivot = witnesses[tie_breaker]
+
+    for _ in range(max( iterations, 1 )):
+        readings, insertions = align_to_pivot( pivot, witnesses, gotoh_param )
+        majority, votes = majority_readings( readings, tie_breaker )
+
+        slots = []
+        for slot in range(len(pivot) + 1):
+            slot_insertions = Counter( witness_insertions[slot] for witness_insertions in insertions )
+            if tie_breaker is not None:
+                slot_insertions[insertions[tie_breaker][slot]] += 0.5
+            slots.append( slot_insertions.most_common( 1 )[0][0] )
+
+        text = "".join( slot + (chr(code) if code != GAP else "") for slot, code in zip(slots, majority) ) + slots[-1]
+        pivot, tie_breaker = text, None
+
+    agrees = readings == majority
+    witness_agreement[present] = agrees.mean( axis=1 ) if len(majority) else 1.0
+    return VerseConsensus(
+        text=text,
+        witness_count=len(witnesses),
+        position_count=len(majority),
+        agreement=float(np.mean( votes/len(witnesses) )) if len(majority) else 1.0,
+        unanimity=float(np.mean( votes == len(witnesses) )) if len(majority) else 1.0,
+        witness_agreement=witness_agreement,
+    )
+
+
+class LectionConsensus():
+    """
+    The majority texts of the verses of a lection.
+
+    `text` joins the consensus of the verses with LECTION_SEPARATOR. The statistics are the means over the verses weighted by their number of positions.
+    """
+    def __init__( self, verses, separator=LECTION_SEPARATOR ):
+        self.verses = list(verses)
+        self.text = separator.join( verse.text for verse in self.verses if verse.text )
+
+        weights = np.array( [verse.position_count for verse in self.verses], dtype=float )
+        self.position_count = int(weights.sum())
+        self.witness_count = max( [verse.witness_count for verse in self.verses], default=0 )
+        if self.position_count:
+            self.agreement = float(np.average( [verse.agreement for verse in self.verses], weights=weights ))
+            self.unanimity = float(np.average( [verse.unanimity for verse in self.verses], weights=weights ))
+            witness_agreement = np.array( [verse.witness_agreement for verse in self.verses] )
+            witness_weights = np.where( np.isnan( witness_agreement ), 0.0, weights[:,None] )
+            with np.errstate( divide='ignore', invalid='ignore' ):
+                self.witness_agreement = np.nansum( witness_agreement * witness_weights, axis=0 )/witness_weights.sum( axis=0 )
+            self.witness_agreement[witness_weights.sum( axis=0 ) == 0] = np.nan
+        else:
+            self.agreement = np.nan
+            self.unanimity = np.nan
+            self.witness_agreement = None
+
+    def __str__(self):
+        return self.text
+
+
+def lection_consensus( verses_texts, gotoh_param, iterations=1, separator=LECTION_SEPARATOR ):
+    """ Reconstructs the majority text of a lection from a list with the texts of the witnesses for each verse (see `verse_consensus`). """
+    return LectionConsensus( [verse_consensus( texts, gotoh_param, iterations=iterations ) for texts in verses_texts], separator=separator )
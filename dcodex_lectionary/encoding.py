@@ -0,0 +1,120 @@
+"""
+Compact integer encodings of normalized transcriptions.
+
+The texts of a manuscript are held as one contiguous array of character codes with an array of offsets to the start of each text,
+rather than as a Python string for each verse. Slicing gives views of the same array so nothing is copied,
+the arrays can be saved and memory-mapped and they are much cheaper to send to worker processes than lists of strings.
+Nothing in this module imports Django models.
+"""
+import os
+import numpy as np
+
+MAX_ALPHABET_SIZE = np.iinfo( np.uint16 ).max + 1
+
+
+class EncodedTexts():
+    """
+    A sequence of texts encoded as indexes into an alphabet.
+
+    `codes` is a uint8 array (or uint16 if the alphabet has more than 256 characters) with the codes of all the texts one after the other.
+    The characters of text i are `codes[offsets[i]:offsets[i+1]]`. Missing texts are empty.
+    """
+    def __init__( self, codes, offsets, alphabet ):
+        self.codes = codes
+        self.offsets = offsets
+        self.alphabet = alphabet
+        self.code_points = np.array( [ord(character) for character in alphabet], dtype=np.uint32 )
+        self._decoded = None
+
+    def __getstate__( self ):
+        """ The decoded strings are not pickled so that only the arrays are sent to worker processes. """
+        state = self.__dict__.copy()
+        state['_decoded'] = None
+        return state
+
+    @classmethod
+    def from_texts( cls, texts, alphabet=None ):
+        """ Encodes a list of strings (where None is a missing text). The alphabet is the sorted characters of the texts unless it is given. """
+        texts = [text or "" for text in texts]
+        if alphabet is None:
+            alphabet = "".join( sorted( set().union( *texts ) ) )
+        if len(alphabet) > MAX_ALPHABET_SIZE:
+            raise ValueError( f"An alphabet of {len(alphabet)} characters is too large to encode." )
+        dtype = np.uint8 if len(alphabet) <= 256 else np.uint16
+
+        offsets = np.zeros( (len(texts) + 1,), dtype=np.int64 )
+        np.cumsum( [len(text) for text in texts], out=offsets[1:] )
+
+        code_points = np.frombuffer( "".join( texts ).encode( 'utf-32-le' ), dtype=np.uint32 )
+        alphabet_code_points = np.array( [ord(character) for character in alphabet], dtype=np.uint32 )
+        sorter = np.argsort( alphabet_code_points )
+        positions = np.searchsorted( alphabet_code_points, code_points, sorter=sorter )
+        positions = np.minimum( positions, max( len(alphabet) - 1, 0 ) )
+        if len(code_points) and not np.array_equal( alphabet_code_points[sorter][positions], code_points ):
+            raise ValueError( "The texts have characters which are not in the alphabet." )
+
+        return cls( sorter[positions].astype( dtype ), offsets, alphabet )
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__( self, index ):
+        """ Returns a view of the codes of a text. """
+        return self.codes[self.offsets[index]:self.offsets[index+1]]
+
+    def lengths( self ):
+        return np.diff( self.offsets )
+
+    def text( self, index ):
+        """ Decodes a text into a string (or None if it is missing). """
+        codes = self[index]
+        if len(codes) == 0:
+            return None
+        return self.code_points[codes].tobytes().decode( 'utf-32-le' )
+
+    def texts( self ):
+        return [self.text( index ) for index in range(len(self))]
+
+    def decoded( self ):
+        """
+        Returns a list with each text decoded into a string (or None if it is missing).
+
+        All the texts are decoded in one call and the list is kept so that aligning these texts with those of several other manuscripts only decodes them once.
+        """
+        if self._decoded is None:
+            start = self.offsets[0]
+            text = self.code_points[self.codes[start:self.offsets[-1]]].tobytes().decode( 'utf-32-le' )
+            bounds = (self.offsets - start).tolist()
+            self._decoded = [text[text_start:text_end] or None for text_start, text_end in zip(bounds[:-1], bounds[1:])]
+        return self._decoded
+
+    def slice( self, start, stop ):
+        """ Returns the texts from `start` up to `stop` as EncodedTexts which share the array of codes. """
+        return EncodedTexts( self.codes, self.offsets[start:stop+1], self.alphabet )
+
+    def __eq__( self, other ):
+        """ Texts are equal if they have the same characters, even if they are encoded with different alphabets. """
+        if not isinstance( other, EncodedTexts ):
+            return NotImplemented
+        if not np.array_equal( self.lengths(), other.lengths() ):
+            return False
+        codes = self.codes[self.offsets[0]:self.offsets[-1]]
+        other_codes = other.codes[other.offsets[0]:other.offsets[-1]]
+        return np.array_equal( self.code_points[codes], other.code_points[other_codes] )
+
+    def save( self, directory ):
+        """ Saves the arrays and alphabet into a directory so that they can be loaded with `load`. """
+        os.makedirs( directory, exist_ok=True )
+        np.save( os.path.join( directory, "codes.npy" ), self.codes[self.offsets[0]:self.offsets[-1]] )
+        np.save( os.path.join( directory, "offsets.npy" ), self.offsets - self.offsets[0] )
+        with open( os.path.join( directory, "alphabet.txt" ), "w", encoding="utf-8" ) as file:
+            file.write( self.alphabet )
+
+    @classmethod
+    def load( cls, directory, mmap_mode='r' ):
+        """ Loads texts saved with `save`. By default the arrays are memory-mapped rather than read into memory. """
+        with open( os.path.join( directory, "alphabet.txt" ), encoding="utf-8" ) as file:
+            alphabet = file.read()
+        codes = np.load( os.path.join( directory, "codes.npy" ), mmap_mode=mmap_mode )
+        offsets = np.load( os.path.join( directory, "offsets.npy" ), mmap_mode=mmap_mode )
+        return cls( codes, offsets, alphabet )
@@ -0,0 +1,114 @@
+"""
+Fitting the parameters for scoring similarities from Gotoh counts which have already been computed.
+
+Nothing in this module imports Django so that it can be used on counts from anywhere.
+"""
+import time
+import numpy as np
+from scipy.optimize import minimize
+from scipy.special import expit
+from scipy.stats import rankdata
+
+from . import alignment
+
+
+def logistic_loss( parameters, counts, labels, l2=0.0, fit_prior=False, prior_log_odds=0.0 ):
+    """
+    Returns the negative log likelihood of the labels and its gradient for the logistic model used in `similarity_and_probability_arrays`.
+
+    `parameters` has the four weights followed by the prior log odds if `fit_prior` is True. Otherwise `prior_log_odds` is kept fixed.
+    `counts` is an array of shape (samples, 4) and `labels` is an array of zeros and ones.
+    The weights (but not the prior) are penalized by `l2` times half their squared norm.
+    """
+    weights = parameters[:4]
+    if fit_prior:
+        prior_log_odds = parameters[4]
+
+    log_odds = prior_log_odds + counts @ weights
+    loss = np.sum( np.logaddexp( 0.0, log_odds ) - labels * log_odds ) + 0.5 * l2 * weights @ weights
+
+    residuals = expit( log_odds ) - labels
+    gradient = counts.T @ residuals + l2 * weights
+    if fit_prior:
+        gradient = np.append( gradient, residuals.sum() )
+    return loss, gradient
+
+
+def fit_logistic_weights( counts, labels, l2=0.0, fit_prior=False, initial_weights=None, initial_prior_log_odds=0.0 ):
+    """
+    Fits the logistic weights for the similarity probabilities to labelled Gotoh counts.
+
+    `counts` is an array of shape (samples, 4) with the total matches, mismatches, gap openings and gap extensions for a lection
+    and `labels` is 1 where the manuscripts are affiliated in the lection and 0 where they are not.
+
+    If `fit_prior` is False then the prior log odds are kept at `initial_prior_log_odds`.
+
+    Returns a tuple of the weights, the prior log odds and the result from `scipy.optimize.minimize`.
+    """
+    counts = np.asarray( counts, dtype=float )
+    labels = np.asarray( labels, dtype=float )
+    initial = np.zeros( (4,) ) if initial_weights is None else np.asarray( initial_weights, dtype=float )
+    if fit_prior:
+        initial = np.append( initial, initial_prior_log_odds )
+
+    result = minimize( logistic_loss, initial, args=(counts, labels, l2, fit_prior, initial_prior_log_odds), jac=True, method='L-BFGS-B' )
+
+    weights = result.x[:4]
+    prior_log_odds = result.x[4] if fit_prior else initial_prior_log_odds
+    return weights, prior_log_odds, result
+
+
+def roc_auc( scores, labels ):
+    """ Returns the area under the ROC curve: the probability that a random positive example scores higher than a random negative one (ties count half). """
+    scores = np.asarray( scores, dtype=float )
+    labels = np.asarray( labels ).astype( bool )
+    positives = labels.sum()
+    negatives = len(labels) - positives
+    if positives == 0 or negatives == 0:
+        return np.nan
+    ranks = rankdata( scores )
+    return (ranks[labels].sum() - 0.5 * positives * (positives + 1))/(positives * negatives)
+
+
+def separation_metrics( counts, labels, weights, prior_log_odds=0.0 ):
+    """
+    Returns a dictionary with measures of how well the similarity and probability from Gotoh counts separate labelled affiliations.
+
+    `similarity_auc` and `probability_auc` are the areas under the ROC curves, `separation` is the difference between the mean similarity
+    of the affiliated and unaffiliated examples divided by the pooled standard deviation, `log_loss` is the mean negative log likelihood
+    of the labels and `accuracy` is the fraction of labels which the probability predicts with a threshold of one half.
+    """
+    counts = np.asarray( counts, dtype=float )
+    labels = np.asarray( labels ).astype( bool )
+    similarity = alignment.similarity_percentages( counts )
+    log_odds = prior_log_odds + counts @ np.asarray( weights, dtype=float )
+
+    affiliated = similarity[labels]
+    unaffiliated = similarity[~labels]
+    pooled_std = np.sqrt( 0.5 * (affiliated.var() + unaffiliated.var()) ) if len(affiliated) and len(unaffiliated) else np.nan
+    return dict(
+        similarity_auc=roc_auc( similarity, labels ),
+        probability_auc=roc_auc( log_odds, labels ),
+        separation=(affiliated.mean() - unaffiliated.mean())/pooled_std if pooled_std > 0 else np.nan,
+        log_loss=float(np.mean( np.logaddexp( 0.0, log_odds ) - labels * log_odds )) if len(labels) else np.nan,
+        accuracy=float(np.mean( (log_odds > 0) == labels )) if len(labels) else np.nan,
+    )
+
+
+def labelled_counts( groups, positions, gotoh_param, backend=None ):
+    """
+    Aligns the transcriptions of labelled examples with one set of Gotoh parameters.
+
+    `groups` is a list of tuples with the transcriptions of a list of lections (as for `alignment.lections_verse_counts`) and the number of comparison manuscripts.
+    `positions` has a tuple of the group, lection and comparison manuscript indexes for each example.
+    Returns an integer array of shape (examples, 4) with the total counts for each example and the time taken in seconds.
+    """
+    start = time.perf_counter()
+    groups_totals = [
+        [counts.sum( axis=0 ) for counts in alignment.lections_verse_counts( lections_transcriptions, comparison_count, gotoh_param, backend=backend )]
+        for lections_transcriptions, comparison_count in groups
+    ]
+    counts = np.zeros( (len(positions), 4), dtype=np.int64 )
+    for example_index, (group_index, lection_index, ms_index) in enumerate(positions):
+        counts[example_index] = groups_totals[group_index][lection_index][ms_index]
+    return counts, time.perf_counter() - start
@@ -0,0 +1,153 @@
+"""
+Runs similarity computations in the background and records their progress in SimilarityJob objects.
+
+By default the jobs are run on a thread pool in the web server process.
+If DCODEX_LECTIONARY_SIMILARITY_JOB_THREADS is set to 0 then the jobs are left pending for the 'run-similarity-jobs' management command.
+The updates of the derived similarity data when a transcription is saved are queued on the same pool (see `signals.update_derived_similarity`).
+Finished jobs are deleted after DCODEX_LECTIONARY_FINISHED_JOB_SECONDS (a week by default) when new jobs are submitted or run.
+"""
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache as django_cache
+from django.db import connection
+from django.utils import timezone
+
+from .models import SimilarityJob
+from .similarity import similarity_cache_key, similarity_cache_timeout, similarity_dict, similarity_lection_counts
+
+STALE_JOB_SECONDS = 60*60
+
+_executor = None
+
+
+def job_threads():
+    return getattr( settings, "DCODEX_LECTIONARY_SIMILARITY_JOB_THREADS", 1 )
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor( max_workers=job_threads(), thread_name_prefix="dcodex-lectionary-similarity" )
+    return _executor
+
+
+def stale_pending_job_seconds():
+    return getattr( settings, "DCODEX_LECTIONARY_STALE_PENDING_JOB_SECONDS", 10*60 )
+
+
+def finished_job_seconds():
+    return getattr( settings, "DCODEX_LECTIONARY_FINISHED_JOB_SECONDS", 7*24*60*60 )
+
+
+def prune_finished_jobs():
+    """ Deletes the jobs which finished more than `finished_job_seconds` ago (if it is not None) and returns the number deleted. """
+    seconds = finished_job_seconds()
+    if seconds is None:
+        return 0
+    return SimilarityJob.prune( timezone.now() - timedelta(seconds=seconds) )
+
+
+def is_stale( job ):
+    """ Returns True if a running job has not reported progress for STALE_JOB_SECONDS or a pending job on the thread pool has not started in time. """
+    if job.status == SimilarityJob.RUNNING:
+        return job.updated < timezone.now() - timedelta(seconds=STALE_JOB_SECONDS)
+    if job.status == SimilarityJob.PENDING and job_threads() > 0:
+        return job.updated < timezone.now() - timedelta(seconds=stale_pending_job_seconds())
+    return False
+
+
+def submit_similarity_job( kind, system, base_ms, comparison_mss, **parameters ):
+    """
+    Returns a job which computes a similarity result for these manuscripts and parameters.
+
+    An existing job with the same cache key is reused unless it has failed or is stale: a running job which has stopped reporting progress
+    or, when the jobs are run on the thread pool, a pending job which has not started (for example because the server restarted before it ran).
+    Otherwise a new job is created and started on the thread pool (if there is one).
+    """
+    key = similarity_cache_key( kind, system, base_ms, comparison_mss, **parameters )
+    job = SimilarityJob.objects.filter( key=key ).exclude( status=SimilarityJob.FAILED ).first()
+    if job and is_stale( job ):
+        # The update is conditional so that a job which has just been claimed or has progressed is not marked as failed
+        failed = SimilarityJob.objects.filter( id=job.id, status=job.status, updated=job.updated ).update(
+            status=SimilarityJob.FAILED,
+            error="The job stopped reporting progress." if job.status == SimilarityJob.RUNNING else "The job was never started.",
+            updated=timezone.now(),
+        )
+        if failed:
+            job = None
+
+    if job:
+        return job
+
+    prune_finished_jobs()
+    job = SimilarityJob.objects.create(
+        kind=kind,
+        key=key,
+        system=system,
+        base_ms=base_ms,
+        comparison_sigla=",".join( ms.siglum for ms in comparison_mss ),
+        parameters=parameters,
+    )
+    if job_threads() > 0:
+        get_executor().submit( run_similarity_job_in_thread, job.id )
+    return job
+
+
+def run_similarity_job_in_thread( job_id ):
+    try:
+        run_similarity_job( SimilarityJob.objects.get( id=job_id ) )
+    finally:
+        connection.close()
+
+
+def run_similarity_job( job ):
+    """
+    Computes the result of a job, saves it to the job and to the Django cache and then marks the job as done (or failed).
+
+    Nothing is done if the job has already been claimed by another thread or process.
+    The alignments are looked up in and added to the GotohCounts table so that jobs with different parameters only align the new pairs of texts.
+    """
+    if not SimilarityJob.objects.filter( id=job.id, status=SimilarityJob.PENDING ).update( status=SimilarityJob.RUNNING, updated=timezone.now() ):
+        return job
+    job.status = SimilarityJob.RUNNING
+
+    comparison_mss = job.comparison_mss()
+    try:
+        parameters = {'cache': True, **job.parameters}
+        if job.kind == SimilarityJob.SIMILARITY_DICT:
+            result = similarity_dict( job.base_ms, comparison_mss, system=job.system, progress=job.set_progress, **parameters )
+            job.result = {
+                str(lection_in_system.id): [similarities[ms] for ms in comparison_mss]
+                for lection_in_system, similarities in result.items()
+            }
+        elif job.kind == SimilarityJob.LECTION_COUNTS:
+            result = similarity_lection_counts( job.system, job.base_ms, comparison_mss, progress=job.set_progress, **parameters )
+            lections_in_system, lection_counts = result
+            job.result = dict(
+                lections_in_system=[lection_in_system.id for lection_in_system in lections_in_system],
+                counts=lection_counts.tolist(),
+            )
+        else:
+            raise ValueError( f"Unknown kind of similarity job '{job.kind}'." )
+
+        django_cache.set( job.key, result, timeout=similarity_cache_timeout() )
+        job.status = SimilarityJob.DONE
+    except Exception:
+        job.status = SimilarityJob.FAILED
+        job.error = traceback.format_exc()
+
+    job.save()
+    return job
+
+
+def run_pending_jobs():
+    """ Runs all the pending jobs in this process and returns the number of jobs run. """
+    prune_finished_jobs()
+    count = 0
+    for job in SimilarityJob.objects.filter( status=SimilarityJob.PENDING ).order_by( 'created' ):
+        run_similarity_job( job )
+        count += 1
+    return count
@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand, CommandError
+from dcodex.models import Manuscript
+from dcodex_lectionary import alignment
+from dcodex_lectionary.models import LectionarySystem
+from dcodex_lectionary.similarity import get_system, lection_transcriptions, DEFAULT_GOTOH_PARAM
+
+class Command(BaseCommand):
+    help = 'Times aligning lections verse by verse and as whole lections and compares the similarities from the two modes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('base', type=str, help="The siglum of the base manuscript.")
+        parser.add_argument('comparison', type=str, nargs='+', help="The sigla of the comparison manuscripts.")
+        parser.add_argument('--system', type=str, help="The name of the lectionary system (e.g. one of the Apostolos systems). Default: the system of the manuscripts.")
+        parser.add_argument('--lections', type=int, default=50, help="The number of lections of the system to align.")
+        parser.add_argument('--repeat', type=int, default=3, help="The number of times to time each mode. The best time is reported.")
+        parser.add_argument('--separator', type=str, default=alignment.LECTION_SEPARATOR, help="The text which joins the verses of a lection.")
+
+    def handle(self, *args, **options):
+        base_ms = Manuscript.find( options['base'] )
+        comparison_mss = [Manuscript.find( siglum ) for siglum in options['comparison']]
+        if base_ms is None or None in comparison_mss:
+            raise CommandError( "Cannot find all the manuscripts." )
+
+        if options['system']:
+            system = LectionarySystem.objects.filter( name=options['system'] ).first()
+            if system is None:
+                raise CommandError( f"Cannot find lectionary system '{options['system']}'." )
+        else:
+            system = get_system( base_ms, comparison_mss )
+
+        lections = [lection_in_system.lection for lection_in_system in system.lections_in_system().all()[:options['lections']]]
+        lections_transcriptions = [lection_transcriptions( base_ms, lection, comparison_mss ) for lection in lections]
+        self.stdout.write( f"Aligning {len(lections)} lections of {system} with {len(comparison_mss)} manuscripts." )
+
+        results = alignment.benchmark_alignment_modes(
+            lections_transcriptions,
+            len(comparison_mss),
+            DEFAULT_GOTOH_PARAM,
+            separator=options['separator'],
+            repeat=options['repeat'],
+        )
+        for mode in ('verses', 'lections'):
+            self.stdout.write( f"{mode}: {results[mode]['seconds']:.3f}s, {results[mode]['lections_per_second']:.1f} lections/s" )
+        self.stdout.write( f"Similarity difference: mean {results['mean_difference']:.2f}%, max {results['max_difference']:.2f}%" )
@@ -0,0 +1,34 @@
+import pandas as pd
+from django.core.management.base import BaseCommand, CommandError
+from dcodex_lectionary.benchmarks import benchmark_similarity
+
+class Command(BaseCommand):
+    help = 'Times the similarity functions on synthetic lectionary systems. The synthetic data is removed afterwards.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[10, 50, 200], help="The numbers of lections in the synthetic systems.")
+        parser.add_argument('--verses-per-lection', type=int, default=5, help="The number of verses in each lection.")
+        parser.add_argument('--manuscripts', type=int, default=4, help="The number of synthetic manuscripts (the first is the base manuscript).")
+        parser.add_argument('--variation-rate', type=float, default=0.05, help="The probability that a word varies between the families of manuscripts.")
+        parser.add_argument('--seed', type=int, default=0, help="The seed for the random texts.")
+        parser.add_argument('--n-jobs', type=int, default=1, help="The number of processes for the alignments.")
+        parser.add_argument('--no-memory', action='store_true', help="Does not trace the peak memory (of this process only, not the worker processes) while timing each stage. Tracing makes the times longer.")
+        parser.add_argument('--output', type=str, default=None, help="A path to save the results as CSV.")
+
+    def handle(self, *args, **options):
+        if options['manuscripts'] < 2:
+            raise CommandError( "At least two manuscripts are needed." )
+
+        df = benchmark_similarity(
+            sizes=options['sizes'],
+            verses_per_lection=options['verses_per_lection'],
+            manuscript_count=options['manuscripts'],
+            variation_rate=options['variation_rate'],
+            seed=options['seed'],
+            n_jobs=options['n_jobs'],
+            trace_memory=not options['no_memory'],
+        )
+        with pd.option_context( 'display.max_rows', None, 'display.width', 200 ):
+            self.stdout.write( str(df) )
+        if options['output']:
+            df.to_csv( options['output'], index=False )
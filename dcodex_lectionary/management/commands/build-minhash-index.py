@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand, CommandError
+from dcodex.models import Manuscript
+from dcodex_lectionary.models import LectionarySystem
+from dcodex_lectionary.similarity import build_minhash_sketches, DEFAULT_MINHASH_PARAMETERS
+
+class Command(BaseCommand):
+    help = 'Stores the MinHash sketch of each lection of a system for manuscripts so that the nearest manuscripts can be found with an LSH index.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('system', type=str, help="The name of the lectionary system.")
+        parser.add_argument('--manuscripts', type=str, nargs='+', help="The sigla of the manuscripts to sketch. Default: all manuscripts.")
+        parser.add_argument('--refresh', action='store_true', help="Sketches the manuscripts again even if they already have sketches with these parameters.")
+        parser.add_argument('--permutations', type=int, default=DEFAULT_MINHASH_PARAMETERS['permutation_count'], help="The number of hash functions in each sketch.")
+        parser.add_argument('--shingle-size', type=int, default=DEFAULT_MINHASH_PARAMETERS['shingle_size'], help="The number of characters in each shingle.")
+        parser.add_argument('--bands', type=int, default=DEFAULT_MINHASH_PARAMETERS['band_count'], help="The number of bands of the LSH index.")
+        parser.add_argument('--ignore-incipits', action='store_true', help="Leaves out the first verse of each lection.")
+
+    def handle(self, *args, **options):
+        system = LectionarySystem.objects.filter( name=options['system'] ).first()
+        if system is None:
+            raise CommandError( f"Cannot find lectionary system '{options['system']}'." )
+
+        if options['manuscripts']:
+            mss = [Manuscript.find( siglum ) for siglum in options['manuscripts']]
+            if None in mss:
+                raise CommandError( "Cannot find all the manuscripts." )
+        else:
+            mss = list(Manuscript.objects.all())
+
+        def progress( done, total ):
+            self.stdout.write( f"\r{done}/{total} manuscripts", ending="" )
+            self.stdout.flush()
+
+        count = build_minhash_sketches(
+            system,
+            mss,
+            refresh=options['refresh'],
+            progress=progress,
+            permutation_count=options['permutations'],
+            shingle_size=options['shingle_size'],
+            band_count=options['bands'],
+            ignore_incipits=options['ignore_incipits'],
+        )
+        self.stdout.write( f"\nStored {count} sketches." )
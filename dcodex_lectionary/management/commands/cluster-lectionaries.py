@@ -0,0 +1,72 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from dcodex.models import Manuscript
+from dcodex_lectionary.models import LectionarySystem
+from dcodex_lectionary.similarity import get_system, cluster_manuscripts
+
+class Command(BaseCommand):
+    help = (
+        'Clusters manuscripts hierarchically by their profiles of similarity over the lections of a system. '
+        'Writes the dendrogram in Newick format and the cluster of each manuscript to CSV.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('sigla', type=str, nargs='+', help="The sigla of the manuscripts to cluster.")
+        parser.add_argument('--references', type=str, nargs='*', help="The sigla of the reference manuscripts for the profiles. Default: every pair of the manuscripts is aligned.")
+        parser.add_argument('--system', type=str, help="The name of the lectionary system. Default: the system of the manuscripts.")
+        parser.add_argument('--method', type=str, default='average', help="The linkage method for scipy.cluster.hierarchy.linkage (e.g. average, complete, single, weighted).")
+        parser.add_argument('--clusters', type=int, help="The number of clusters to cut the dendrogram into.")
+        parser.add_argument('--threshold', type=float, help="The distance to cut the dendrogram at if the number of clusters is not given.")
+        parser.add_argument('--min-overlap', type=int, default=1, help="The number of lection similarities two manuscripts need in common to have a distance.")
+        parser.add_argument('--n-jobs', type=int, default=1, help="The number of processes to align the texts with.")
+        parser.add_argument('--newick', type=str, help="A file to write the dendrogram to in Newick format.")
+        parser.add_argument('--csv', type=str, help="A file to write the cluster assignments to.")
+        parser.add_argument('--plot', type=str, help="An image file to draw the dendrogram in.")
+
+    def handle(self, *args, **options):
+        mss = [Manuscript.find( siglum ) for siglum in options['sigla']]
+        if None in mss:
+            raise CommandError( "Cannot find all the manuscripts." )
+
+        if options['system']:
+            system = LectionarySystem.objects.filter( name=options['system'] ).first()
+            if system is None:
+                raise CommandError( f"Cannot find lectionary system '{options['system']}'." )
+        else:
+            system = get_system( mss[0], mss[1:] )
+
+        reference_mss = None
+        if options['references']:
+            reference_mss = [Manuscript.find( siglum ) for siglum in options['references']]
+            if None in reference_mss:
+                raise CommandError( "Cannot find all the reference manuscripts." )
+
+        start = time.perf_counter()
+        clusters = cluster_manuscripts( system, mss, reference_mss, method=options['method'], min_overlap=options['min_overlap'], n_jobs=options['n_jobs'] )
+        self.stdout.write( f"Clustered {len(clusters)} manuscripts in {time.perf_counter() - start:.2f}s." )
+
+        newick = clusters.newick()
+        if options['newick']:
+            with open( options['newick'], 'w' ) as file:
+                file.write( newick + "\n" )
+        else:
+            self.stdout.write( newick )
+
+        if options['clusters'] is not None or options['threshold'] is not None:
+            assignments = clusters.assignments( cluster_count=options['clusters'], threshold=options['threshold'] )
+            self.stdout.write( assignments.to_string( index=False ) )
+            if options['csv']:
+                assignments.to_csv( options['csv'], index=False )
+        elif options['csv']:
+            raise CommandError( "Give the number of clusters or a distance threshold to write the cluster assignments." )
+
+        if options['plot']:
+            import matplotlib
+            matplotlib.use( 'Agg' )
+            import matplotlib.pyplot as plt
+            fig, ax = plt.subplots( figsize=(max( 6, 0.25 * len(clusters) ), 6) )
+            clusters.dendrogram( ax=ax, leaf_rotation=90 )
+            ax.set_ylabel( "Distance (RMS difference in similarity %)" )
+            fig.tight_layout()
+            fig.savefig( options['plot'] )
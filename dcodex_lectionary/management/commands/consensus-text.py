@@ -0,0 +1,57 @@
+import csv
+import sys
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from dcodex.models import Manuscript
+from dcodex_lectionary.models import LectionarySystem
+from dcodex_lectionary.similarity import get_system, consensus_lections
+
+class Command(BaseCommand):
+    help = (
+        'Reconstructs the majority text of each lection from a group of manuscripts. '
+        'Writes a CSV row for each lection as soon as it is done with the consensus text and how well the manuscripts agree with it.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('sigla', type=str, nargs='+', help="The sigla of the manuscripts in the group.")
+        parser.add_argument('--system', type=str, help="The name of the lectionary system. Default: the system of the manuscripts.")
+        parser.add_argument('--min-verses', type=int, default=1, help="The minimum number of verses of the lections to reconstruct.")
+        parser.add_argument('--ignore-incipits', action='store_true', help="Skips the first verse of each lection.")
+        parser.add_argument('--iterations', type=int, default=1, help="The number of times to align to the consensus. After the first time the consensus is the pivot.")
+        parser.add_argument('--output', type=str, help="A CSV file to write to. Default: standard output.")
+
+    def handle(self, *args, **options):
+        mss = [Manuscript.find( siglum ) for siglum in options['sigla']]
+        if None in mss:
+            raise CommandError( "Cannot find all the manuscripts." )
+
+        if options['system']:
+            system = LectionarySystem.objects.filter( name=options['system'] ).first()
+            if system is None:
+                raise CommandError( f"Cannot find lectionary system '{options['system']}'." )
+        else:
+            system = get_system( mss[0], mss[1:] )
+
+        file = open( options['output'], 'w', newline='' ) if options['output'] else sys.stdout
+        try:
+            writer = csv.writer( file )
+            writer.writerow( ['lection', 'order', 'witnesses', 'positions', 'agreement', 'unanimity'] + [f"{ms.siglum}_agreement" for ms in mss] + ['text'] )
+            results = consensus_lections(
+                system,
+                mss,
+                min_verses=options['min_verses'],
+                ignore_incipits=options['ignore_incipits'],
+                iterations=options['iterations'],
+            )
+            for lection_in_system, lection_consensus in results:
+                witness_agreement = lection_consensus.witness_agreement if lection_consensus.witness_agreement is not None else np.full( (len(mss),), np.nan )
+                writer.writerow(
+                    [str(lection_in_system), lection_in_system.order, lection_consensus.witness_count, lection_consensus.position_count]
+                    + [f"{value:.4f}" if np.isfinite( value ) else "" for value in [lection_consensus.agreement, lection_consensus.unanimity, *witness_agreement]]
+                    + [lection_consensus.text]
+                )
+                file.flush()
+        finally:
+            if file is not sys.stdout:
+                file.close()
@@ -0,0 +1,65 @@
+import numpy as np
+import pandas as pd
+from django.core.management.base import BaseCommand, CommandError
+from dcodex_lectionary.models import SimilarityParameters
+from dcodex_lectionary.similarity import labelled_affiliations, lections_verse_counts, DEFAULT_WEIGHTS, DEFAULT_GOTOH_PARAM
+from dcodex_lectionary.fitting import fit_logistic_weights
+
+class Command(BaseCommand):
+    help = 'Fits the logistic weights for similarity probabilities to a CSV of labelled affiliations and saves them as a named parameter set.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('csv', type=str, help="A CSV file with the columns 'lection' (the description), 'base' and 'comparison' (sigla) and 'affiliated' (1 or 0).")
+        parser.add_argument('name', type=str, help="The name of the parameter set to save. An existing set with this name is replaced.")
+        parser.add_argument('--description', type=str, default="", help="A description of the parameter set.")
+        parser.add_argument('--gotoh-param', type=float, nargs=4, default=DEFAULT_GOTOH_PARAM, help="The match, mismatch, gap opening and gap extension scores for the alignments.")
+        parser.add_argument('--include-incipits', action='store_true', help="Includes the first verse of each lection in the alignments. By default it is left out, the same as in the similarity views.")
+        parser.add_argument('--l2', type=float, default=0.0, help="The strength of the L2 penalty on the weights.")
+        parser.add_argument('--fit-prior', action='store_true', help="Fits the prior log odds as well as the weights.")
+        parser.add_argument('--n-jobs', type=int, default=1, help="The number of processes to use for alignments which are not in the cache.")
+
+    def handle(self, *args, **options):
+        try:
+            groups, labels = labelled_affiliations( pd.read_csv( options['csv'] ) )
+        except ValueError as error:
+            raise CommandError( str(error) )
+
+        gotoh_param = options['gotoh_param']
+        ignore_incipits = not options['include_incipits']
+        counts = []
+        for base_ms, comparison_mss, lections, positions in groups:
+            # Uses the cached counts from the GotohCounts table so that only new pairs of texts are aligned.
+            lection_totals = [
+                verse_counts.sum( axis=0 )
+                for verse_counts in lections_verse_counts( base_ms, lections, comparison_mss, gotoh_param=gotoh_param, ignore_incipits=ignore_incipits, n_jobs=options['n_jobs'], cache=True )
+            ]
+            counts.extend( lection_totals[lection_index][comparison_index] for lection_index, comparison_index in positions )
+
+        counts = np.array( counts )
+        aligned = counts.sum( axis=1 ) > 0
+        if not aligned.all():
+            self.stdout.write( f"Ignoring {(~aligned).sum()} row(s) without any aligned text." )
+        if len(np.unique( labels[aligned] )) < 2:
+            raise CommandError( "The labelled affiliations need both affiliated and unaffiliated examples." )
+
+        weights, prior_log_odds, result = fit_logistic_weights(
+            counts[aligned],
+            labels[aligned],
+            l2=options['l2'],
+            fit_prior=options['fit_prior'],
+            initial_weights=DEFAULT_WEIGHTS,
+        )
+        if not result.success:
+            raise CommandError( f"The fit did not converge: {result.message}" )
+
+        parameters, _ = SimilarityParameters.objects.update_or_create(
+            name=options['name'],
+            defaults=dict(
+                description=options['description'],
+                weights=[float(weight) for weight in weights],
+                gotoh_param=[float(value) for value in gotoh_param],
+                prior_log_odds=float(prior_log_odds),
+                ignore_incipits=ignore_incipits,
+            ),
+        )
+        self.stdout.write( f"Saved '{parameters}' from {aligned.sum()} examples: weights={parameters.weights}, prior_log_odds={parameters.prior_log_odds}, negative log likelihood={result.fun:.4g}" )
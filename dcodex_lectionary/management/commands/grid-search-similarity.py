@@ -0,0 +1,99 @@
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from django.core.management.base import BaseCommand, CommandError
+from dcodex_lectionary import alignment
+from dcodex_lectionary.models import SimilarityParameters
+from dcodex_lectionary.similarity import labelled_affiliations, lection_transcriptions, DEFAULT_WEIGHTS, DEFAULT_GOTOH_PARAM
+from dcodex_lectionary.fitting import fit_logistic_weights, labelled_counts, separation_metrics
+
+class Command(BaseCommand):
+    help = (
+        'Evaluates a grid of Gotoh parameters and logistic weights on a CSV of labelled affiliations. '
+        'The transcriptions are loaded once and the parameter sets are aligned in parallel.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('csv', type=str, help="A CSV file with the columns 'lection' (the description), 'base' and 'comparison' (sigla) and 'affiliated' (1 or 0).")
+        parser.add_argument('--match', type=float, nargs='+', default=[DEFAULT_GOTOH_PARAM[0]], help="The match scores to try.")
+        parser.add_argument('--mismatch', type=float, nargs='+', default=[DEFAULT_GOTOH_PARAM[1]], help="The mismatch scores to try.")
+        parser.add_argument('--gap-open', type=float, nargs='+', default=[DEFAULT_GOTOH_PARAM[2]], help="The gap opening scores to try.")
+        parser.add_argument('--gap-extend', type=float, nargs='+', default=[DEFAULT_GOTOH_PARAM[3]], help="The gap extension scores to try.")
+        parser.add_argument('--parameters', type=str, nargs='*', default=[], help="The names of saved similarity parameter sets whose weights are also tried.")
+        parser.add_argument('--include-incipits', action='store_true', help="Includes the first verse of each lection in the alignments for the default and fitted weights. The saved parameter sets use their own setting.")
+        parser.add_argument('--fit', action='store_true', help="Also fits the weights for each set of Gotoh parameters (the separation is then measured on the examples used for the fit).")
+        parser.add_argument('--l2', type=float, default=0.0, help="The strength of the L2 penalty when fitting the weights.")
+        parser.add_argument('--n-jobs', type=int, default=1, help="The number of processes to align the parameter sets with. Negative numbers count back from the number of CPUs.")
+        parser.add_argument('--output', type=str, help="A CSV file to write the comparison table to.")
+
+    def handle(self, *args, **options):
+        try:
+            affiliations, labels = labelled_affiliations( pd.read_csv( options['csv'] ) )
+        except ValueError as error:
+            raise CommandError( str(error) )
+
+        ignore_incipits = not options['include_incipits']
+        weight_sets = [('default', DEFAULT_WEIGHTS, 0.0, ignore_incipits)]
+        for name in options['parameters']:
+            parameters = SimilarityParameters.objects.filter( name=name ).first()
+            if parameters is None:
+                raise CommandError( f"Cannot find similarity parameters '{name}'." )
+            weight_sets.append( (name, parameters.weights, parameters.prior_log_odds, parameters.ignore_incipits) )
+
+        # The transcriptions are loaded once for each way of treating the incipits which a weight set needs
+        incipit_settings = sorted( {ignore_incipits} | {weight_set[3] for weight_set in weight_sets} )
+        grid = list(itertools.product( options['match'], options['mismatch'], options['gap_open'], options['gap_extend'] ))
+        tasks = []
+        for ignore in incipit_settings:
+            groups, positions = self.load_transcriptions( affiliations, ignore )
+            tasks.extend( (ignore, gotoh_param, groups, positions) for gotoh_param in grid )
+        self.stdout.write( f"Loaded the transcriptions of {len(labels)} examples. Evaluating {len(grid)} sets of Gotoh parameters." )
+
+        n_jobs = alignment.resolve_n_jobs( options['n_jobs'] )
+        if n_jobs == 1:
+            results = [labelled_counts( groups, positions, gotoh_param ) for _, gotoh_param, groups, positions in tasks]
+        else:
+            with ProcessPoolExecutor( max_workers=n_jobs ) as executor:
+                futures = [executor.submit( labelled_counts, groups, positions, gotoh_param ) for _, gotoh_param, groups, positions in tasks]
+                results = [future.result() for future in futures]
+
+        rows = []
+        for (ignore, gotoh_param, _, _), (counts, seconds) in zip(tasks, results):
+            aligned = counts.sum( axis=1 ) > 0
+            candidates = [weight_set for weight_set in weight_sets if weight_set[3] == ignore]
+            if options['fit'] and ignore == ignore_incipits:
+                weights, prior_log_odds, _ = fit_logistic_weights( counts[aligned], labels[aligned], l2=options['l2'], initial_weights=DEFAULT_WEIGHTS )
+                candidates.append( ('fitted', weights, prior_log_odds, ignore) )
+
+            for weights_name, weights, prior_log_odds, _ in candidates:
+                rows.append( dict(
+                    match=gotoh_param[0],
+                    mismatch=gotoh_param[1],
+                    gap_open=gotoh_param[2],
+                    gap_extend=gotoh_param[3],
+                    ignore_incipits=ignore,
+                    weights_name=weights_name,
+                    weights=[round( float(weight), 6 ) for weight in weights],
+                    prior_log_odds=prior_log_odds,
+                    **separation_metrics( counts[aligned], labels[aligned], weights, prior_log_odds ),
+                    examples=int(aligned.sum()),
+                    seconds=seconds,
+                ) )
+
+        table = pd.DataFrame( rows ).sort_values( 'probability_auc', ascending=False )
+        self.stdout.write( table.to_string( index=False ) )
+        if options['output']:
+            table.to_csv( options['output'], index=False )
+
+    def load_transcriptions(self, affiliations, ignore_incipits):
+        """ Loads the normalized transcriptions for the examples in the CSV once so that every parameter set aligns the same texts. """
+        groups = []
+        positions = []
+        for base_ms, comparison_mss, lections, rows in affiliations:
+            group_index = len(groups)
+            groups.append( ([lection_transcriptions( base_ms, lection, comparison_mss, ignore_incipits=ignore_incipits ) for lection in lections], len(comparison_mss)) )
+            positions.extend( (group_index, lection_index, comparison_index) for lection_index, comparison_index in rows )
+
+        return groups, positions
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+from dcodex.models import Manuscript, VerseTranscriptionBase
+from dcodex_lectionary.models import NormalizedTranscription, NORMALIZATION_VERSION
+
+class Command(BaseCommand):
+    help = 'Stores the normalized text of the transcriptions which do not have one for the current normalization version.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--manuscripts', type=str, nargs='+', help="The sigla of the manuscripts to normalize. Default: all manuscripts.")
+        parser.add_argument('--refresh', action='store_true', help="Normalizes every transcription again, even if it already has a normalized text for the current version.")
+        parser.add_argument('--batch-size', type=int, default=500, help="The number of normalized texts saved in each query.")
+
+    def handle(self, *args, **options):
+        transcriptions = VerseTranscriptionBase.objects.all()
+        if options['manuscripts']:
+            mss = [Manuscript.find( siglum ) for siglum in options['manuscripts']]
+            if None in mss:
+                raise CommandError( "Cannot find all the manuscripts." )
+            transcriptions = transcriptions.filter( manuscript__in=mss )
+
+        count = NormalizedTranscription.fill( transcriptions, refresh=options['refresh'], batch_size=options['batch_size'] )
+        self.stdout.write( f"Stored {count} normalized transcriptions (version {NORMALIZATION_VERSION})." )
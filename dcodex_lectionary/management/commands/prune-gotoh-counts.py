@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from dcodex_lectionary.models import GotohCounts
+
+class Command(BaseCommand):
+    help = 'Deletes the cached Gotoh counts of texts which are no longer the normalized text of any transcription.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help="The number of text hashes deleted in each query.")
+
+    def handle(self, *args, **options):
+        count = GotohCounts.prune( batch_size=options['batch_size'] )
+        self.stdout.write( f"Deleted {count} cached Gotoh counts." )
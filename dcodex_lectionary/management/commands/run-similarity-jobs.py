@@ -0,0 +1,19 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from dcodex_lectionary import jobs
+
+class Command(BaseCommand):
+    help = 'Runs the pending background similarity jobs.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help="Keeps waiting for new jobs instead of exiting when there are no pending jobs.")
+        parser.add_argument('--sleep', type=float, default=5.0, help="The number of seconds to wait between checks for new jobs when looping.")
+
+    def handle(self, *args, **options):
+        while True:
+            count = jobs.run_pending_jobs()
+            if count:
+                self.stdout.write(f"Ran {count} similarity job(s).")
+            if not options['loop']:
+                break
+            time.sleep( options['sleep'] )
@@ -0,0 +1,63 @@
+import itertools
+
+import pandas as pd
+from django.core.management.base import BaseCommand, CommandError
+from dcodex.models import Manuscript
+from dcodex_lectionary.models import LectionarySystem
+from dcodex_lectionary.pipeline import PipelineStats
+from dcodex_lectionary.similarity import get_system, lections_verse_counts, LectionVerses
+
+class Command(BaseCommand):
+    help = (
+        'Aligns the lections of a system with different chunk sizes, queue sizes and numbers of jobs '
+        'and reports the time in each stage of the pipeline, the backpressure and the depth of the queue.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('base', type=str, help="The siglum of the base manuscript.")
+        parser.add_argument('comparison', type=str, nargs='+', help="The sigla of the comparison manuscripts.")
+        parser.add_argument('--system', type=str, help="The name of the lectionary system. Default: the system of the manuscripts.")
+        parser.add_argument('--lections', type=int, default=100, help="The number of lections of the system to align.")
+        parser.add_argument('--chunksizes', type=int, nargs='+', default=[4, 16], help="The numbers of lections in each batch.")
+        parser.add_argument('--queue-sizes', type=int, nargs='+', default=[0, 2, 8], help="The numbers of fetched batches which can wait in the queue. 0 fetches in the calling thread.")
+        parser.add_argument('--n-jobs', type=int, nargs='+', default=[1], help="The numbers of processes for the alignments.")
+        parser.add_argument('--output', type=str, help="A CSV file to write the table to.")
+
+    def handle(self, *args, **options):
+        base_ms = Manuscript.find( options['base'] )
+        comparison_mss = [Manuscript.find( siglum ) for siglum in options['comparison']]
+        if base_ms is None or None in comparison_mss:
+            raise CommandError( "Cannot find all the manuscripts." )
+
+        if options['system']:
+            system = LectionarySystem.objects.filter( name=options['system'] ).first()
+            if system is None:
+                raise CommandError( f"Cannot find lectionary system '{options['system']}'." )
+        else:
+            system = get_system( base_ms, comparison_mss )
+
+        lection_verses = LectionVerses( system )
+        lections = [lection_in_system.lection for lection_in_system in system.lections_in_system().select_related( 'lection' )[:options['lections']]]
+
+        rows = []
+        for chunksize, queue_size, n_jobs in itertools.product( options['chunksizes'], options['queue_sizes'], options['n_jobs'] ):
+            stats = PipelineStats()
+            lections_verse_counts(
+                base_ms,
+                lections,
+                comparison_mss,
+                n_jobs=n_jobs,
+                chunksize=chunksize,
+                lection_verses=lection_verses,
+                queue_size=queue_size,
+                threaded=queue_size > 0,
+                stats=stats,
+            )
+            rows.append( dict( chunksize=chunksize, **stats.as_dict() ) )
+            self.stdout.write( f"chunksize={chunksize}, {stats}" )
+
+        table = pd.DataFrame( rows ).sort_values( 'wall_seconds' )
+        with pd.option_context( 'display.max_rows', None, 'display.width', 250 ):
+            self.stdout.write( table.to_string( index=False ) )
+        if options['output']:
+            table.to_csv( options['output'], index=False )
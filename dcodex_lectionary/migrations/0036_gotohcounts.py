@@ -0,0 +1,29 @@
+# Generated by Django 3.2.6 on 2026-10-19 09:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dcodex_lectionary', '0035_auto_20210811_1101'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GotohCounts',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(help_text='A hash of both texts and the Gotoh parameters.', max_length=40, unique=True)),
+                ('base_hash', models.CharField(db_index=True, help_text='A hash of the normalized base text.', max_length=40)),
+                ('comparison_hash', models.CharField(db_index=True, help_text='A hash of the normalized comparison text.', max_length=40)),
+                ('matches', models.IntegerField()),
+                ('mismatches', models.IntegerField()),
+                ('gap_openings', models.IntegerField()),
+                ('gap_extensions', models.IntegerField()),
+            ],
+            options={
+                'verbose_name_plural': 'Gotoh counts',
+            },
+        ),
+    ]
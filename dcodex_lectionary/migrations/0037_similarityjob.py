@@ -0,0 +1,45 @@
+# Generated by Django 3.2.6 on 2026-10-19 09:30
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dcodex', '0025_auto_20200809_1536'),
+        ('dcodex_lectionary', '0036_gotohcounts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TranscriptionsVersion',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveBigIntegerField(default=0)),
+                ('manuscript', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='dcodex.manuscript')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SimilarityJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('similarity_dict', 'Similarity'), ('lection_counts', 'Lection Counts')], max_length=31)),
+                ('key', models.CharField(db_index=True, help_text='The cache key for the result of this job.', max_length=255)),
+                ('comparison_sigla', models.TextField(help_text='The sigla of the comparison manuscripts separated by commas.')),
+                ('parameters', models.JSONField(blank=True, default=dict)),
+                ('status', models.CharField(choices=[('P', 'Pending'), ('R', 'Running'), ('D', 'Done'), ('F', 'Failed')], default='P', max_length=1)),
+                ('processed', models.PositiveIntegerField(default=0, help_text='The number of lections processed so far.')),
+                ('total', models.PositiveIntegerField(default=0, help_text='The total number of lections to process.')),
+                ('result', models.JSONField(blank=True, default=None, null=True)),
+                ('error', models.TextField(blank=True, default='')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('base_ms', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='dcodex.manuscript')),
+                ('system', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='dcodex_lectionary.lectionarysystem')),
+            ],
+            options={
+                'ordering': ('-created',),
+            },
+        ),
+    ]
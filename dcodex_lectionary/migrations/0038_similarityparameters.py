@@ -0,0 +1,30 @@
+# Generated by Django 3.2.6 on 2026-10-19 11:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dcodex_lectionary', '0037_similarityjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SimilarityParameters',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('description', models.TextField(blank=True, default='')),
+                ('weights', models.JSONField(help_text='The logistic weights for the matches, mismatches, gap openings and gap extensions.')),
+                ('gotoh_param', models.JSONField(help_text='The match, mismatch, gap opening and gap extension scores used for the alignments.')),
+                ('prior_log_odds', models.FloatField(default=0.0)),
+                ('ignore_incipits', models.BooleanField(default=True, help_text='Whether the first verse of each lection is left out of the alignments.')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name_plural': 'Similarity parameters',
+                'ordering': ('name',),
+            },
+        ),
+    ]
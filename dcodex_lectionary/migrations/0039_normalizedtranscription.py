@@ -0,0 +1,30 @@
+# Generated by Django 3.2.6 on 2026-10-19 12:30
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dcodex', '0025_auto_20200809_1536'),
+        ('dcodex_lectionary', '0038_similarityparameters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NormalizedTranscription',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('text', models.TextField(blank=True, default='')),
+                ('version', models.PositiveIntegerField(default=1)),
+                ('manuscript', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='dcodex.manuscript')),
+                ('transcription', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='normalized', to='dcodex.versetranscriptionbase')),
+                ('verse', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='dcodex.verse')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='normalizedtranscription',
+            index=models.Index(fields=['manuscript', 'verse'], name='normalized_ms_verse_idx'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 3.2.6 on 2026-10-19 14:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dcodex', '0025_auto_20200809_1536'),
+        ('dcodex_lectionary', '0039_normalizedtranscription'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LectionGotohTotals',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('parameters_key', models.CharField(help_text='A hash of the Gotoh parameters and whether incipits are ignored.', max_length=40)),
+                ('gotoh_param', models.JSONField()),
+                ('ignore_incipits', models.BooleanField(default=False)),
+                ('matches', models.IntegerField(default=0)),
+                ('mismatches', models.IntegerField(default=0)),
+                ('gap_openings', models.IntegerField(default=0)),
+                ('gap_extensions', models.IntegerField(default=0)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('base_ms', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='dcodex.manuscript')),
+                ('comparison_ms', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='dcodex.manuscript')),
+                ('lection', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='dcodex_lectionary.lection')),
+                ('system', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='dcodex_lectionary.lectionarysystem')),
+            ],
+            options={
+                'verbose_name_plural': 'lection Gotoh totals',
+                'unique_together': {('system', 'lection', 'base_ms', 'comparison_ms', 'parameters_key')},
+            },
+        ),
+        migrations.AddIndex(
+            model_name='lectiongotohtotals',
+            index=models.Index(fields=['system', 'base_ms', 'parameters_key'], name='gotoh_totals_system_base_idx'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 3.2.6 on 2026-10-19 16:20
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dcodex', '0025_auto_20200809_1536'),
+        ('dcodex_lectionary', '0040_lectiongotohtotals'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MinHashSketch',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('parameters_key', models.CharField(help_text='A hash of the MinHash parameters, the number of bands and whether incipits are ignored.', max_length=40)),
+                ('parameters', models.JSONField()),
+                ('sketch', models.BinaryField(help_text='The uint32 values of the sketch.')),
+                ('band_hashes', models.BinaryField(help_text='The uint64 hashes of the bands of the sketch.')),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('lection', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='dcodex_lectionary.lection')),
+                ('manuscript', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='dcodex.manuscript')),
+            ],
+            options={
+                'unique_together': {('manuscript', 'lection', 'parameters_key')},
+            },
+        ),
+        migrations.AddIndex(
+            model_name='minhashsketch',
+            index=models.Index(fields=['lection', 'parameters_key'], name='minhash_lection_idx'),
+        ),
+    ]
@@ -0,0 +1,149 @@
+"""
+MinHash sketches of texts and a locality-sensitive hashing (LSH) index to find the texts most like a query without aligning them.
+
+A text is reduced to the set of hashes of its character shingles (substrings of a fixed length) and its sketch is the minimum of each of a set of
+random hash functions over that set. The fraction of equal values in two sketches estimates the Jaccard similarity of the sets of shingles.
+The LSH index splits each sketch into bands and texts which agree on all the values in any band are candidates for each other.
+Nothing in this module imports Django models.
+"""
+from collections import defaultdict
+import numpy as np
+
+EMPTY = np.iinfo( np.uint32 ).max # The value of every hash in the sketch of a text with no shingles
+
+
+def shingle_hashes( text, shingle_size=5 ):
+    """
+    Returns the distinct 64-bit hashes of the substrings of `shingle_size` characters of a text.
+
+    Texts shorter than the shingle size have a single shingle of the whole text. Empty or missing texts have none.
+    """
+    if not text:
+        return np.zeros( (0,), dtype=np.uint64 )
+    code_points = np.frombuffer( text.encode( 'utf-32-le' ), dtype=np.uint32 ).astype( np.uint64 )
+    size = min( shingle_size, len(code_points) )
+    windows = np.lib.stride_tricks.sliding_window_view( code_points, size )
+
+    # A polynomial hash with odd multipliers which wraps around modulo 2^64
+    powers = np.full( (size,), 0x100000001B3, dtype=np.uint64 ) ** np.arange( size, dtype=np.uint64 )
+    with np.errstate( over='ignore' ):
+        hashes = (windows * powers).sum( axis=1, dtype=np.uint64 )
+    return np.unique( hashes )
+
+
+class MinHasher():
+    """
+    Computes MinHash sketches with `permutation_count` hash functions of the form (a*x + b) >> 32 modulo 2^64 from a random `seed`.
+
+    Sketches are uint32 arrays so that they can be stored as bytes. The same parameters always give the same hash functions.
+    """
+    def __init__( self, permutation_count=128, shingle_size=5, seed=1 ):
+        self.permutation_count = permutation_count
+        self.shingle_size = shingle_size
+        self.seed = seed
+        rng = np.random.default_rng( seed )
+        self.multipliers = rng.integers( 0, 2**63, size=permutation_count, dtype=np.uint64 ) * np.uint64(2) + np.uint64(1)
+        self.offsets = rng.integers( 0, 2**63, size=permutation_count, dtype=np.uint64 )
+
+    def parameters( self ):
+        return dict( permutation_count=self.permutation_count, shingle_size=self.shingle_size, seed=self.seed )
+
+    def sketch( self, text ):
+        """ Returns the sketch of a text (every value is EMPTY if the text has no shingles). """
+        hashes = shingle_hashes( text, self.shingle_size )
+        if len(hashes) == 0:
+            return np.full( (self.permutation_count,), EMPTY, dtype=np.uint32 )
+        with np.errstate( over='ignore' ):
+            permuted = (hashes[:,None] * self.multipliers + self.offsets) >> np.uint64(32)
+        return permuted.min( axis=0 ).astype( np.uint32 )
+
+    def sketches( self, texts ):
+        """ Returns an array of shape (texts, permutation_count) with the sketch of each text. """
+        sketches = np.empty( (len(texts), self.permutation_count), dtype=np.uint32 )
+        for index, text in enumerate(texts):
+            sketches[index] = self.sketch( text )
+        return sketches
+
+
+def is_empty( sketches ):
+    """ Returns True for each sketch of a text without any shingles. """
+    return np.all( np.asarray( sketches ) == EMPTY, axis=-1 )
+
+
+def estimated_jaccard( sketch, sketches ):
+    """ Returns the estimated Jaccard similarity of a sketch with each row of an array of sketches (zero for empty sketches). """
+    sketches = np.atleast_2d( sketches )
+    similarity = np.mean( sketches == sketch, axis=-1 )
+    similarity[is_empty( sketches ) | is_empty( sketch )] = 0.0
+    return similarity
+
+
+def band_hashes( sketches, band_count ):
+    """
+    Returns an array of shape (sketches, bands) with a 64-bit hash of the values in each band of each sketch.
+
+    The values of the sketches are split into `band_count` bands of the same number of rows (any remaining values are not used).
+    """
+    sketches = np.atleast_2d( np.asarray( sketches, dtype=np.uint32 ) )
+    rows = sketches.shape[1]//band_count
+    if rows == 0:
+        raise ValueError( f"There are more bands ({band_count}) than values in the sketches ({sketches.shape[1]})." )
+    bands = sketches[:,:band_count*rows].reshape( len(sketches), band_count, rows ).astype( np.uint64 )
+    powers = np.full( (rows,), 0x9E3779B97F4A7C15, dtype=np.uint64 ) ** np.arange( rows, dtype=np.uint64 )
+    with np.errstate( over='ignore' ):
+        return (bands * powers).sum( axis=2, dtype=np.uint64 )
+
+
+class LSHIndex():
+    """
+    An index of sketches keyed by any hashable key and partitioned by a group (such as the lection) so that queries only find sketches in the same group.
+
+    Texts which agree on every value of at least one of the `band_count` bands are candidates.
+    With b bands of r rows, a pair with Jaccard similarity s is a candidate with probability 1 - (1 - s^r)^b.
+    Empty sketches are never indexed.
+    """
+    def __init__( self, band_count=32 ):
+        self.band_count = band_count
+        self.buckets = defaultdict( list )
+        self.keys = []
+        self.groups = []
+        self.sketches = []
+
+    def __len__(self):
+        return len(self.keys)
+
+    def add( self, key, group, sketch, hashes=None ):
+        """ Adds a sketch to the index. The band hashes can be given if they have been stored with the sketch. """
+        if is_empty( sketch ):
+            return
+        if hashes is None:
+            hashes = band_hashes( sketch, self.band_count )[0]
+        position = len(self.keys)
+        self.keys.append( key )
+        self.groups.append( group )
+        self.sketches.append( np.asarray( sketch, dtype=np.uint32 ) )
+        for band, value in enumerate(hashes.tolist()):
+            self.buckets[(group, band, value)].append( position )
+
+    def candidates( self, group, sketch ):
+        """ Returns the positions in the index of the sketches in the group which share a band with the sketch. """
+        if is_empty( sketch ):
+            return []
+        positions = set()
+        for band, value in enumerate(band_hashes( sketch, self.band_count )[0].tolist()):
+            positions.update( self.buckets.get( (group, band, value), () ) )
+        return sorted( positions )
+
+    def query( self, group, sketch, count=10, exclude=() ):
+        """
+        Returns up to `count` tuples of the key and the estimated Jaccard similarity of the candidates most similar to a sketch, best first.
+
+        Keys in `exclude` are skipped.
+        """
+        exclude = set(exclude)
+        positions = [position for position in self.candidates( group, sketch ) if self.keys[position] not in exclude]
+        if not positions:
+            return []
+        similarity = estimated_jaccard( sketch, np.stack( [self.sketches[position] for position in positions] ) )
+        order = np.argsort( -similarity, kind='stable' )[:count]
+        return [(self.keys[positions[index]], float(similarity[index])) for index in order]
@@ -1,5 +1,6 @@
 from pathlib import Path
 from itertools import chain
+import hashlib
 from lxml import etree
 
 from django.db import models
@@ -7,13 +8,14 @@ from django.db.models import F
 from django.db.models import Max, Min, Sum
 from django.shortcuts import render
 from django.urls import reverse
+from django.utils import timezone
 from polymorphic.models import PolymorphicModel
 
 import numpy as np
 import pandas as pd
 from collections import defaultdict
 
-from dcodex.models import Manuscript, Verse, VerseLocation
+from dcodex.models import Manuscript, Verse, VerseLocation, VerseTranscriptionBase
 from dcodex_bible.models import BibleVerse
 from dcodex_bible.similarity import * 
 import dcodex.distance as distance
@@ -21,6 +23,7 @@ import dcodex.distance as distance
 import logging
 
 DEFAULT_LECTIONARY_VERSE_MASS = 50
+NORMALIZATION_VERSION = 1 # Increase this when the normalization of transcriptions changes so that the stored normalized texts are recomputed
 
 def data_dir():
     return Path(__file__).parent/"data"
@@ -689,6 +692,10 @@ class LectionarySystem(models.Model):
     def lections_in_system_min_verses(self, min_verses=2):
         return [m for m in self.lections_in_system().all() if m.lection.verses.count() >= min_verses]
 
+    def consensus_lections(self, mss, **kwargs):
+        from .similarity import consensus_lections
+        return consensus_lections( self, mss, **kwargs )
+
     def export_csv(self, filename) -> pd.DataFrame:
         """
         Exports the lectionary system as a CSV.
@@ -1262,14 +1269,15 @@ class Lectionary( Manuscript ):
 
     def similarity_lection( self, lection, comparison_mss, similarity_func=distance.similarity_levenshtein, ignore_incipits=False ):
         from .similarity import similarity_lection
-        
+        return similarity_lection( self, lection, comparison_mss, ignore_incipits=ignore_incipits )
+
     def similarity_probabilities_lection( self, lection, comparison_mss, weights, gotoh_param, prior_log_odds=0.0, ignore_incipits=False ):
         from .similarity import similarity_probabilities_lection
         return similarity_probabilities_lection( self, lection, comparison_mss, weights, gotoh_param, prior_log_odds, ignore_incipits )
 
     def similarity_dict( self, comparison_mss, min_verses = 2, ignore_unstranscribed=True, **kwargs ):
         from .similarity import similarity_dict
-        return similarity_dict(self.system, self, comparison_mss=comparison_mss, min_verses=min_verses, ignore_unstranscribed=ignore_unstranscribed, **kwargs)
+        return similarity_dict(self, comparison_mss, system=self.system, min_verses=min_verses, ignore_unstranscribed=ignore_unstranscribed, **kwargs)
 
     # def similarity_df( self, comparison_mss, min_verses = 2, ignore_unstranscribed=True, **kwargs ):
     #     """ TODO get from similarity_dict """
@@ -1297,59 +1305,41 @@ class Lectionary( Manuscript ):
     def similarity_probabilities_df( self, comparison_mss, min_verses=2, **kwargs ):
         from .similarity import similarity_probabilities_df
         return similarity_probabilities_df( self.system, self, comparison_mss, min_verses=2, **kwargs)
+
+    def similarity_counts( self, comparison_mss, min_verses=2, **kwargs ):
+        from .similarity import similarity_counts
+        return similarity_counts( self.system, self, comparison_mss, min_verses=min_verses, **kwargs)
+
+    def similarity_series( self, comparison_mss, window, window_unit='verses', **kwargs ):
+        from .similarity import similarity_series
+        return similarity_series( self.system, self, comparison_mss, window, window_unit=window_unit, **kwargs)
           
-    def similarity_families_array( self, comparison_mss, start_verse, end_verse, threshold, **kwargs ):
-        verse_count = end_verse.rank - start_verse.rank + 1
-        families_array = np.zeros( (verse_count,) )
-        
-        
-        UNCERTAIN = 1
-        MIXED = 2
-        
-        
-        for i, lection in enumerate(self.system.lections.all()):
-            averages = self.similarity_lection( lection, comparison_mss, **kwargs )
- #           print(lection, averages)
-            
-            max_index = None
-            max_average = 0.0
-            for ms_index, average in enumerate( averages ):
-                print(average)
-                print( 'average is not None', average is not None )
-#                print( 'average > max_average', average > max_average )
-                if average is not None and average > max_average:
-                    max_index = ms_index
-                    max_average = average
-            
-            if max_index is None:
-                continue
-            family = max_index + MIXED + 1 if max_average > threshold else UNCERTAIN
-            print( lection, max_index, family, max_average, averages )
-            
-            for lectionary_verse in lection.verses.all():
-                array_index = lectionary_verse.bible_verse.rank - start_verse.rank
-                if families_array[array_index] <= UNCERTAIN:
-                    families_array[array_index] = family
-                elif families_array[array_index] != family:
-                    families_array[array_index] = MIXED
-                
-        return families_array   
-        
-    def lections_agreeing_with( self, comparison_mss, threshold, **kwargs ):
+    def similarity_change_points( self, comparison_mss, **kwargs ):
+        from .similarity import similarity_change_points
+        return similarity_change_points( self.system, self, comparison_mss, **kwargs )
+
+    def similarity_families_array( self, comparison_mss, start_verse, end_verse, threshold, prune=False, **kwargs ):
+        """
+        Returns an integer array with the family of each Bible verse from `start_verse` to `end_verse` (see `similarity.similarity_families_array`).
+
+        If `prune` is True then cheap upper bounds on the similarity are used to avoid aligning manuscripts which cannot be the closest in a lection.
+        """
+        from .similarity import similarity_families_array
+        return similarity_families_array( self, comparison_mss, start_verse, end_verse, threshold, system=self.system, prune=prune, **kwargs )
+
+    def lections_agreeing_with( self, comparison_mss, threshold, prune=True, **kwargs ):
+        """
+        Returns a dictionary of the lections where each comparison manuscript is the most similar to this lectionary (above the threshold).
+
+        If `prune` is True then cheap upper bounds on the similarity are used to avoid aligning manuscripts which cannot be the closest.
+        """
+        from .similarity import best_match_lection
         lections_agreeing_with = defaultdict( list )
         for i, lection in enumerate(self.system.lections.all()):
-            averages = self.similarity_lection( lection, comparison_mss, **kwargs )
-            
-            max_index = None            
-            max_average = 0.0
-            for ms_index, average in enumerate( averages ):
-                if average is not None and average > max_average:
-                    max_index = ms_index
-                    max_average = average
+            max_index, max_average, _ = best_match_lection( self, lection, comparison_mss, threshold=threshold, prune=prune, **kwargs )
             if max_index is None:
                 continue
-            if max_average > threshold:
-                lections_agreeing_with[max_index].append( lection )
+            lections_agreeing_with[max_index].append( lection )
         
         # Add Sigla to dictionary
         for ms_index, ms in enumerate( comparison_mss ):
@@ -1458,6 +1448,392 @@ class AffiliationLections(AffiliationLectionsSet):
             if lection and isinstance( lection, Lection ):
                 self.lections.add(lection)
         self.save()
-                
-                
-    
\ No newline at end of file
+
+
+class NormalizedTranscription(models.Model):
+    """
+    The normalized text of a verse transcription which is stored so that it does not need to be normalized from the markup every time.
+
+    The text is only used if `version` is the current NORMALIZATION_VERSION. The manuscript and verse are copied from the transcription so that
+    the texts for a set of manuscripts and verses can be read with a single query.
+    """
+    transcription = models.OneToOneField(VerseTranscriptionBase, on_delete=models.CASCADE, related_name='normalized')
+    manuscript = models.ForeignKey(Manuscript, on_delete=models.CASCADE, related_name='+')
+    verse = models.ForeignKey(Verse, on_delete=models.CASCADE, related_name='+')
+    text = models.TextField(default="", blank=True)
+    version = models.PositiveIntegerField(default=NORMALIZATION_VERSION)
+
+    class Meta:
+        indexes = [models.Index(fields=['manuscript', 'verse'], name='normalized_ms_verse_idx')]
+
+    def __str__(self):
+        return f"{self.manuscript_id}:{self.verse_id} (v{self.version}): {self.text}"
+
+    @classmethod
+    def normalize( cls, transcription ):
+        return transcription.manuscript.normalized_transcription( transcription.verse ) or ""
+
+    @classmethod
+    def update_for( cls, transcription ):
+        """ Stores the normalized text of a transcription and returns the NormalizedTranscription object. """
+        normalized, _ = cls.objects.update_or_create(
+            transcription_id=transcription.pk,
+            defaults=dict(
+                manuscript_id=transcription.manuscript_id,
+                verse_id=transcription.verse_id,
+                text=cls.normalize( transcription ),
+                version=NORMALIZATION_VERSION,
+            ),
+        )
+        return normalized
+
+    @classmethod
+    def fill( cls, transcriptions=None, refresh=False, batch_size=500 ):
+        """
+        Stores the normalized text of the transcriptions which do not have one for the current version (or of all of them if `refresh` is True).
+
+        The transcriptions are processed in batches. Returns the number of normalized texts stored.
+        """
+        if transcriptions is None:
+            transcriptions = VerseTranscriptionBase.objects.all()
+        if not refresh:
+            transcriptions = transcriptions.exclude( normalized__version=NORMALIZATION_VERSION )
+
+        count = 0
+        batch = []
+        for transcription in transcriptions.select_related( 'manuscript', 'verse' ).iterator( chunk_size=batch_size ):
+            batch.append( cls(
+                transcription_id=transcription.pk,
+                manuscript_id=transcription.manuscript_id,
+                verse_id=transcription.verse_id,
+                text=cls.normalize( transcription ),
+                version=NORMALIZATION_VERSION,
+            ) )
+            if len(batch) >= batch_size:
+                count += cls.replace( batch )
+                batch = []
+        if batch:
+            count += cls.replace( batch )
+        return count
+
+    @classmethod
+    def replace( cls, normalized_transcriptions ):
+        """ Saves a list of unsaved NormalizedTranscription objects in bulk and removes any older objects for the same transcriptions. """
+        cls.objects.filter( transcription_id__in=[normalized.transcription_id for normalized in normalized_transcriptions] ).delete()
+        cls.objects.bulk_create( normalized_transcriptions )
+        return len(normalized_transcriptions)
+
+    @classmethod
+    def texts( cls, manuscript_ids, verse_ids ):
+        """
+        Returns a dictionary keyed by (manuscript ID, verse ID) with the normalized texts of the transcriptions in these manuscripts and verses.
+
+        Transcriptions which do not have a normalized text for the current version are normalized and stored first.
+        There are no keys for verses which a manuscript has not transcribed.
+        """
+        manuscript_ids = list(manuscript_ids)
+        verse_ids = list(verse_ids)
+        missing = VerseTranscriptionBase.objects.filter(
+            manuscript_id__in=manuscript_ids,
+            verse_id__in=verse_ids,
+        ).exclude( normalized__version=NORMALIZATION_VERSION )
+        cls.fill( missing )
+
+        stored = cls.objects.filter(
+            manuscript_id__in=manuscript_ids,
+            verse_id__in=verse_ids,
+            version=NORMALIZATION_VERSION,
+        ).order_by( '-transcription_id' ).values_list( 'manuscript_id', 'verse_id', 'text' )
+
+        # The earliest transcription is used if there are more than one for a verse, the same as Manuscript.transcription
+        return {(manuscript_id, verse_id): text for manuscript_id, verse_id, text in stored}
+
+
+class TranscriptionsVersion(models.Model):
+    """
+    A version number for the transcriptions of a manuscript which is incremented whenever one of them is saved or deleted.
+
+    It is stored in the database (rather than in the Django cache) so that every process sees the same version
+    and the fingerprints of the transcriptions (see `similarity.transcriptions_fingerprint`) agree between them.
+    """
+    manuscript = models.OneToOneField(Manuscript, on_delete=models.CASCADE, related_name='+')
+    version = models.PositiveBigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.manuscript_id}: {self.version}"
+
+    @classmethod
+    def get_version( cls, manuscript_id ):
+        """ Returns the version number for the transcriptions of a manuscript (zero if they have never changed). """
+        return cls.objects.filter( manuscript_id=manuscript_id ).values_list( 'version', flat=True ).first() or 0
+
+    @classmethod
+    def bump( cls, manuscript_id ):
+        """ Increments the version number for the transcriptions of a manuscript. """
+        cls.objects.get_or_create( manuscript_id=manuscript_id )
+        cls.objects.filter( manuscript_id=manuscript_id ).update( version=F('version') + 1 )
+
+
+class GotohCounts(models.Model):
+    """
+    A cached result of aligning two normalized transcriptions with `gotoh.counts`.
+
+    Entries are keyed by a hash of both texts and the Gotoh parameters so that a changed transcription never matches an old entry.
+    The hashes of the individual texts are kept so that the entries of texts which are no longer transcribed can be deleted with `prune`
+    (see the prune-gotoh-counts command).
+    """
+    key = models.CharField(max_length=40, unique=True, help_text="A hash of both texts and the Gotoh parameters.")
+    base_hash = models.CharField(max_length=40, db_index=True, help_text="A hash of the normalized base text.")
+    comparison_hash = models.CharField(max_length=40, db_index=True, help_text="A hash of the normalized comparison text.")
+    matches = models.IntegerField()
+    mismatches = models.IntegerField()
+    gap_openings = models.IntegerField()
+    gap_extensions = models.IntegerField()
+
+    class Meta:
+        verbose_name_plural = 'Gotoh counts'
+
+    def __str__(self):
+        return f"{self.key}: {self.counts()}"
+
+    def counts(self):
+        return (self.matches, self.mismatches, self.gap_openings, self.gap_extensions)
+
+    @classmethod
+    def text_hash( cls, text ):
+        return hashlib.sha1( text.encode("utf-8") ).hexdigest()
+
+    @classmethod
+    def make_key( cls, base_hash, comparison_hash, gotoh_param ):
+        param_string = ",".join( repr(float(x)) for x in gotoh_param )
+        return hashlib.sha1( f"{base_hash}|{comparison_hash}|{param_string}".encode("utf-8") ).hexdigest()
+
+    @classmethod
+    def current_text_hashes( cls, batch_size=2000 ):
+        """ Returns the set of the hashes of the normalized transcriptions for the current NORMALIZATION_VERSION. """
+        texts = NormalizedTranscription.objects.filter( version=NORMALIZATION_VERSION ).values_list( 'text', flat=True )
+        return {cls.text_hash( text ) for text in texts.iterator( chunk_size=batch_size )}
+
+    @classmethod
+    def prune( cls, text_hashes=None, batch_size=500 ):
+        """
+        Deletes the cached alignments of texts which are no longer the normalized text of any transcription.
+
+        `text_hashes` is the set of the hashes of the texts to keep and defaults to `current_text_hashes`.
+        The hashes in the cache are read from the indexes of the hash columns. Returns the number of entries deleted.
+        """
+        if text_hashes is None:
+            text_hashes = cls.current_text_hashes()
+        cached_hashes = set( cls.objects.order_by().values_list( 'base_hash', flat=True ).distinct() )
+        cached_hashes.update( cls.objects.order_by().values_list( 'comparison_hash', flat=True ).distinct() )
+        stale_hashes = sorted( cached_hashes - set(text_hashes) )
+
+        deleted = 0
+        for start in range(0, len(stale_hashes), batch_size):
+            batch = stale_hashes[start:start+batch_size]
+            count, _ = cls.objects.filter( models.Q(base_hash__in=batch) | models.Q(comparison_hash__in=batch) ).delete()
+            deleted += count
+        return deleted
+
+
+class LectionGotohTotals(models.Model):
+    """
+    The total Gotoh counts from aligning the verses of a lection in a base manuscript with a comparison manuscript.
+
+    These rows materialize the similarity tables for a system so that they can be read with queries instead of aligning the texts.
+    There is a row for every lection of the system once a pair of manuscripts has been materialized (see `similarity.materialized_lection_counts`)
+    and the rows for the lections containing a verse are recomputed when a transcription of that verse is saved.
+    """
+    system = models.ForeignKey(LectionarySystem, on_delete=models.CASCADE)
+    lection = models.ForeignKey(Lection, on_delete=models.CASCADE)
+    base_ms = models.ForeignKey(Manuscript, on_delete=models.CASCADE, related_name='+')
+    comparison_ms = models.ForeignKey(Manuscript, on_delete=models.CASCADE, related_name='+')
+    parameters_key = models.CharField(max_length=40, help_text="A hash of the Gotoh parameters and whether incipits are ignored.")
+    gotoh_param = models.JSONField()
+    ignore_incipits = models.BooleanField(default=False)
+    matches = models.IntegerField(default=0)
+    mismatches = models.IntegerField(default=0)
+    gap_openings = models.IntegerField(default=0)
+    gap_extensions = models.IntegerField(default=0)
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name_plural = 'lection Gotoh totals'
+        unique_together = ('system', 'lection', 'base_ms', 'comparison_ms', 'parameters_key')
+        indexes = [models.Index(fields=['system', 'base_ms', 'parameters_key'], name='gotoh_totals_system_base_idx')]
+
+    def __str__(self):
+        return f"{self.lection}: {self.base_ms_id} with {self.comparison_ms_id}: {self.counts()}"
+
+    def counts(self):
+        return (self.matches, self.mismatches, self.gap_openings, self.gap_extensions)
+
+    def set_counts(self, counts):
+        self.matches, self.mismatches, self.gap_openings, self.gap_extensions = (int(count) for count in counts)
+
+    @classmethod
+    def make_parameters_key( cls, gotoh_param, ignore_incipits ):
+        param_string = ",".join( repr(float(x)) for x in gotoh_param )
+        return hashlib.sha1( f"{param_string}|{bool(ignore_incipits)}".encode("utf-8") ).hexdigest()
+
+
+class MinHashSketch(models.Model):
+    """
+    The MinHash sketch of the normalized text of a lection in a manuscript and the hashes of its bands for an LSH index (see `minhash`).
+
+    The sketches let the manuscripts most like a manuscript in a lection be found without aligning the texts (see `similarity.nearest_manuscripts`).
+    The rows for the lections containing a verse are recomputed when a transcription of that verse is saved.
+    """
+    manuscript = models.ForeignKey(Manuscript, on_delete=models.CASCADE, related_name='+')
+    lection = models.ForeignKey(Lection, on_delete=models.CASCADE)
+    parameters_key = models.CharField(max_length=40, help_text="A hash of the MinHash parameters, the number of bands and whether incipits are ignored.")
+    parameters = models.JSONField()
+    sketch = models.BinaryField(help_text="The uint32 values of the sketch.")
+    band_hashes = models.BinaryField(help_text="The uint64 hashes of the bands of the sketch.")
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('manuscript', 'lection', 'parameters_key')
+        indexes = [models.Index(fields=['lection', 'parameters_key'], name='minhash_lection_idx')]
+
+    def __str__(self):
+        return f"{self.lection}: {self.manuscript_id}"
+
+    def sketch_array(self):
+        return np.frombuffer( bytes(self.sketch), dtype=np.uint32 )
+
+    def band_hashes_array(self):
+        return np.frombuffer( bytes(self.band_hashes), dtype=np.uint64 )
+
+    @classmethod
+    def make_parameters_key( cls, parameters ):
+        parameter_string = ",".join( f"{key}={parameters[key]!r}" for key in sorted(parameters) )
+        return hashlib.sha1( parameter_string.encode("utf-8") ).hexdigest()
+
+
+class SimilarityJob(models.Model):
+    """
+    A similarity computation which is run in the background because it takes too long for a single request.
+
+    The job is identified by the cache key of its result so that a job is reused until a transcription in one of the manuscripts changes.
+    """
+    SIMILARITY_DICT = 'similarity_dict'
+    LECTION_COUNTS = 'lection_counts'
+    KIND_CHOICES = [
+        (SIMILARITY_DICT, 'Similarity'),
+        (LECTION_COUNTS, 'Lection Counts'),
+    ]
+
+    PENDING = 'P'
+    RUNNING = 'R'
+    DONE = 'D'
+    FAILED = 'F'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    kind = models.CharField(max_length=31, choices=KIND_CHOICES)
+    key = models.CharField(max_length=255, db_index=True, help_text="The cache key for the result of this job.")
+    system = models.ForeignKey(LectionarySystem, on_delete=models.CASCADE)
+    base_ms = models.ForeignKey(Manuscript, on_delete=models.CASCADE, related_name='+')
+    comparison_sigla = models.TextField(help_text="The sigla of the comparison manuscripts separated by commas.")
+    parameters = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=1, choices=STATUS_CHOICES, default=PENDING)
+    processed = models.PositiveIntegerField(default=0, help_text="The number of lections processed so far.")
+    total = models.PositiveIntegerField(default=0, help_text="The total number of lections to process.")
+    result = models.JSONField(default=None, null=True, blank=True)
+    error = models.TextField(default="", blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ('-created',)
+
+    def __str__(self):
+        return f"{self.get_kind_display()}: {self.base_ms.siglum} with {self.comparison_sigla} ({self.get_status_display()})"
+
+    def comparison_mss(self):
+        sigla = self.comparison_sigla.split(",")
+        mss = {ms.siglum: ms for ms in Manuscript.objects.filter(siglum__in=sigla)}
+        return [mss[siglum] for siglum in sigla if siglum in mss]
+
+    def percent(self):
+        return 100.0 * self.processed/self.total if self.total else 0.0
+
+    def is_finished(self):
+        return self.status in (self.DONE, self.FAILED)
+
+    def set_progress(self, processed, total):
+        self.processed = processed
+        self.total = total
+        SimilarityJob.objects.filter(id=self.id).update(processed=processed, total=total, updated=timezone.now())
+
+    def progress_dict(self):
+        return dict(
+            id=self.id,
+            status=self.get_status_display(),
+            finished=self.is_finished(),
+            processed=self.processed,
+            total=self.total,
+            percent=self.percent(),
+            error=self.error,
+        )
+
+    def similarity_dict(self):
+        """ Returns the result of a finished SIMILARITY_DICT job in the same form as `similarity.similarity_dict`. """
+        comparison_mss = self.comparison_mss()
+        lections_in_system = LectionInSystem.objects.in_bulk([int(id) for id in self.result.keys()])
+        return {
+            lections_in_system[int(id)]: dict(zip(comparison_mss, similarities))
+            for id, similarities in self.result.items()
+            if int(id) in lections_in_system
+        }
+
+    def lection_counts(self):
+        """ Returns the result of a finished LECTION_COUNTS job in the same form as `similarity.similarity_lection_counts`. """
+        ids = self.result['lections_in_system']
+        counts = np.array( self.result['counts'], dtype=np.int64 ).reshape( len(ids), -1, 4 )
+        lections_in_system = LectionInSystem.objects.select_related('lection').in_bulk(ids)
+        present = [index for index, id in enumerate(ids) if id in lections_in_system]
+        return [lections_in_system[ids[index]] for index in present], counts[present]
+
+    @classmethod
+    def prune(cls, older_than):
+        """
+        Deletes the jobs which finished (or failed) before a datetime. Returns the number of jobs deleted.
+
+        The results of the jobs are also kept in the Django cache so a pruned job is only run again if its result is no longer in the cache.
+        """
+        count, _ = cls.objects.filter(status__in=[cls.DONE, cls.FAILED], updated__lt=older_than).delete()
+        return count
+
+
+class SimilarityParameters(models.Model):
+    """
+    A named set of parameters for scoring the similarity between manuscripts.
+
+    The logistic `weights` multiply the matches, mismatches, gap openings and gap extensions from aligning with `gotoh_param`
+    (leaving out the first verse of each lection if `ignore_incipits` is True).
+    These are usually fitted with the `fit-similarity-weights` management command.
+    """
+    name = models.CharField(max_length=255, unique=True)
+    description = models.TextField(default="", blank=True)
+    weights = models.JSONField(help_text="The logistic weights for the matches, mismatches, gap openings and gap extensions.")
+    gotoh_param = models.JSONField(help_text="The match, mismatch, gap opening and gap extension scores used for the alignments.")
+    prior_log_odds = models.FloatField(default=0.0)
+    ignore_incipits = models.BooleanField(default=True, help_text="Whether the first verse of each lection is left out of the alignments.")
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ('name',)
+        verbose_name_plural = 'Similarity parameters'
+
+    def __str__(self):
+        return self.name
+
+    def parameters(self):
+        """ Returns a dictionary of the keyword arguments for the similarity functions. """
+        return dict( weights=self.weights, gotoh_param=self.gotoh_param, prior_log_odds=self.prior_log_odds, ignore_incipits=self.ignore_incipits )
@@ -0,0 +1,116 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from dcodex.models import Manuscript
+from . import alignment
+from .similarity import DEFAULT_GOTOH_PARAM, LectionVerses, encoded_lections_texts, similarity_and_probability_arrays
+
+
+class PairwiseSimilarity():
+    """
+    The similarity between every pair of a set of manuscripts for each lection in a lectionary system.
+
+    Each unordered pair of manuscripts is aligned once per verse (with the manuscript earlier in the list as the first sequence)
+    and the counts are used for both directions.
+    The counts are kept in `counts` which is an array of shape (manuscripts, manuscripts, lections, 4)
+    and the texts of each manuscript are kept in `texts` as EncodedTexts with the verses of lection i from `lection_offsets[i]`.
+    """
+    def __init__( self, system, mss, min_verses=2, gotoh_param=None, ignore_incipits=False ):
+        self.system = system
+        self.mss = [Manuscript.find( ms ) if isinstance(ms, str) else ms for ms in mss]
+        self.gotoh_param = gotoh_param or DEFAULT_GOTOH_PARAM
+        self.ignore_incipits = ignore_incipits
+        self.lections_in_system = system.lections_in_system_min_verses( min_verses )
+        self.lection_verses = LectionVerses( system )
+        self.lection_offsets = None
+        self.texts = [None] * len(self.mss)
+        self.counts = np.zeros( (len(self.mss), len(self.mss), len(self.lections_in_system), 4), dtype=np.int64 )
+
+    @property
+    def sigla(self):
+        return [ms.siglum for ms in self.mss]
+
+    def load_texts( self, ms ):
+        """ Returns the normalized transcriptions of every verse of the lections as EncodedTexts (see `similarity.encoded_lections_texts`). """
+        encoded, self.lection_offsets = encoded_lections_texts(
+            ms,
+            [lection_in_system.lection for lection_in_system in self.lections_in_system],
+            ignore_incipits=self.ignore_incipits,
+            lection_verses=self.lection_verses,
+        )
+        return encoded
+
+    def compute( self, n_jobs=1 ):
+        """ Loads the texts of all the manuscripts and aligns every pair. """
+        self.texts = [self.load_texts( ms ) for ms in self.mss]
+        self.align_rows( range(len(self.mss)), n_jobs=n_jobs )
+        return self
+
+    def update( self, mss=None, n_jobs=1 ):
+        """
+        Realigns only the pairs which include manuscripts with changed transcriptions.
+
+        If `mss` is None then the texts of all the manuscripts are reloaded and compared with the texts from the last alignment to find which have changed.
+        Returns the indexes of the manuscripts that were updated.
+        """
+        if mss is None:
+            changed = []
+            for ms_index, ms in enumerate(self.mss):
+                texts = self.load_texts( ms )
+                if texts != self.texts[ms_index]:
+                    self.texts[ms_index] = texts
+                    changed.append( ms_index )
+        else:
+            sigla = self.sigla
+            changed = [sigla.index( ms if isinstance(ms, str) else ms.siglum ) for ms in mss]
+            for ms_index in changed:
+                self.texts[ms_index] = self.load_texts( self.mss[ms_index] )
+
+        self.align_rows( changed, n_jobs=n_jobs )
+        return changed
+
+    def align_rows( self, ms_indexes, n_jobs=1 ):
+        """ Aligns each manuscript in `ms_indexes` with every other manuscript and stores the counts in both directions. """
+        ms_indexes = set(ms_indexes)
+        pairs = [
+            (i, j)
+            for i in range(len(self.mss))
+            for j in range(i+1, len(self.mss))
+            if i in ms_indexes or j in ms_indexes
+        ]
+
+        n_jobs = alignment.resolve_n_jobs( n_jobs )
+        if n_jobs == 1:
+            results = [alignment.encoded_pair_lection_counts( self.texts[i], self.texts[j], self.lection_offsets, self.gotoh_param ) for i, j in pairs]
+        else:
+            with ProcessPoolExecutor( max_workers=n_jobs ) as executor:
+                futures = [executor.submit( alignment.encoded_pair_lection_counts, self.texts[i], self.texts[j], self.lection_offsets, self.gotoh_param ) for i, j in pairs]
+                results = [future.result() for future in futures]
+
+        for (i, j), counts in zip(pairs, results):
+            self.counts[i,j] = counts
+            self.counts[j,i] = counts
+
+        for i in ms_indexes:
+            self.counts[i,i] = alignment.encoded_self_lection_counts( self.texts[i], self.lection_offsets )
+
+    def similarity_array( self ):
+        """ Returns an array of shape (manuscripts, manuscripts, lections) with the similarity percentages (NaN where there is no text in common). """
+        similarity, _ = similarity_and_probability_arrays( self.counts )
+        return similarity
+
+    def probability_array( self, weights=None, prior_log_odds=0.0 ):
+        """ Returns an array of shape (manuscripts, manuscripts, lections) with the posterior probabilities from the logistic weights. """
+        _, probability = similarity_and_probability_arrays( self.counts, weights, prior_log_odds )
+        return probability
+
+    def profiles( self ):
+        """
+        Returns an array of shape (manuscripts, manuscripts, lections) with the similarity profile of each manuscript for `similarity.cluster_manuscripts`.
+
+        This is the similarity array with NaN where a manuscript is compared with itself.
+        """
+        profiles = self.similarity_array()
+        profiles[np.arange( len(self.mss) ), np.arange( len(self.mss) )] = np.nan
+        return profiles
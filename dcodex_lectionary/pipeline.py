@@ -0,0 +1,193 @@
+"""
+A producer/consumer pipeline which overlaps loading batches of work with processing them.
+
+A fetch thread loads the batches one after the other and puts them into a bounded queue. The calling thread takes them from the queue
+and aligns them, either itself or in a pool of worker processes, and then finishes each batch in the original order.
+When the queue is full the fetch thread waits (backpressure) and when it is empty the alignment waits (starvation).
+These waits, the depth of the queue and the time in each stage are recorded in `PipelineStats` so that the batch and queue sizes can be tuned.
+Nothing in this module imports Django models.
+"""
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import queue
+import threading
+import time
+
+import numpy as np
+
+_DONE = object()
+
+
+class _Failure():
+    def __init__( self, exception ):
+        self.exception = exception
+
+
+def timed_call( function, *args ):
+    """ Calls a function and returns its result with the time it took in seconds. This is run in the worker processes. """
+    start = time.perf_counter()
+    result = function( *args )
+    return result, time.perf_counter() - start
+
+
+class PipelineStats():
+    """
+    The times and queue depths from running a pipeline.
+
+    `fetch_seconds`, `align_seconds` and `finish_seconds` are the total times spent in each stage (the alignment time is summed over the workers).
+    `backpressure_seconds` is the time the fetch thread waited for space in the queue and `backpressure_count` is the number of batches it waited for.
+    `starvation_seconds` is the time the alignment waited for a batch to be fetched.
+    `queue_depths` has the number of batches waiting in the queue each time a batch was taken from it.
+    """
+    def __init__( self ):
+        self.batches = 0
+        self.fetch_seconds = 0.0
+        self.align_seconds = 0.0
+        self.finish_seconds = 0.0
+        self.backpressure_seconds = 0.0
+        self.backpressure_count = 0
+        self.starvation_seconds = 0.0
+        self.wall_seconds = 0.0
+        self.queue_size = 0
+        self.n_jobs = 1
+        self.threaded = False
+        self.queue_depths = []
+
+    def as_dict( self ):
+        depths = np.array( self.queue_depths, dtype=float )
+        return dict(
+            batches=self.batches,
+            threaded=self.threaded,
+            queue_size=self.queue_size,
+            n_jobs=self.n_jobs,
+            wall_seconds=self.wall_seconds,
+            fetch_seconds=self.fetch_seconds,
+            align_seconds=self.align_seconds,
+            finish_seconds=self.finish_seconds,
+            backpressure_seconds=self.backpressure_seconds,
+            backpressure_count=self.backpressure_count,
+            starvation_seconds=self.starvation_seconds,
+            mean_queue_depth=float(depths.mean()) if len(depths) else 0.0,
+            max_queue_depth=int(depths.max()) if len(depths) else 0,
+        )
+
+    def __str__(self):
+        return ", ".join( f"{key}={value:.3f}" if isinstance(value, float) else f"{key}={value}" for key, value in self.as_dict().items() )
+
+
+def run_pipeline( batches, fetch, align, finish, queue_size=2, n_jobs=1, stats=None, threaded=True, on_thread_exit=None ):
+    """
+    Fetches, aligns and finishes a sequence of batches.
+
+    `fetch(batch)` loads a batch and returns a tuple of the arguments for `align` and a context for `finish`. It runs in the fetch thread if `threaded` is True.
+    `align(*arguments)` processes the batch. It must be a module-level function if `n_jobs` is not 1 because it is then sent to worker processes.
+    `finish(context, result)` is called in the calling thread in the order of the batches.
+    At most `queue_size` fetched batches wait in the queue and at most twice `n_jobs` batches are submitted to the workers at once
+    (so each worker has a batch waiting while the calling thread finishes the results).
+    `on_thread_exit` is called in the fetch thread when it finishes (for example, to close its database connection).
+    Any exception in a stage is raised in the calling thread. Returns the PipelineStats (the object in `stats` if it is given).
+    """
+    stats = stats or PipelineStats()
+    stats.queue_size = queue_size
+    stats.n_jobs = n_jobs
+    stats.threaded = threaded
+    start = time.perf_counter()
+
+    def fetch_timed( batch ):
+        fetch_start = time.perf_counter()
+        item = fetch( batch )
+        stats.fetch_seconds += time.perf_counter() - fetch_start
+        return item
+
+    def inline_items():
+        for batch in batches:
+            yield fetch_timed( batch )
+
+    def threaded_items():
+        fetched = queue.Queue( maxsize=max( queue_size, 1 ) )
+        stop = threading.Event()
+
+        def put( item ):
+            """ Puts an item in the queue, waiting while it is full unless the pipeline has been stopped. Returns False if it was stopped. """
+            try:
+                fetched.put_nowait( item )
+                return True
+            except queue.Full:
+                pass
+
+            wait_start = time.perf_counter()
+            stats.backpressure_count += 1
+            try:
+                while not stop.is_set():
+                    try:
+                        fetched.put( item, timeout=0.05 )
+                        return True
+                    except queue.Full:
+                        pass
+                return False
+            finally:
+                stats.backpressure_seconds += time.perf_counter() - wait_start
+
+        def produce():
+            try:
+                for batch in batches:
+                    if not put( fetch_timed( batch ) ):
+                        return
+                put( _DONE )
+            except BaseException as exception:
+                put( _Failure( exception ) )
+            finally:
+                if on_thread_exit:
+                    on_thread_exit()
+
+        thread = threading.Thread( target=produce, name="dcodex-lectionary-fetch", daemon=True )
+        thread.start()
+        try:
+            while True:
+                stats.queue_depths.append( fetched.qsize() )
+                wait_start = time.perf_counter()
+                item = fetched.get()
+                stats.starvation_seconds += time.perf_counter() - wait_start
+                if item is _DONE:
+                    return
+                if isinstance( item, _Failure ):
+                    raise item.exception
+                yield item
+        finally:
+            stop.set()
+            thread.join()
+
+    def finish_timed( context, result ):
+        finish_start = time.perf_counter()
+        finish( context, result )
+        stats.finish_seconds += time.perf_counter() - finish_start
+        stats.batches += 1
+
+    items = threaded_items() if threaded else inline_items()
+    try:
+        if n_jobs == 1:
+            for arguments, context in items:
+                result, seconds = timed_call( align, *arguments )
+                stats.align_seconds += seconds
+                finish_timed( context, result )
+        else:
+            with ProcessPoolExecutor( max_workers=n_jobs ) as executor:
+                pending = deque()
+
+                def finish_next():
+                    context, future = pending.popleft()
+                    result, seconds = future.result()
+                    stats.align_seconds += seconds
+                    finish_timed( context, result )
+
+                for arguments, context in items:
+                    if len(pending) >= 2 * n_jobs:
+                        finish_next()
+                    pending.append( (context, executor.submit( timed_call, align, *arguments )) )
+                while pending:
+                    finish_next()
+    finally:
+        items.close()
+        stats.wall_seconds = time.perf_counter() - start
+
+    return stats
@@ -37,6 +37,11 @@ def plot_lections_similarity(
     space_evenly=False,
     ignore_untranscribed=False,
     yaxis_title=None,
+    n_jobs=1,
+    cache=None,
+    error_bands=False,
+    bootstrap=1000,
+    error_band_alpha=0.15,
 ):
 
     import pandas as pd
@@ -74,10 +79,12 @@ def plot_lections_similarity(
     assert system is not None
 
     # Calculate Data
+    # The error bands are the bootstrap confidence intervals from resampling the verses of each lection
+    bootstrap = bootstrap if error_bands else 0
     if not force_compute and csv_filename and isfile( csv_filename ) and access(csv_filename, R_OK):
         df = pd.read_csv(csv_filename)
     else:    
-        df = similarity_probabilities_df( system, base_ms, mss, weights=weights, gotoh_param=gotoh_param, prior_log_odds=prior_log_odds )
+        df = similarity_probabilities_df( system, base_ms, mss, weights=weights, gotoh_param=gotoh_param, prior_log_odds=prior_log_odds, n_jobs=n_jobs, cache=cache, bootstrap=bootstrap )
         if csv_filename:
             csv_path = Path(csv_filename)
             csv_path.parent.mkdir(exist_ok=True, parents=True)
@@ -122,6 +129,9 @@ def plot_lections_similarity(
 
     for index, ms_siglum in enumerate(mss_sigla.keys()): 
         ms_df = df[ df[ms_siglum+'_similarity'].notnull() ] if ignore_untranscribed else df
+
+        if error_bands and ms_siglum+'_similarity_lower' in ms_df:
+            plt.fill_between(ms_df.index, ms_df[ms_siglum+'_similarity_lower'], ms_df[ms_siglum+'_similarity_upper'], color=colors[index], alpha=error_band_alpha, linewidth=0, zorder=5)
         
         
         if mode is HIGHLY_LIKELY__LIKELY__ELSE:
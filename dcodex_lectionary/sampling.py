@@ -0,0 +1,190 @@
+"""
+Approximate similarity from random samples of the verses of lections and the uncertainty of the similarity from resampling verses.
+
+`SampledSimilarity` estimates the similarity from a sample of the verses of a lection which is refined as more verses are aligned.
+
+The verses are sampled with priority sampling (Duffield, Lund and Thorup) where each verse has a priority of its mass divided by a uniform random number.
+Taking the verses in order of decreasing priority gives a sample weighted by mass which grows without changing the verses already chosen.
+The sums over the sample are weighted so that they are unbiased estimates of the sums over the whole lection
+and the weights are all one once every verse has been aligned, so the estimate converges to the exact similarity.
+
+`bootstrap_lection_intervals` gives confidence intervals for the similarity of whole lections by resampling their verses.
+Nothing in this module imports Django models.
+"""
+import warnings
+import numpy as np
+from scipy.special import expit
+from scipy.stats import norm
+
+from . import alignment
+
+
+def priority_order( masses, rng ):
+    """
+    Returns the priority of each verse and the order of the verses by decreasing priority.
+
+    The priority is the mass divided by a uniform random number in (0, 1]. Verses without mass are given the smallest positive mass.
+    """
+    masses = np.maximum( np.asarray( masses, dtype=float ), 1.0 )
+    priorities = masses/(1.0 - rng.random( len(masses) ))
+    return priorities, np.argsort( -priorities, kind='stable' )
+
+
+class SampledSimilarity():
+    """
+    Estimates the similarity of the comparison manuscripts with the base manuscript over a lection from a sample of its verses.
+
+    `transcriptions` has the same format as for `alignment.verse_counts` and `masses` has the mass of each verse (by default the length of the base transcription).
+    The verses without a base transcription are never sampled. The same `seed` always gives the same order of verses.
+    Call `refine` to align more verses and `estimate` for the similarity and its confidence interval.
+    """
+    def __init__( self, transcriptions, comparison_count, gotoh_param, masses=None, seed=0, backend=None ):
+        self.transcriptions = list(transcriptions)
+        self.comparison_count = comparison_count
+        self.gotoh_param = gotoh_param
+        self.backend = backend
+
+        self.verse_indexes = np.array( [index for index, (base_transcription, _) in enumerate(self.transcriptions) if base_transcription], dtype=np.int64 )
+        if masses is None:
+            masses = [len(base_transcription or "") for base_transcription, _ in self.transcriptions]
+        self.masses = np.maximum( np.asarray( masses, dtype=float )[self.verse_indexes], 1.0 )
+        self.priorities, self.order = priority_order( self.masses, np.random.default_rng( seed ) )
+
+        self.counts = np.zeros( (len(self.verse_indexes), comparison_count, 4), dtype=np.int64 )
+        self.aligned_count = 0
+
+    def __len__(self):
+        return len(self.verse_indexes)
+
+    @property
+    def is_exact(self):
+        return self.aligned_count >= len(self)
+
+    def aligned_mass_fraction( self ):
+        """ Returns the fraction of the mass of the lection which has been aligned. """
+        total = self.masses.sum()
+        return float(self.masses[self.order[:self.aligned_count]].sum()/total) if total > 0 else 1.0
+
+    def refine( self, verse_count=1 ):
+        """ Aligns the next `verse_count` verses in the order of the sample. Returns the number of verses aligned. """
+        sample = self.order[self.aligned_count:self.aligned_count+verse_count]
+        if len(sample):
+            transcriptions = [self.transcriptions[index] for index in self.verse_indexes[sample]]
+            self.counts[sample] = alignment.verse_counts( transcriptions, self.comparison_count, self.gotoh_param, backend=self.backend )
+            self.aligned_count += len(sample)
+        return len(sample)
+
+    def refine_to_fraction( self, fraction ):
+        """ Aligns verses in the order of the sample until at least `fraction` of the mass of the lection has been aligned. Returns the number of verses aligned. """
+        cumulative = np.cumsum( self.masses[self.order] )
+        target = fraction * cumulative[-1] if len(cumulative) else 0.0
+        verse_count = int(np.searchsorted( cumulative, target - 1e-9*max( target, 1.0 ), side='left' )) + 1
+        return self.refine( max( 0, min( verse_count, len(self) ) - self.aligned_count ) )
+
+    def weights( self ):
+        """
+        Returns the weight of each aligned verse (in the order of the sample) and the threshold priority.
+
+        The threshold is the priority of the first verse which has not been aligned (or zero if they all have).
+        Each weight is the inverse of the probability that the verse would be in a sample of this size given the threshold.
+        """
+        sample = self.order[:self.aligned_count]
+        threshold = self.priorities[self.order[self.aligned_count]] if self.aligned_count < len(self) else 0.0
+        return np.maximum( 1.0, threshold/self.masses[sample] ), sample
+
+    def estimate( self, confidence=0.95 ):
+        """
+        Returns arrays with the estimated similarity percentage of each comparison manuscript and the lower and upper bounds of the confidence interval.
+
+        The similarity is the ratio of the weighted sums of the matches and of the alignment lengths over the sample.
+        Its variance is estimated by linearizing the ratio with the variance estimator for priority sampling, which is zero once every verse has been aligned.
+        The estimates are NaN for manuscripts without any text aligned. If nothing in the sample could be aligned but verses remain then the interval is 0 to 100.
+        """
+        weights, sample = self.weights()
+        counts = self.counts[sample]
+        matches = counts[:,:,0]
+        lengths = counts.sum( axis=2 )
+        estimated_matches = weights @ matches
+        estimated_lengths = weights @ lengths
+
+        with np.errstate( divide='ignore', invalid='ignore' ):
+            ratio = np.where( estimated_lengths > 0, estimated_matches/estimated_lengths, np.nan )
+            residuals = (matches - np.nan_to_num( ratio )*lengths)/estimated_lengths
+        variance_factors = weights*(weights - 1.0)
+        variance = variance_factors @ np.nan_to_num( residuals )**2
+
+        half_width = norm.ppf( 0.5 + 0.5*confidence ) * np.sqrt( variance )
+        similarity = 100.0 * ratio
+        lower = np.clip( 100.0 * (ratio - half_width), 0.0, 100.0 )
+        upper = np.clip( 100.0 * (ratio + half_width), 0.0, 100.0 )
+
+        if not self.is_exact:
+            unknown = np.isnan( ratio )
+            lower[unknown] = 0.0
+            upper[unknown] = 100.0
+        return similarity, lower, upper
+
+
+def bootstrap_lection_intervals(
+    verse_counts,
+    lection_index,
+    lection_count,
+    weights,
+    prior_log_odds=0.0,
+    resamples=1000,
+    confidence=0.95,
+    seed=0,
+    max_elements=4_000_000,
+):
+    """
+    Returns bootstrap confidence intervals for the similarity and probability of each lection from resampling its verses with replacement.
+
+    `verse_counts` is an array of shape (verses, manuscripts, 4) and `lection_index` gives the lection of each verse (as in `similarity.SimilarityCounts`).
+    Every lection is resampled `resamples` times at once with NumPy, in chunks of resamples so that no array has more than about `max_elements` elements.
+    Returns a dictionary with arrays of shape (lections, manuscripts) for 'similarity_lower', 'similarity_upper', 'probability_lower' and 'probability_upper'.
+    The bounds are percentiles of the resampled values and they are NaN for lections without any aligned text.
+    """
+    verse_counts = np.asarray( verse_counts )
+    lection_index = np.asarray( lection_index, dtype=np.int64 )
+    order = np.argsort( lection_index, kind='stable' )
+    verse_counts = verse_counts[order]
+    lection_index = lection_index[order]
+    verse_total, ms_count = verse_counts.shape[:2]
+
+    sizes = np.bincount( lection_index, minlength=lection_count )
+    starts = np.zeros( (lection_count,), dtype=np.int64 )
+    np.cumsum( sizes[:-1], out=starts[1:] )
+    present = sizes > 0
+
+    similarity = np.full( (resamples, lection_count, ms_count), np.nan )
+    probability = np.full( (resamples, lection_count, ms_count), np.nan )
+    rng = np.random.default_rng( seed )
+    weights = np.asarray( weights, dtype=float )
+
+    if verse_total:
+        # Each verse is replaced by a random verse from the same lection
+        slot_starts = starts[lection_index]
+        slot_sizes = sizes[lection_index]
+        chunk = max( 1, max_elements//(verse_total * ms_count * 4 or 1) )
+        for start in range(0, resamples, chunk):
+            count = min( chunk, resamples - start )
+            indexes = slot_starts + (rng.random( (count, verse_total) ) * slot_sizes).astype( np.int64 )
+            totals = np.add.reduceat( verse_counts[indexes], starts[present], axis=1 )
+
+            lengths = totals.sum( axis=-1 )
+            with np.errstate( divide='ignore', invalid='ignore' ):
+                similarity[start:start+count, present] = np.where( lengths > 0, 100.0 * totals[...,0]/lengths, np.nan )
+            probability[start:start+count, present] = np.where( lengths > 0, expit( prior_log_odds + totals @ weights ), np.nan )
+
+    tail = 50.0 * (1.0 - confidence)
+    with warnings.catch_warnings():
+        warnings.simplefilter( "ignore", category=RuntimeWarning ) # Lections without text have only NaN values
+        similarity_lower, similarity_upper = np.nanpercentile( similarity, [tail, 100.0 - tail], axis=0 )
+        probability_lower, probability_upper = np.nanpercentile( probability, [tail, 100.0 - tail], axis=0 )
+
+    return dict(
+        similarity_lower=similarity_lower,
+        similarity_upper=similarity_upper,
+        probability_lower=probability_lower,
+        probability_upper=probability_upper,
+    )
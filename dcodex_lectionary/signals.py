@@ -0,0 +1,79 @@
+from django.apps import apps
+from django.db import connection, transaction
+from django.db.models.signals import post_save, post_delete
+
+from dcodex.models import VerseTranscriptionBase
+from .jobs import get_executor, job_threads
+from .models import NormalizedTranscription
+from .similarity import bump_transcriptions_version, update_lection_gotoh_totals, update_minhash_sketches
+
+
+def update_derived_similarity_now( transcription ):
+    """ Recomputes the materialized similarity totals and the stored MinHash sketches for the lections containing the verse of a transcription. """
+    update_lection_gotoh_totals( transcription )
+    update_minhash_sketches( transcription )
+
+
+def update_derived_similarity_in_thread( transcription ):
+    try:
+        update_derived_similarity_now( transcription )
+    finally:
+        connection.close()
+
+
+def update_derived_similarity( transcription ):
+    """
+    Recomputes the data derived from a transcription once the transaction which changed it has been committed
+    so that a transaction which is rolled back does not change it.
+
+    Aligning the lections again and sketching them takes a noticeable time so, if the similarity jobs are run on the thread pool (see `jobs`),
+    the update is queued on that pool and saving a transcription does not wait for it. The derived data is then out of date until the update has run,
+    which can be after the similarity jobs already queued. If there is no thread pool then the update runs in the saving thread when the transaction is committed
+    (immediately under autocommit) and the save waits for it.
+    """
+    def update():
+        if job_threads() > 0:
+            get_executor().submit( update_derived_similarity_in_thread, transcription )
+        else:
+            update_derived_similarity_now( transcription )
+
+    transaction.on_commit( update )
+
+
+def transcription_saved(sender, instance, **kwargs):
+    """
+    Keeps the data derived from a transcription up to date when it is saved.
+
+    The cached similarity results which include its manuscript are invalidated and its normalized text is stored
+    before the lections are aligned again with the new text.
+    """
+    bump_transcriptions_version( instance.manuscript_id )
+    if kwargs.get('raw'):
+        return
+
+    NormalizedTranscription.update_for( instance )
+    update_derived_similarity( instance )
+
+
+def transcription_deleted(sender, instance, **kwargs):
+    """ Keeps the data derived from a transcription up to date when it is deleted. Its normalized text is deleted by cascade. """
+    bump_transcriptions_version( instance.manuscript_id )
+    update_derived_similarity( instance )
+
+
+def transcription_models():
+    """ Returns the concrete models of transcriptions (the senders of the signals of saving a transcription). """
+    return [model for model in apps.get_models() if issubclass(model, VerseTranscriptionBase) and not model._meta.proxy]
+
+
+def connect_signals():
+    """
+    Connects the receivers to the signals sent by each transcription model so that saving other models does not call them.
+
+    The cached Gotoh counts are keyed by the hashes of the texts and are shared by every manuscript with the same text,
+    so they are not expired when a transcription changes: a new text simply has a new key.
+    """
+    for model in transcription_models():
+        uid = model._meta.label_lower
+        post_save.connect( transcription_saved, sender=model, dispatch_uid=f"transcription_saved_{uid}" )
+        post_delete.connect( transcription_deleted, sender=model, dispatch_uid=f"transcription_deleted_{uid}" )
@@ -1,11 +1,42 @@
+import logging
+import math
+import os
+import shutil
+import tempfile
+from collections import defaultdict
+import hashlib
+
 import numpy as np
 import pandas as pd
 from scipy.special import expit
-import gotoh
 
-from dcodex.models import VerseTranscriptionBase
-from dcodex_bible.models import BibleVerse
-from .models import Lectionary
+from django.conf import settings
+from django.core.cache import cache as django_cache
+from django.db import connection, connections
+from django.db.models import Count, Max, Q
+from django.utils import timezone
+
+from dcodex.models import Manuscript, VerseTranscriptionBase
+from .models import Lection, Lectionary, LectionaryVerse, LectionaryVerseMembership, GotohCounts, NormalizedTranscription, LectionGotohTotals, MinHashSketch, TranscriptionsVersion, NORMALIZATION_VERSION
+from . import alignment, sampling, changepoints, clustering, consensus, minhash, pipeline
+from .encoding import EncodedTexts
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WEIGHTS = [0.07124444438506426, -0.2723489152810223, -0.634987796501936, -0.05103656566400282] # From whole dataset
+DEFAULT_GOTOH_PARAM = [6.6995597099885345, -0.9209875054657459, -5.097397327423096, -1.3005714416503906] # From PairHMM of whole dataset
+MAX_CHUNKSIZE = 16 # The maximum number of lections loaded and aligned together
+ALIGNMENT_MODES = ('verses', 'lections') # Align verse by verse or whole lections with the verses joined by alignment.LECTION_SEPARATOR
+PER_LECTION_MIN_SIZE = 2 # The default shortest segment between change points in lections
+PER_VERSE_MIN_SIZE = 5 # The default shortest segment in verses, where a few verses are too noisy to be a segment
+
+# Values in the array from `similarity_families_array`. The family of comparison manuscript i is FAMILY_OFFSET + i.
+FAMILY_NONE = 0
+FAMILY_UNCERTAIN = 1
+FAMILY_MIXED = 2
+FAMILY_OFFSET = 3
+
+DEFAULT_MINHASH_PARAMETERS = dict( permutation_count=128, shingle_size=5, seed=1, band_count=32, ignore_incipits=False )
 
 
 def get_system(base_ms, comparison_ms):
@@ -22,104 +53,1645 @@ def get_system(base_ms, comparison_ms):
     return system
 
 
-def similarity_probabilities_lection( 
-    base_ms, 
-    lection, 
-    comparison_mss, 
-    weights=None, 
-    gotoh_param=None, 
-    prior_log_odds=0.0, 
-    ignore_incipits=False, 
-    include_probabilities=True 
-):
-    weights = weights or [0.07124444438506426, -0.2723489152810223, -0.634987796501936, -0.05103656566400282] # From whole dataset
-    gotoh_param = gotoh_param or [6.6995597099885345, -0.9209875054657459, -5.097397327423096, -1.3005714416503906] # From PairHMM of whole dataset
-    gotoh_totals = np.zeros( (len(comparison_mss),4), dtype=np.int32 )   
-    weights = np.asarray(weights)  
-    
-    for verse_index, verse in enumerate(lection.verses.all()):
-        if verse_index == 0 and ignore_incipits:
-            continue
-        base_transcription = base_ms.normalized_transcription( verse ) if type(base_ms) is Lectionary else base_ms.normalized_transcription( verse.bible_verse )
+def normalized_transcription( ms, verse ):
+    """ Returns the normalized transcription of a lectionary verse in a manuscript, using the Bible verse if it is not a lectionary. """
+    return ms.normalized_transcription( verse ) if type(ms) is Lectionary else ms.normalized_transcription( verse.bible_verse )
+
+
+def transcription_verse_id( ms, verse ):
+    """ Returns the ID of the verse which a manuscript transcribes for a lectionary verse (the Bible verse if it is not a lectionary). """
+    return verse.id if type(ms) is Lectionary else verse.bible_verse_id
+
+
+def stored_normalized_transcriptions( mss, verses ):
+    """
+    Returns a dictionary keyed by (manuscript ID, verse ID) with the stored normalized transcriptions of a set of manuscripts in a set of lectionary verses.
+
+    The verse ID for each manuscript is given by `transcription_verse_id`. The texts are read with a single query
+    and any transcriptions which have not been normalized for the current NORMALIZATION_VERSION are normalized and stored first.
+    """
+    verse_ids = set()
+    for ms in mss:
+        verse_ids.update( transcription_verse_id( ms, verse ) for verse in verses )
+    verse_ids.discard( None )
+    return NormalizedTranscription.texts( {ms.id for ms in mss}, verse_ids )
+
+
+class LectionVerses():
+    """
+    The verses of every lection in a lectionary system which are loaded together in a single query.
+
+    `verses` is a dictionary keyed by the ID of each lection with a list of its LectionaryVerse objects (with the Bible verses already loaded)
+    in the same order as `lection.verses.all()`. `verse_ids` and `bible_verse_ids` have arrays of the IDs of these verses
+    where the Bible verse ID is -1 if the lectionary verse is not mapped to a Bible verse.
+    """
+    def __init__( self, system ):
+        self.verses = defaultdict( list )
+        memberships = (
+            LectionaryVerseMembership.objects
+            .filter( lection__in=system.lections.all() )
+            .select_related( 'verse__bible_verse' )
+            .order_by( 'lection_id', *[f"verse__{field}" for field in LectionaryVerse._meta.ordering] )
+        )
+        for membership in memberships:
+            self.verses[membership.lection_id].append( membership.verse )
+
+        self.verse_ids = {}
+        self.bible_verse_ids = {}
+        for lection_id, verses in self.verses.items():
+            self.verse_ids[lection_id] = np.array( [verse.id for verse in verses], dtype=np.int64 )
+            self.bible_verse_ids[lection_id] = np.array( [verse.bible_verse_id or -1 for verse in verses], dtype=np.int64 )
+
+    def verse_count( self, lection ):
+        """ Returns the number of verses in a lection (the same as `lection.verses.count()`). """
+        return len(self.verses[lection.id])
+
+    def transcription_counts( self, ms ):
+        """
+        Returns a dictionary with the number of transcriptions of a manuscript in the verses of each lection.
+
+        The transcriptions are counted in the lectionary verses if the manuscript is a lectionary and otherwise in the distinct Bible verses.
+        All the lections are counted with a single grouped query.
+        """
+        lectionary = isinstance( ms, Lectionary )
+        lections_ids = self.verse_ids if lectionary else self.bible_verse_ids
+        all_ids = np.unique( np.concatenate( [np.zeros( (0,), dtype=np.int64 )] + list(lections_ids.values()) ) )
+        transcribed = sorted(
+            VerseTranscriptionBase.objects
+            .filter( manuscript=ms, verse_id__in=all_ids[all_ids >= 0].tolist() )
+            .order_by()
+            .values( 'verse_id' )
+            .annotate( transcription_count=Count('id') )
+            .values_list( 'verse_id', 'transcription_count' )
+        )
+        transcribed_ids = np.array( [verse_id for verse_id, _ in transcribed], dtype=np.int64 )
+        transcription_counts = np.array( [count for _, count in transcribed], dtype=np.int64 )
+
+        counts = {}
+        for lection_id, ids in lections_ids.items():
+            ids = np.unique( ids[ids >= 0] )
+            positions = np.searchsorted( transcribed_ids, ids )
+            found = positions < len(transcribed_ids)
+            found[found] = transcribed_ids[positions[found]] == ids[found]
+            counts[lection_id] = int(transcription_counts[positions[found]].sum())
+        return counts
+
+
+def lection_transcriptions( base_ms, lection, comparison_mss, ignore_incipits=False, verses=None ):
+    """
+    Loads the normalized transcriptions for each verse in a lection.
+
+    `verses` is an optional list of the verses of the lection from LectionVerses so that they do not need to be loaded again.
+    The texts come from the stored NormalizedTranscription objects (see `stored_normalized_transcriptions`).
+    Returns a list with a tuple for each verse of the base transcription and a list of the comparison transcriptions.
+    The base transcription is None (and the comparison transcriptions are not loaded) if the verse is to be skipped.
+    """
+    if verses is None:
+        verses = lection.verses.select_related( 'bible_verse' )
+    verses = list(verses)
+    texts = stored_normalized_transcriptions( [base_ms] + list(comparison_mss), verses )
+
+    def text( ms, verse ):
+        return texts.get( (ms.id, transcription_verse_id( ms, verse )) )
+
+    transcriptions = []
+    for verse_index, verse in enumerate(verses):
+        base_transcription = None
+        if verse_index > 0 or not ignore_incipits:
+            base_transcription = text( base_ms, verse )
+
         if not base_transcription:
+            transcriptions.append( (None, []) )
+            continue
+
+        comparison_transcriptions = [text( ms, verse ) for ms in comparison_mss]
+        transcriptions.append( (base_transcription, comparison_transcriptions) )
+
+    return transcriptions
+
+
+def encoded_lections_texts( ms, lections, ignore_incipits=False, lection_verses=None ):
+    """
+    Returns the normalized transcriptions of a manuscript in the verses of a list of lections as EncodedTexts and the offsets of the lections.
+
+    The verses of lection i are the texts from `lection_offsets[i]` up to `lection_offsets[i+1]` in the same order as `lection.verses.all()`.
+    If the setting DCODEX_LECTIONARY_ENCODED_TEXTS_DIR is a directory then the arrays are saved there, keyed by the fingerprint of the transcriptions
+    of the manuscript (which is stored in the database so that every process agrees on it), and they are memory-mapped from there on later calls
+    until a transcription changes. The arrays for earlier fingerprints of the same manuscript and lections are then deleted.
+    """
+    lections = list(lections)
+    lections_verses = [
+        lection_verses.verses[lection.id] if lection_verses else list(lection.verses.select_related( 'bible_verse' ))
+        for lection in lections
+    ]
+    lection_offsets = np.zeros( (len(lections) + 1,), dtype=np.int64 )
+    np.cumsum( [len(verses) for verses in lections_verses], out=lection_offsets[1:] )
+
+    directory = getattr( settings, 'DCODEX_LECTIONARY_ENCODED_TEXTS_DIR', None )
+    if directory:
+        # The arrays are in a directory for the fingerprint inside a directory for the manuscript and the lections
+        components = [[lection.id for lection in lections], bool(ignore_incipits), NORMALIZATION_VERSION]
+        parent = os.path.join( directory, str(ms.id), hashlib.sha1( repr(components).encode("utf-8") ).hexdigest() )
+        directory = os.path.join( parent, hashlib.sha1( repr(transcriptions_fingerprint( ms )).encode("utf-8") ).hexdigest() )
+        if os.path.exists( os.path.join( directory, "alphabet.txt" ) ):
+            return EncodedTexts.load( directory ), lection_offsets
+
+    all_verses = [verse for verses in lections_verses for verse in verses]
+    stored = stored_normalized_transcriptions( [ms], all_verses )
+    texts = []
+    for verses in lections_verses:
+        for verse_index, verse in enumerate(verses):
+            if verse_index == 0 and ignore_incipits:
+                texts.append( None )
+            else:
+                texts.append( stored.get( (ms.id, transcription_verse_id( ms, verse )) ) )
+    encoded = EncodedTexts.from_texts( texts )
+
+    if directory:
+        save_encoded_texts( encoded, directory )
+    return encoded, lection_offsets
+
+
+def save_encoded_texts( encoded, directory ):
+    """
+    Saves EncodedTexts into a directory and deletes the other directories beside it (which have the texts for earlier fingerprints).
+
+    The texts are saved into a temporary directory which is then renamed so that other processes never load a directory which is partly written.
+    Arrays which are still memory-mapped by another process stay readable after their directory is deleted.
+    """
+    parent = os.path.dirname( directory )
+    os.makedirs( parent, exist_ok=True )
+    temporary = tempfile.mkdtemp( dir=parent, prefix=".tmp-" )
+    encoded.save( temporary )
+    try:
+        os.rename( temporary, directory )
+    except OSError:
+        # Another process saved the same texts first
+        shutil.rmtree( temporary, ignore_errors=True )
+
+    for name in os.listdir( parent ):
+        path = os.path.join( parent, name )
+        if path != directory and not name.startswith( ".tmp-" ):
+            shutil.rmtree( path, ignore_errors=True )
+
+
+class GotohCountsCache():
+    """
+    A persistent cache of the results of `gotoh.counts` which is stored in the GotohCounts table.
+
+    The number of hits and misses for the pairs of texts looked up through this object are recorded in `hits` and `misses`.
+    """
+    batch_size = 500
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+    def __str__(self):
+        return f"{self.hits} hits, {self.misses} misses ({self.hit_rate():.1%} hit rate)"
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits/lookups if lookups else 0.0
+
+    def stats(self):
+        return dict(hits=self.hits, misses=self.misses, hit_rate=self.hit_rate())
+
+    def pair_keys( self, lections_transcriptions, gotoh_param ):
+        """ Returns a dictionary of the key in the cache for each distinct pair of texts which needs to be aligned. """
+        text_hashes = {}
+        pair_keys = {}
+        for transcriptions in lections_transcriptions:
+            for pair in alignment.transcription_pairs( transcriptions ):
+                if pair in pair_keys:
+                    continue
+                for text in pair:
+                    if text not in text_hashes:
+                        text_hashes[text] = GotohCounts.text_hash( text )
+                pair_keys[pair] = (text_hashes[pair[0]], text_hashes[pair[1]])
+
+        return {
+            pair: (GotohCounts.make_key( base_hash, comparison_hash, gotoh_param ), base_hash, comparison_hash)
+            for pair, (base_hash, comparison_hash) in pair_keys.items()
+        }
+
+    def lookup( self, lections_transcriptions, gotoh_param ):
+        """ Returns a dictionary with the cached counts for the pairs of texts in the transcriptions of a list of lections. """
+        pair_keys = self.pair_keys( lections_transcriptions, gotoh_param )
+        pairs = {key: pair for pair, (key, _, _) in pair_keys.items()}
+        keys = list(pairs.keys())
+
+        known_counts = {}
+        for start in range(0, len(keys), self.batch_size):
+            for cached in GotohCounts.objects.filter( key__in=keys[start:start+self.batch_size] ):
+                known_counts[ pairs[cached.key] ] = cached.counts()
+
+        self.hits += len(known_counts)
+        self.misses += len(pairs) - len(known_counts)
+        return known_counts
+
+    def store( self, lections_transcriptions, lections_counts, known_counts, gotoh_param ):
+        """ Saves the counts for the pairs of texts which were not already in the cache. """
+        pair_keys = self.pair_keys( lections_transcriptions, gotoh_param )
+        new_entries = {}
+        for transcriptions, counts in zip(lections_transcriptions, lections_counts):
+            for verse_index, (base_transcription, comparison_transcriptions) in enumerate(transcriptions):
+                for ms_index, comparison_transcription in enumerate(comparison_transcriptions):
+                    pair = (base_transcription, comparison_transcription)
+                    if pair not in pair_keys or pair in known_counts:
+                        continue
+                    key, base_hash, comparison_hash = pair_keys[pair]
+                    matches, mismatches, gap_openings, gap_extensions = (int(x) for x in counts[verse_index, ms_index])
+                    new_entries[key] = GotohCounts(
+                        key=key,
+                        base_hash=base_hash,
+                        comparison_hash=comparison_hash,
+                        matches=matches,
+                        mismatches=mismatches,
+                        gap_openings=gap_openings,
+                        gap_extensions=gap_extensions,
+                    )
+
+        GotohCounts.objects.bulk_create( new_entries.values(), batch_size=self.batch_size, ignore_conflicts=True )
+
+
+def resolve_cache( cache ):
+    """ Returns a GotohCountsCache object if `cache` is True, otherwise it returns `cache` (which may be an existing cache object or None). """
+    if cache is True:
+        return GotohCountsCache()
+    return cache or None
+
+
+def pipeline_options( queue_size=None, threaded=None ):
+    """
+    Returns the size of the queue of fetched batches and whether they are fetched in a separate thread (see `pipeline.run_pipeline`).
+
+    The defaults come from the settings DCODEX_LECTIONARY_PIPELINE_QUEUE_SIZE (2) and DCODEX_LECTIONARY_FETCH_THREAD (True).
+    The batches are always fetched in the calling thread inside a transaction because the fetch thread has its own database connection
+    which would not see the uncommitted rows.
+    """
+    if queue_size is None:
+        queue_size = getattr( settings, 'DCODEX_LECTIONARY_PIPELINE_QUEUE_SIZE', 2 )
+    if threaded is None:
+        threaded = getattr( settings, 'DCODEX_LECTIONARY_FETCH_THREAD', True )
+    return queue_size, bool(threaded) and queue_size > 0 and not connection.in_atomic_block
+
+
+def lections_verse_counts(
+    base_ms,
+    lections,
+    comparison_mss,
+    gotoh_param=None,
+    ignore_incipits=False,
+    n_jobs=1,
+    chunksize=None,
+    cache=None,
+    progress=None,
+    backend=None,
+    lection_verses=None,
+    queue_size=None,
+    threaded=None,
+    stats=None,
+):
+    """
+    Aligns the verses of each lection in the base manuscript with the comparison manuscripts.
+
+    The lections are processed in chunks with `pipeline.run_pipeline`: a fetch thread loads the transcriptions of each chunk into a queue of `queue_size` chunks
+    while the chunks already loaded are aligned (in a process pool if `n_jobs` is not 1). See `pipeline_options` for the defaults.
+    The results are returned in the same order as the lections regardless of the number of jobs.
+
+    If a GotohCountsCache is given in `cache`, then pairs of texts which have been aligned before with the same parameters are read from the database
+    and new alignments are saved to it.
+
+    If `progress` is given, it is called with the number of lections processed and the total number of lections after each chunk.
+
+    `backend` is the name of the alignment backend (see `backends.BACKENDS`). The default comes from the setting DCODEX_LECTIONARY_ALIGNMENT_BACKEND
+    or else it is `gotoh`.
+
+    `lection_verses` is an optional LectionVerses object for the system with the verses of the lections already loaded.
+
+    `stats` is an optional `pipeline.PipelineStats` which records the time in each stage and the depth of the queue.
+
+    Returns a list with an array of shape (verses, manuscripts, 4) for each lection.
+    """
+    gotoh_param = gotoh_param or DEFAULT_GOTOH_PARAM
+    backend = backend or getattr( settings, 'DCODEX_LECTIONARY_ALIGNMENT_BACKEND', None )
+    comparison_count = len(comparison_mss)
+    n_jobs = alignment.resolve_n_jobs( n_jobs )
+    cache = resolve_cache( cache )
+    queue_size, threaded = pipeline_options( queue_size, threaded )
+    lections = list(lections)
+    chunksize = chunksize or max( 1, min( MAX_CHUNKSIZE, math.ceil( len(lections)/(4*n_jobs) ) ) )
+
+    def fetch_chunk( start ):
+        chunk = [
+            lection_transcriptions( base_ms, lection, comparison_mss, ignore_incipits, verses=lection_verses.verses[lection.id] if lection_verses else None )
+            for lection in lections[start:start+chunksize]
+        ]
+        known_counts = cache.lookup( chunk, gotoh_param ) if cache else None
+        return (chunk, comparison_count, gotoh_param, known_counts, backend), (chunk, known_counts)
+
+    def finish_chunk( context, chunk_counts ):
+        chunk, known_counts = context
+        if cache:
+            cache.store( chunk, chunk_counts, known_counts, gotoh_param )
+        results.extend( chunk_counts )
+        if progress:
+            progress( len(results), len(lections) )
+
+    results = []
+    if progress:
+        progress( 0, len(lections) )
+
+    pipeline.run_pipeline(
+        range(0, len(lections), chunksize),
+        fetch_chunk,
+        alignment.lections_verse_counts,
+        finish_chunk,
+        queue_size=queue_size,
+        n_jobs=n_jobs,
+        stats=stats,
+        threaded=threaded,
+        on_thread_exit=connections.close_all,
+    )
+    return results
+
+
+def lections_whole_counts(
+    base_ms,
+    lections,
+    comparison_mss,
+    gotoh_param=None,
+    ignore_incipits=False,
+    n_jobs=1,
+    chunksize=None,
+    progress=None,
+    backend=None,
+    lection_verses=None,
+    separator=alignment.LECTION_SEPARATOR,
+    queue_size=None,
+    threaded=None,
+    stats=None,
+):
+    """
+    Aligns each lection as a whole in the base manuscript with the comparison manuscripts (see `alignment.lections_counts`).
+
+    The verses are joined with `separator` so that there is one alignment per lection and manuscript rather than one per verse.
+    The other arguments are the same as for `lections_verse_counts` but there is no cache because the joined texts rarely repeat.
+    Returns an integer array of shape (lections, manuscripts, 4).
+    """
+    gotoh_param = gotoh_param or DEFAULT_GOTOH_PARAM
+    backend = backend or getattr( settings, 'DCODEX_LECTIONARY_ALIGNMENT_BACKEND', None )
+    comparison_count = len(comparison_mss)
+    n_jobs = alignment.resolve_n_jobs( n_jobs )
+    queue_size, threaded = pipeline_options( queue_size, threaded )
+    lections = list(lections)
+    chunksize = chunksize or max( 1, min( MAX_CHUNKSIZE, math.ceil( len(lections)/(4*n_jobs) ) ) )
+
+    def fetch_chunk( start ):
+        chunk = [
+            lection_transcriptions( base_ms, lection, comparison_mss, ignore_incipits, verses=lection_verses.verses[lection.id] if lection_verses else None )
+            for lection in lections[start:start+chunksize]
+        ]
+        return (chunk, comparison_count, gotoh_param, separator, backend), None
+
+    results = [np.zeros( (0, comparison_count, 4), dtype=np.int64 )]
+    processed = 0
+    if progress:
+        progress( 0, len(lections) )
+
+    def finish_chunk( context, chunk_counts ):
+        nonlocal processed
+        results.append( chunk_counts )
+        processed += len(chunk_counts)
+        if progress:
+            progress( processed, len(lections) )
+
+    pipeline.run_pipeline(
+        range(0, len(lections), chunksize),
+        fetch_chunk,
+        alignment.lections_counts,
+        finish_chunk,
+        queue_size=queue_size,
+        n_jobs=n_jobs,
+        stats=stats,
+        threaded=threaded,
+        on_thread_exit=connections.close_all,
+    )
+    return np.concatenate( results )
+
+
+def lections_gotoh_totals( base_ms, lections, comparison_mss, alignment_mode='verses', cache=None, separator=alignment.LECTION_SEPARATOR, **kwargs ):
+    """
+    Returns an integer array of shape (lections, manuscripts, 4) with the total Gotoh counts for each lection.
+
+    If `alignment_mode` is 'verses' then the verses are aligned separately with `lections_verse_counts` and summed.
+    If it is 'lections' then whole lections are aligned with `lections_whole_counts` (the cache is not used).
+    The remaining keyword arguments are passed to these functions.
+    """
+    if alignment_mode == 'verses':
+        lections_counts = lections_verse_counts( base_ms, lections, comparison_mss, cache=cache, **kwargs )
+        totals = np.zeros( (len(lections_counts), len(comparison_mss), 4), dtype=np.int64 )
+        for lection_index, counts in enumerate(lections_counts):
+            totals[lection_index] = counts.sum( axis=0 )
+        return totals
+    if alignment_mode == 'lections':
+        return lections_whole_counts( base_ms, lections, comparison_mss, separator=separator, **kwargs )
+    raise ValueError( f"Unknown alignment mode '{alignment_mode}'. Use one of: {', '.join(ALIGNMENT_MODES)}" )
+
+
+class SimilarityCounts():
+    """
+    The Gotoh counts for each verse of the lections in a system aligned between a base manuscript and comparison manuscripts.
+
+    `verse_counts` is an integer array of shape (verses, manuscripts, 4) with the number of matches, mismatches, gap openings and gap extensions.
+    `lection_index` gives the index in `lections_in_system` for each verse and `verse_ids` gives the ID of each LectionaryVerse.
+    Verses which were not aligned have zero counts.
+    """
+    def __init__( self, lections_in_system, comparison_mss, verse_counts, lection_index, verse_ids ):
+        self.lections_in_system = list(lections_in_system)
+        self.comparison_mss = list(comparison_mss)
+        self.verse_counts = verse_counts
+        self.lection_index = lection_index
+        self.verse_ids = verse_ids
+
+    def __len__(self):
+        return len(self.lections_in_system)
+
+    def lection_counts( self ):
+        """ Returns an array of shape (lections, manuscripts, 4) with the total counts for each lection. """
+        counts = np.zeros( (len(self.lections_in_system), len(self.comparison_mss), 4), dtype=np.int64 )
+        np.add.at( counts, self.lection_index, self.verse_counts )
+        return counts
+
+    def verse_masses( self ):
+        """ Returns an array with the mass of each verse. """
+        masses = dict( LectionaryVerse.objects.filter( id__in=np.unique(self.verse_ids).tolist() ).values_list( 'id', 'mass' ) )
+        return np.fromiter( (masses[verse_id] for verse_id in self.verse_ids), dtype=np.int64, count=len(self.verse_ids) )
+
+    def verse_positions( self, window_unit='verses' ):
+        """
+        Returns the position of each verse along the sequence of the system.
+
+        If `window_unit` is 'verses' then the positions are the indexes of the verses.
+        If it is 'mass' then the positions are the cumulative mass at the middle of each verse.
+        """
+        if window_unit == 'verses':
+            return np.arange( len(self.verse_ids), dtype=float )
+        if window_unit == 'mass':
+            masses = self.verse_masses()
+            return np.cumsum( masses ) - 0.5 * masses
+        raise ValueError( f"Unknown window unit '{window_unit}'. Use 'verses' or 'mass'." )
+
+    def rolling_counts( self, window, window_unit='verses' ):
+        """ Returns the counts of each verse summed over a window centred on it. See `rolling_window_counts`. """
+        return rolling_window_counts( self.verse_counts, window, self.verse_positions( window_unit ) )
+
+    def bootstrap_intervals( self, weights=None, prior_log_odds=0.0, resamples=1000, confidence=0.95, seed=0 ):
+        """ Returns the bootstrap confidence intervals for each lection from resampling its verses. See `sampling.bootstrap_lection_intervals`. """
+        return sampling.bootstrap_lection_intervals(
+            self.verse_counts,
+            self.lection_index,
+            len(self.lections_in_system),
+            DEFAULT_WEIGHTS if weights is None else weights,
+            prior_log_odds,
+            resamples=resamples,
+            confidence=confidence,
+            seed=seed,
+        )
+
+
+def rolling_window_counts( verse_counts, window, positions=None ):
+    """
+    Sums the counts of the verses in a window of width `window` centred on each verse.
+
+    `positions` is an increasing array with the position of each verse in the same units as the window. By default it is the index of the verse.
+    The window includes the verses at positions from `position - window/2` up to (but not including) `position + window/2`
+    so a window of n verses covers n verses. The sums use cumulative sums so the cost does not depend on the width of the window.
+    """
+    verse_counts = np.asarray( verse_counts )
+    positions = np.arange( len(verse_counts), dtype=float ) if positions is None else np.asarray( positions, dtype=float )
+
+    cumulative = np.zeros( (len(verse_counts) + 1,) + verse_counts.shape[1:], dtype=np.int64 )
+    np.cumsum( verse_counts, axis=0, out=cumulative[1:] )
+
+    half_window = 0.5 * window
+    start = np.searchsorted( positions, positions - half_window, side='left' )
+    end = np.searchsorted( positions, positions + half_window, side='left' )
+    return cumulative[end] - cumulative[start]
+
+
+def similarity_counts(
+    system,
+    base_ms,
+    comparison_mss,
+    min_verses=2,
+    gotoh_param=None,
+    ignore_incipits=False,
+    n_jobs=1,
+    cache=None,
+    lections_in_system=None,
+    progress=None,
+    backend=None,
+    lection_verses=None,
+):
+    """
+    Aligns each verse of the lections in a system and returns the counts in a SimilarityCounts object.
+
+    The lections with fewer than `min_verses` verses are skipped unless the lections are given explicitly in `lections_in_system`.
+    The verses of the lections are loaded unless a LectionVerses object for the system is given in `lection_verses`.
+    The counts can be scored with different weights and priors using `score_similarity_counts` without aligning the texts again.
+    """
+    lection_verses = lection_verses or LectionVerses( system )
+    if lections_in_system is None:
+        lections_in_system = [
+            lection_in_system for lection_in_system in system.lections_in_system().select_related( 'lection' )
+            if lection_verses.verse_count( lection_in_system.lection ) >= min_verses
+        ]
+    lections = [lection_in_system.lection for lection_in_system in lections_in_system]
+
+    lections_counts = lections_verse_counts(
+        base_ms,
+        lections,
+        comparison_mss,
+        gotoh_param=gotoh_param,
+        ignore_incipits=ignore_incipits,
+        n_jobs=n_jobs,
+        cache=cache,
+        progress=progress,
+        backend=backend,
+        lection_verses=lection_verses,
+    )
+    lections_verse_ids = [lection_verses.verse_ids.get( lection.id, np.zeros( (0,), dtype=np.int64 ) ) for lection in lections]
+
+    if lections_counts:
+        verse_counts = np.concatenate( lections_counts )
+        verse_ids = np.concatenate( lections_verse_ids )
+    else:
+        verse_counts = np.zeros( (0, len(comparison_mss), 4), dtype=np.int32 )
+        verse_ids = np.zeros( (0,), dtype=np.int64 )
+    lection_index = np.repeat( np.arange( len(lections) ), [len(counts) for counts in lections_counts] )
+
+    return SimilarityCounts( lections_in_system, comparison_mss, verse_counts, lection_index, verse_ids )
+
+
+def similarity_and_probability_arrays( counts, weights=None, prior_log_odds=0.0 ):
+    """
+    Scores an array of Gotoh counts where the last axis has the four counts.
+
+    Returns the similarity percentages (NaN where nothing was aligned) and the posterior probabilities from the logistic weights.
+    """
+    counts = np.asarray(counts)
+    weights = np.asarray(DEFAULT_WEIGHTS if weights is None else weights)
+
+    length = counts.sum( axis=-1 )
+    with np.errstate( divide='ignore', invalid='ignore' ):
+        similarity = np.where( length > 0, 100.0 * counts[...,0]/length, np.nan )
+    probability = expit( prior_log_odds + counts @ weights )
+    return similarity, probability
+
+
+def score_similarity_counts( counts, weights=None, prior_log_odds=0.0, per_verse=False, window=None, window_unit='verses', bootstrap=0, confidence=0.95, seed=0 ):
+    """
+    Converts a SimilarityCounts object into a DataFrame with the similarity and probability for each comparison manuscript.
+
+    The DataFrame has a row for each lection unless `per_verse` is True, in which case it has a row for each verse.
+    If a `window` is given then each verse is scored with the counts summed over a window centred on it (measured in `window_unit` which is 'verses' or 'mass').
+    These rows also include the position of the verse in the same units.
+
+    If `bootstrap` is a number of resamples then the rows for lections also have the bounds of the confidence intervals
+    for the similarity and probability from resampling the verses of each lection (see `sampling.bootstrap_lection_intervals`).
+    """
+    if window is not None:
+        per_verse = True
+        verse_counts = counts.rolling_counts( window, window_unit )
+    else:
+        verse_counts = counts.verse_counts
+
+    if per_verse:
+        similarity, probability = similarity_and_probability_arrays( verse_counts, weights, prior_log_odds )
+        lection_index = counts.lection_index
+    else:
+        similarity, probability = similarity_and_probability_arrays( counts.lection_counts(), weights, prior_log_odds )
+        lection_index = np.arange( len(counts.lections_in_system) )
+
+    columns = {}
+    if per_verse:
+        columns['Verse__id'] = counts.verse_ids
+    if window is not None:
+        columns['Position'] = counts.verse_positions( window_unit )
+
+    intervals = None
+    if bootstrap and not per_verse:
+        intervals = counts.bootstrap_intervals( weights, prior_log_odds, resamples=bootstrap, confidence=confidence, seed=seed )
+
+    return similarity_dataframe( counts.lections_in_system, counts.comparison_mss, lection_index, similarity, probability, intervals=intervals, **columns )
+
+
+def similarity_dataframe( lections_in_system, comparison_mss, lection_index, similarity, probability, intervals=None, **columns ):
+    """
+    Returns a DataFrame with the similarity and probability for each comparison manuscript in the rows of the arrays `similarity` and `probability`.
+
+    `lection_index` gives the index in `lections_in_system` for each row. Any other columns are given as keyword arguments and come before the manuscripts.
+    `intervals` is an optional dictionary of arrays with the same shape as `similarity` which are added after the probability of each manuscript
+    with the siglum as a prefix to the key (e.g. 'similarity_lower').
+    """
+    descriptions = [str(lection_in_system) for lection_in_system in lections_in_system]
+    data = {
+        'Lection': [descriptions[index] for index in lection_index],
+        'Lection_Membership__id': np.array( [lection_in_system.id for lection_in_system in lections_in_system], dtype=np.int64 )[lection_index],
+        'Lection_Membership__order': np.array( [lection_in_system.order for lection_in_system in lections_in_system], dtype=np.int64 )[lection_index],
+    }
+    data.update( columns )
+
+    for ms_index, ms in enumerate(comparison_mss):
+        data[ms.siglum + "_similarity"] = similarity[:,ms_index]
+        data[ms.siglum + "_probability"] = probability[:,ms_index]
+        for name, values in (intervals or {}).items():
+            data[f"{ms.siglum}_{name}"] = values[:,ms_index]
+
+    return pd.DataFrame( data )
+
+
+def similarity_series( system, base_ms, comparison_mss, window, window_unit='verses', weights=None, prior_log_odds=0.0, counts=None, **kwargs ):
+    """
+    Returns a DataFrame with the similarity and probability for each verse of the system over a rolling window.
+
+    The per-verse counts are computed with `similarity_counts` (which takes the remaining keyword arguments)
+    unless a SimilarityCounts object is given in `counts`, so that different windows can be tried without aligning the texts again.
+    """
+    if counts is None:
+        counts = similarity_counts( system, base_ms, comparison_mss, **kwargs )
+    return score_similarity_counts( counts, weights, prior_log_odds, window=window, window_unit=window_unit )
+
+
+def similarity_change_points( system, base_ms, comparison_mss, per_verse=False, penalty=None, min_size=None, counts=None, **kwargs ):
+    """
+    Finds where the similarity of the base manuscript with the comparison manuscripts changes along the lectionary system.
+
+    The similarity series of all the comparison manuscripts (by lection, or by verse if `per_verse` is True) are segmented together
+    with `changepoints.detect_change_points` so a change in any of them can be a boundary. Missing similarities are skipped.
+    Segments have at least `min_size` values which defaults to PER_VERSE_MIN_SIZE verses or PER_LECTION_MIN_SIZE lections.
+    The counts come from `similarity_counts` (which takes the remaining keyword arguments) unless a SimilarityCounts object is given in `counts`.
+
+    Returns a list with a dictionary for each boundary with the `lection_in_system` (and `verse_id` if `per_verse`) where the new segment starts,
+    its `score` and the mean similarity of each comparison manuscript `before` and `after` the boundary in dictionaries keyed by siglum.
+    """
+    if counts is None:
+        counts = similarity_counts( system, base_ms, comparison_mss, **kwargs )
+    if min_size is None:
+        min_size = PER_VERSE_MIN_SIZE if per_verse else PER_LECTION_MIN_SIZE
+
+    if per_verse:
+        similarity, _ = similarity_and_probability_arrays( counts.verse_counts )
+        lection_index = counts.lection_index
+    else:
+        similarity, _ = similarity_and_probability_arrays( counts.lection_counts() )
+        lection_index = np.arange( len(counts.lections_in_system) )
+
+    sigla = [ms.siglum for ms in counts.comparison_mss]
+    boundaries = []
+    for change_point in changepoints.detect_change_points( similarity, penalty=penalty, min_size=min_size ):
+        index = change_point['index']
+        boundary = dict(
+            lection_in_system=counts.lections_in_system[lection_index[index]],
+            score=change_point['score'],
+            before=dict(zip( sigla, change_point['before'].tolist() )),
+            after=dict(zip( sigla, change_point['after'].tolist() )),
+        )
+        if per_verse:
+            boundary['verse_id'] = int(counts.verse_ids[index])
+        boundaries.append( boundary )
+    return boundaries
+
+
+def similarity_profiles( system, mss, reference_mss=None, min_verses=2, gotoh_param=None, ignore_incipits=False, n_jobs=1, **kwargs ):
+    """
+    Returns an array of shape (manuscripts, lections, reference manuscripts) with the similarity of each manuscript with each reference manuscript in each lection.
+
+    If the reference manuscripts are not given then they are the manuscripts themselves and every pair is aligned once with `pairwise.PairwiseSimilarity`.
+    Otherwise the counts come from `similarity_counts` (which takes the remaining keyword arguments) with each manuscript as the base.
+    Similarities are NaN for lections where there is no text in common and for a manuscript compared with itself.
+    """
+    if reference_mss is None:
+        from .pairwise import PairwiseSimilarity
+        pairwise = PairwiseSimilarity( system, mss, min_verses=min_verses, gotoh_param=gotoh_param, ignore_incipits=ignore_incipits ).compute( n_jobs=n_jobs )
+        return pairwise.profiles().transpose( 0, 2, 1 )
+
+    lection_verses = LectionVerses( system )
+    lections_in_system = [
+        lection_in_system for lection_in_system in system.lections_in_system().select_related( 'lection' )
+        if lection_verses.verse_count( lection_in_system.lection ) >= min_verses
+    ]
+
+    profiles = np.full( (len(mss), len(lections_in_system), len(reference_mss)), np.nan )
+    for ms_index, ms in enumerate(mss):
+        references = [reference_index for reference_index, reference_ms in enumerate(reference_mss) if reference_ms.id != ms.id]
+        if not references:
             continue
-        
-        for ms_index, ms in enumerate(comparison_mss):
-            comparison_transcription = ms.normalized_transcription( verse ) if type(ms) is Lectionary else ms.normalized_transcription( verse.bible_verse )
-            if not comparison_transcription:
-                continue
-
-            counts = gotoh.counts( base_transcription, comparison_transcription, *gotoh_param )
-            gotoh_totals[ms_index][:] += counts
-
-    results = []        
-    for ms_index in range(len(comparison_mss)):
-        length = gotoh_totals[ms_index].sum()            
-        similarity = 100.0 * gotoh_totals[ms_index][0]/length if length > 0 else np.NAN
-        
+        counts = similarity_counts(
+            system,
+            ms,
+            [reference_mss[index] for index in references],
+            gotoh_param=gotoh_param,
+            ignore_incipits=ignore_incipits,
+            n_jobs=n_jobs,
+            lections_in_system=lections_in_system,
+            lection_verses=lection_verses,
+            **kwargs,
+        )
+        similarity, _ = similarity_and_probability_arrays( counts.lection_counts() )
+        profiles[ms_index][:,references] = similarity
+    return profiles
+
+
+def cluster_manuscripts( system, mss, reference_mss=None, method='average', min_overlap=1, profiles=None, **kwargs ):
+    """
+    Clusters manuscripts hierarchically by their profiles of similarity with the reference manuscripts over the lections of a system.
+
+    The reference manuscripts are the manuscripts themselves unless they are given.
+    The profiles come from `similarity_profiles` (which takes the remaining keyword arguments) unless they are given in `profiles`,
+    for example from `PairwiseSimilarity.profiles`. Returns a `clustering.ProfileClustering` labelled with the sigla.
+    """
+    mss = [Manuscript.find( ms ) if isinstance(ms, str) else ms for ms in mss]
+    if profiles is None:
+        if reference_mss is not None:
+            reference_mss = [Manuscript.find( ms ) if isinstance(ms, str) else ms for ms in reference_mss]
+        profiles = similarity_profiles( system, mss, reference_mss, **kwargs )
+    return clustering.ProfileClustering( profiles, [ms.siglum for ms in mss], method=method, min_overlap=min_overlap )
+
+
+def consensus_lections( system, mss, min_verses=1, ignore_incipits=False, gotoh_param=None, iterations=1, lections_in_system=None ):
+    """
+    Reconstructs the majority text of each lection of a system from a group of manuscripts.
+
+    The normalized transcriptions of all the manuscripts are loaded with one query for each lection
+    and the witnesses of each verse are aligned to a pivot and voted on with `consensus.verse_consensus`.
+    This is a generator which yields a tuple with the LectionInSystem and a `consensus.LectionConsensus` (whose `witness_agreement` is in the order of `mss`)
+    for each lection as soon as it is done, so the results can be streamed.
+    """
+    gotoh_param = gotoh_param or DEFAULT_GOTOH_PARAM
+    mss = [Manuscript.find( ms ) if isinstance(ms, str) else ms for ms in mss]
+    lection_verses = LectionVerses( system )
+    if lections_in_system is None:
+        lections_in_system = [
+            lection_in_system for lection_in_system in system.lections_in_system().select_related( 'lection' )
+            if lection_verses.verse_count( lection_in_system.lection ) >= min_verses
+        ]
+
+    for lection_in_system in lections_in_system:
+        verses = lection_verses.verses[lection_in_system.lection_id]
+        texts = stored_normalized_transcriptions( mss, verses )
+        verses_texts = [
+            [None] * len(mss) if verse_index == 0 and ignore_incipits else [texts.get( (ms.id, transcription_verse_id( ms, verse )) ) for ms in mss]
+            for verse_index, verse in enumerate(verses)
+        ]
+        yield lection_in_system, consensus.lection_consensus( verses_texts, gotoh_param, iterations=iterations )
+
+
+def similarity_probabilities_from_totals( gotoh_totals, weights=None, prior_log_odds=0.0, include_probabilities=True ):
+    """ Converts the Gotoh count totals for each comparison manuscript into similarity percentages (and posterior probabilities if requested). """
+    weights = np.asarray(DEFAULT_WEIGHTS if weights is None else weights)
+
+    results = []
+    for ms_index in range(len(gotoh_totals)):
+        length = gotoh_totals[ms_index].sum()
+        similarity = 100.0 * gotoh_totals[ms_index][0]/length if length > 0 else np.nan
+
         if include_probabilities:
             logodds = prior_log_odds + np.dot( gotoh_totals[ms_index], weights )
             posterior_probability = expit( logodds )
             results.extend([similarity, posterior_probability])
         else:
-            if similarity == np.NAN or length == 0:
+            if length == 0:
                 similarity = None
             results.append(similarity)
-            import logging
-            logging.error(f"{similarity =}")
-                    
+
     return results
 
 
-def similarity_probabilities_df( system, base_ms, comparison_mss, min_verses=2, **kwargs ):
-    columns = ['Lection','Lection_Membership__id','Lection_Membership__order']
-    for ms in comparison_mss:
-        columns.extend( [ms.siglum + "_similarity", ms.siglum + "_probability"] )
-    
-    df = pd.DataFrame(columns=columns)
-    index = 0
-    for lection_in_system in system.lections_in_system().all():
-        lection = lection_in_system.lection
-        if lection.verses.count() < min_verses:
-            continue
+def similarity_probabilities_lection(
+    base_ms,
+    lection,
+    comparison_mss,
+    weights=None,
+    gotoh_param=None,
+    prior_log_odds=0.0,
+    ignore_incipits=False,
+    include_probabilities=True,
+    cache=None,
+    alignment_mode='verses',
+):
+    """
+    Returns the similarity (and probability if `include_probabilities`) of each comparison manuscript with the base manuscript in a lection.
+
+    `alignment_mode` is 'verses' to align verse by verse or 'lections' to align the whole lection at once (see `lections_gotoh_totals`).
+    """
+    gotoh_totals = lections_gotoh_totals(
+        base_ms, [lection], comparison_mss, alignment_mode=alignment_mode, gotoh_param=gotoh_param, ignore_incipits=ignore_incipits, cache=cache,
+    )[0]
+
+    return similarity_probabilities_from_totals( gotoh_totals, weights, prior_log_odds, include_probabilities )
+
+
+def use_materialized( materialized=None ):
+    """ Returns whether to read the similarity from the LectionGotohTotals table. The default comes from the setting DCODEX_LECTIONARY_MATERIALIZED_SIMILARITY. """
+    if materialized is None:
+        return getattr( settings, 'DCODEX_LECTIONARY_MATERIALIZED_SIMILARITY', False )
+    return materialized
+
+
+def materialize_lection_totals( system, base_ms, comparison_mss, gotoh_param=None, ignore_incipits=False, n_jobs=1, cache=None, progress=None, backend=None ):
+    """
+    Stores the Gotoh totals of every lection in a system for the comparison manuscripts which have not been materialized yet with these parameters.
+
+    The comparison manuscripts which already have a LectionGotohTotals row for every lection of the system are not aligned again.
+    Returns the number of rows created.
+    """
+    gotoh_param = list(gotoh_param or DEFAULT_GOTOH_PARAM)
+    parameters_key = LectionGotohTotals.make_parameters_key( gotoh_param, ignore_incipits )
+    lections = list(system.lections.distinct())
+    rows = LectionGotohTotals.objects.filter( system=system, base_ms=base_ms, parameters_key=parameters_key )
+
+    stored_counts = dict(
+        rows.filter( comparison_ms__in=comparison_mss )
+        .order_by()
+        .values( 'comparison_ms_id' )
+        .annotate( lection_count=Count('id') )
+        .values_list( 'comparison_ms_id', 'lection_count' )
+    )
+    missing_mss = list({ms.id: ms for ms in comparison_mss if stored_counts.get( ms.id, 0 ) < len(lections)}.values())
+    if not missing_mss:
+        return 0
+
+    lections_counts = lections_verse_counts(
+        base_ms,
+        lections,
+        missing_mss,
+        gotoh_param=gotoh_param,
+        ignore_incipits=ignore_incipits,
+        n_jobs=n_jobs,
+        cache=resolve_cache( cache ),
+        progress=progress,
+        backend=backend,
+        lection_verses=LectionVerses( system ),
+    )
+
+    new_rows = []
+    for lection, counts in zip(lections, lections_counts):
+        for ms, totals in zip(missing_mss, counts.sum( axis=0 )):
+            row = LectionGotohTotals(
+                system=system,
+                lection=lection,
+                base_ms=base_ms,
+                comparison_ms=ms,
+                parameters_key=parameters_key,
+                gotoh_param=gotoh_param,
+                ignore_incipits=ignore_incipits,
+            )
+            row.set_counts( totals )
+            new_rows.append( row )
+
+    rows.filter( comparison_ms__in=missing_mss ).delete()
+    LectionGotohTotals.objects.bulk_create( new_rows, batch_size=1000 )
+    return len(new_rows)
+
+
+def materialized_lection_counts( system, base_ms, comparison_mss, gotoh_param=None, ignore_incipits=False, **kwargs ):
+    """
+    Returns a dictionary keyed by lection ID with an array of shape (manuscripts, 4) with the Gotoh totals from the LectionGotohTotals table.
+
+    The totals for all the lections are read with a single query. Any comparison manuscripts which have not been materialized
+    are aligned first with `materialize_lection_totals` which takes the remaining keyword arguments.
+    """
+    gotoh_param = gotoh_param or DEFAULT_GOTOH_PARAM
+    materialize_lection_totals( system, base_ms, comparison_mss, gotoh_param=gotoh_param, ignore_incipits=ignore_incipits, **kwargs )
+
+    ms_indexes = defaultdict( list )
+    for ms_index, ms in enumerate(comparison_mss):
+        ms_indexes[ms.id].append( ms_index )
+
+    totals = defaultdict( lambda: np.zeros( (len(comparison_mss), 4), dtype=np.int64 ) )
+    rows = LectionGotohTotals.objects.filter(
+        system=system,
+        base_ms=base_ms,
+        comparison_ms__in=comparison_mss,
+        parameters_key=LectionGotohTotals.make_parameters_key( gotoh_param, ignore_incipits ),
+    ).values_list( 'lection_id', 'comparison_ms_id', 'matches', 'mismatches', 'gap_openings', 'gap_extensions' )
+    for lection_id, ms_id, *counts in rows:
+        totals[lection_id][ms_indexes[ms_id]] = counts
+    return totals
+
+
+def update_lection_gotoh_totals( transcription ):
+    """
+    Aligns again the materialized LectionGotohTotals which include the verse of a transcription that has been saved or deleted.
+
+    Only the rows for the lections which contain the verse and which have the manuscript of the transcription as the base or comparison manuscript are updated.
+    Returns the number of rows updated.
+    """
+    ms_id = transcription.manuscript_id
+    verse_id = transcription.verse_id
+    lection_ids = LectionaryVerseMembership.objects.filter( Q(verse_id=verse_id) | Q(verse__bible_verse_id=verse_id) ).values( 'lection_id' )
+    rows = list(
+        LectionGotohTotals.objects
+        .filter( lection_id__in=lection_ids )
+        .filter( Q(base_ms_id=ms_id) | Q(comparison_ms_id=ms_id) )
+        .select_related( 'lection' )
+    )
+    if not rows:
+        return 0
+
+    # Loaded with the polymorphic manager so that lectionaries are distinguished from other manuscripts
+    mss = Manuscript.objects.in_bulk( {row.base_ms_id for row in rows} | {row.comparison_ms_id for row in rows} )
+
+    groups = defaultdict( list )
+    for row in rows:
+        groups[(row.lection_id, row.base_ms_id, row.parameters_key)].append( row )
+
+    now = timezone.now()
+    for group in groups.values():
+        first = group[0]
+        counts = lections_verse_counts(
+            mss[first.base_ms_id],
+            [first.lection],
+            [mss[row.comparison_ms_id] for row in group],
+            gotoh_param=first.gotoh_param,
+            ignore_incipits=first.ignore_incipits,
+            threaded=False, # A single lection is not worth a thread and its connection
+        )[0]
+        for row, totals in zip(group, counts.sum( axis=0 )):
+            row.set_counts( totals )
+            row.updated = now
+
+    LectionGotohTotals.objects.bulk_update( rows, ['matches', 'mismatches', 'gap_openings', 'gap_extensions', 'updated'] )
+    return len(rows)
+
+
+def minhash_parameters( **parameters ):
+    """ Returns the parameters of the MinHash sketches with the defaults from DEFAULT_MINHASH_PARAMETERS for any which are not given (or are None). """
+    return {key: value if parameters.get( key ) is None else parameters[key] for key, value in DEFAULT_MINHASH_PARAMETERS.items()}
+
+
+def minhash_sketch_rows( ms, lections, parameters, lection_verses=None ):
+    """
+    Returns unsaved MinHashSketch objects for the lections of a manuscript from its normalized text of each lection (the verses joined by alignment.LECTION_SEPARATOR).
+
+    Lections without any text are skipped.
+    """
+    lections = list(lections)
+    hasher = minhash.MinHasher( parameters['permutation_count'], parameters['shingle_size'], parameters['seed'] )
+    encoded, lection_offsets = encoded_lections_texts( ms, lections, ignore_incipits=parameters['ignore_incipits'], lection_verses=lection_verses )
+    texts = encoded.texts()
+    lection_texts = [
+        alignment.LECTION_SEPARATOR.join( text for text in texts[lection_offsets[index]:lection_offsets[index+1]] if text )
+        for index in range(len(lections))
+    ]
 
-#            if ignore_untranscribed and self.lection_transcribed_count( lection ) == 0:
-#                print("Ignoring untranscribed lection:", lection)
-#                continue
-        
-        results = similarity_probabilities_lection( base_ms, lection, comparison_mss, **kwargs )
-            
-        df.loc[index] = [str(lection_in_system), lection_in_system.id, lection_in_system.order] + results
-        index += 1
+    sketches = hasher.sketches( lection_texts )
+    hashes = minhash.band_hashes( sketches, parameters['band_count'] )
+    parameters_key = MinHashSketch.make_parameters_key( parameters )
+    return [
+        MinHashSketch( manuscript=ms, lection=lection, parameters_key=parameters_key, parameters=parameters, sketch=sketch.tobytes(), band_hashes=band_hashes.tobytes() )
+        for lection, text, sketch, band_hashes in zip(lections, lection_texts, sketches, hashes)
+        if text
+    ]
 
-    print('similarity_probabilities_df indexes:', index)
-    return df      
 
+def build_minhash_sketches( system, mss, refresh=False, progress=None, **parameters ):
+    """
+    Stores the MinHash sketches of every lection of a system for each manuscript (see `minhash_sketch_rows`).
 
-def similarity_dict( base_ms, comparison_mss, system=None, min_verses = 2, ignore_unstranscribed=True, **kwargs ):
+    Only the lections where a manuscript has transcriptions but no sketch with the same parameters are sketched, unless `refresh` is True
+    when all the sketches of the manuscript are replaced.
+    `progress` is an optional function which is called with the number of manuscripts done and the total.
+    Returns the number of sketches stored.
+    """
+    parameters = minhash_parameters( **parameters )
+    parameters_key = MinHashSketch.make_parameters_key( parameters )
+    lection_verses = LectionVerses( system )
+    lections = [lection_in_system.lection for lection_in_system in system.lections_in_system().select_related( 'lection' )]
+    lection_ids = [lection.id for lection in lections]
+
+    stored = 0
+    for index, ms in enumerate(mss):
+        existing = MinHashSketch.objects.filter( manuscript=ms, lection_id__in=lection_ids, parameters_key=parameters_key )
+        if refresh:
+            missing = lections
+            existing.delete()
+        else:
+            transcription_counts = lection_verses.transcription_counts( ms )
+            sketched = set( existing.values_list( 'lection_id', flat=True ) )
+            missing = [lection for lection in lections if transcription_counts.get( lection.id ) and lection.id not in sketched]
+        if missing:
+            rows = minhash_sketch_rows( ms, missing, parameters, lection_verses=lection_verses )
+            MinHashSketch.objects.bulk_create( rows )
+            stored += len(rows)
+        if progress:
+            progress( index + 1, len(mss) )
+    return stored
+
+
+def minhash_index( lection_ids, **parameters ):
+    """
+    Loads the stored MinHash sketches of a set of lections with a single query into a `minhash.LSHIndex`.
+
+    The keys are the manuscript IDs and the groups are the lection IDs.
+    """
+    parameters = minhash_parameters( **parameters )
+    index = minhash.LSHIndex( band_count=parameters['band_count'] )
+    rows = (
+        MinHashSketch.objects
+        .filter( lection_id__in=list(lection_ids), parameters_key=MinHashSketch.make_parameters_key( parameters ) )
+        .values_list( 'manuscript_id', 'lection_id', 'sketch', 'band_hashes' )
+    )
+    for ms_id, lection_id, sketch, band_hashes in rows:
+        index.add( ms_id, lection_id, np.frombuffer( bytes(sketch), dtype=np.uint32 ), np.frombuffer( bytes(band_hashes), dtype=np.uint64 ) )
+    return index
+
+
+def base_minhash_sketches( base_ms, lections, parameters ):
+    """ Returns a dictionary keyed by lection ID with the sketch of each lection of the base manuscript, computing any which are not stored. """
+    lections = list(lections)
+    sketches = {
+        lection_id: np.frombuffer( bytes(sketch), dtype=np.uint32 )
+        for lection_id, sketch in MinHashSketch.objects.filter(
+            manuscript=base_ms, lection__in=lections, parameters_key=MinHashSketch.make_parameters_key( parameters )
+        ).values_list( 'lection_id', 'sketch' )
+    }
+    missing = [lection for lection in lections if lection.id not in sketches]
+    if missing:
+        for row in minhash_sketch_rows( base_ms, missing, parameters ):
+            sketches[row.lection.id] = row.sketch_array()
+    return sketches
+
+
+def nearest_manuscripts( base_ms, lection, count=10, **parameters ):
+    """
+    Returns up to `count` tuples of a manuscript and the estimated Jaccard similarity of its text of a lection with the base manuscript, best first.
+
+    The candidates come from the LSH index of the stored sketches of the lection (see `build_minhash_sketches`) so no texts are aligned.
+    """
+    parameters = minhash_parameters( **parameters )
+    sketch = base_minhash_sketches( base_ms, [lection], parameters ).get( lection.id )
+    if sketch is None:
+        return []
+    index = minhash_index( [lection.id], **parameters )
+    nearest = index.query( lection.id, sketch, count=count, exclude=[base_ms.id] )
+    mss = Manuscript.objects.in_bulk( [ms_id for ms_id, _ in nearest] )
+    return [(mss[ms_id], similarity) for ms_id, similarity in nearest]
+
+
+def suggest_comparison_mss( base_ms, count=5, system=None, lection_sample=50, seed=0, exclude=(), **parameters ):
+    """
+    Suggests the manuscripts closest to the base manuscript from the LSH index of the stored MinHash sketches.
+
+    Up to `lection_sample` lections of the system where the base manuscript has text are chosen at random (with the same `seed` giving the same lections)
+    and the nearest manuscripts in each are found with the index. The manuscripts are ranked by their mean estimated Jaccard similarity over the sampled lections
+    (where lections in which a manuscript is not a candidate count as zero). Manuscripts in `exclude` are skipped.
+    Returns a list of up to `count` tuples of a manuscript and its mean similarity. The list is empty if no sketches have been stored.
+    """
+    parameters = minhash_parameters( **parameters )
+    system = system or getattr( base_ms, 'system', None )
+    if system is None:
+        return []
+
+    lection_ids = list(
+        MinHashSketch.objects
+        .filter( manuscript=base_ms, lection__in=system.lections.all(), parameters_key=MinHashSketch.make_parameters_key( parameters ) )
+        .values_list( 'lection_id', flat=True )
+    )
+    if not lection_ids:
+        return []
+    rng = np.random.default_rng( seed )
+    lection_ids = sorted( rng.choice( sorted(lection_ids), size=min( lection_sample, len(lection_ids) ), replace=False ).tolist() )
+
+    index = minhash_index( lection_ids, **parameters )
+    base_sketches = base_minhash_sketches( base_ms, Lection.objects.filter( id__in=lection_ids ), parameters )
+    exclude = {base_ms.id} | {ms if isinstance(ms, int) else ms.id for ms in exclude}
+    totals = defaultdict( float )
+    for lection_id, sketch in base_sketches.items():
+        for ms_id, similarity in index.query( lection_id, sketch, count=len(index), exclude=exclude ):
+            totals[ms_id] += similarity
+
+    ranked = sorted( totals.items(), key=lambda item: (-item[1], item[0]) )[:count]
+    mss = Manuscript.objects.in_bulk( [ms_id for ms_id, _ in ranked] )
+    return [(mss[ms_id], total/len(lection_ids)) for ms_id, total in ranked]
+
+
+def minhash_fingerprint( **parameters ):
+    """
+    Returns a cheap fingerprint of the stored MinHash sketches with a set of parameters.
+
+    It combines the number of sketches (which changes when sketches are created or deleted) with the time the last one was updated.
+    """
+    parameters_key = MinHashSketch.make_parameters_key( minhash_parameters( **parameters ) )
+    aggregates = MinHashSketch.objects.filter( parameters_key=parameters_key ).aggregate( count=Count('id'), updated=Max('updated') )
+    return (parameters_key, aggregates['count'], aggregates['updated'])
+
+
+def cached_suggest_comparison_mss( base_ms, count=5, system=None, lection_sample=50, seed=0, exclude=(), **parameters ):
+    """
+    Returns the result of `suggest_comparison_mss` from the Django cache if the stored MinHash sketches have not changed since it was computed.
+
+    The key includes the fingerprint of the sketches (see `minhash_fingerprint`) so that the suggestions are found again when any sketch is created, updated or deleted.
+    """
+    system = system or getattr( base_ms, 'system', None )
+    components = [
+        base_ms.id,
+        getattr( system, 'id', None ),
+        count,
+        lection_sample,
+        seed,
+        sorted( ms if isinstance(ms, int) else ms.id for ms in exclude ),
+        minhash_fingerprint( **parameters ),
+    ]
+    key = "dcodex_lectionary:suggest_comparison_mss:" + hashlib.sha1( repr(components).encode("utf-8") ).hexdigest()
+
+    # Only the IDs are cached so that the manuscripts are loaded again
+    suggestions = django_cache.get( key )
+    if suggestions is None:
+        suggestions = [
+            (ms.id, similarity)
+            for ms, similarity in suggest_comparison_mss( base_ms, count=count, system=system, lection_sample=lection_sample, seed=seed, exclude=exclude, **parameters )
+        ]
+        django_cache.set( key, suggestions, timeout=similarity_cache_timeout() )
+
+    mss = Manuscript.objects.in_bulk( [ms_id for ms_id, _ in suggestions] )
+    return [(mss[ms_id], similarity) for ms_id, similarity in suggestions if ms_id in mss]
+
+
+def update_minhash_sketches( transcription ):
+    """
+    Recomputes the MinHash sketches of the manuscript of a transcription that has been saved or deleted in the lections containing its verse.
+
+    The sketches are recomputed for each set of parameters which has been stored for any manuscript. Sketches are created for lections
+    which now have text and deleted for lections which no longer have any.
+    Returns the number of rows created or updated.
+    """
+    lections = list( Lection.objects.filter(
+        id__in=LectionaryVerseMembership.objects.filter( Q(verse_id=transcription.verse_id) | Q(verse__bible_verse_id=transcription.verse_id) ).values( 'lection_id' )
+    ) )
+    parameters_keys = list( MinHashSketch.objects.order_by().values_list( 'parameters_key', flat=True ).distinct() )
+    if not lections or not parameters_keys:
+        return 0
+
+    # Loaded with the polymorphic manager so that lectionaries are distinguished from other manuscripts
+    ms = Manuscript.objects.get( id=transcription.manuscript_id )
+    rows = {
+        (row.parameters_key, row.lection_id): row
+        for row in MinHashSketch.objects.filter( manuscript_id=ms.id, lection__in=lections )
+    }
+
+    now = timezone.now()
+    created = []
+    updated = []
+    removed = []
+    for parameters_key in parameters_keys:
+        parameters = MinHashSketch.objects.filter( parameters_key=parameters_key ).values_list( 'parameters', flat=True ).first()
+        new_rows = {new_row.lection.id: new_row for new_row in minhash_sketch_rows( ms, lections, parameters )}
+        for lection in lections:
+            row = rows.get( (parameters_key, lection.id) )
+            new_row = new_rows.get( lection.id )
+            if new_row is None:
+                if row is not None:
+                    removed.append( row.id )
+            elif row is None:
+                created.append( new_row )
+            else:
+                row.sketch = new_row.sketch
+                row.band_hashes = new_row.band_hashes
+                row.updated = now
+                updated.append( row )
+
+    MinHashSketch.objects.filter( id__in=removed ).delete()
+    MinHashSketch.objects.bulk_create( created )
+    MinHashSketch.objects.bulk_update( updated, ['sketch', 'band_hashes', 'updated'] )
+    return len(created) + len(updated)
+
+
+def similarity_lection_counts(
+    system,
+    base_ms,
+    comparison_mss,
+    min_verses=2,
+    gotoh_param=None,
+    ignore_incipits=False,
+    n_jobs=1,
+    cache=None,
+    progress=None,
+    backend=None,
+    materialized=None,
+    alignment_mode='verses',
+):
+    """
+    Returns a list of the LectionInSystem objects with at least `min_verses` verses and an array of shape (lections, manuscripts, 4) with their total Gotoh counts.
+
+    The totals are read from the LectionGotohTotals table if `materialized` is True (only when aligning verse by verse)
+    and otherwise they are aligned with `lections_gotoh_totals` using `alignment_mode`.
+    The counts only depend on the alignment parameters so they can be scored with different weights and priors with `score_lection_counts`.
+    """
+    cache = resolve_cache( cache )
+    lection_verses = LectionVerses( system )
+    lections_in_system = [
+        lection_in_system for lection_in_system in system.lections_in_system().select_related( 'lection' )
+        if lection_verses.verse_count( lection_in_system.lection ) >= min_verses
+    ]
+    if alignment_mode == 'verses' and use_materialized( materialized ):
+        totals = materialized_lection_counts(
+            system, base_ms, comparison_mss, gotoh_param=gotoh_param, ignore_incipits=ignore_incipits, n_jobs=n_jobs, cache=cache, progress=progress, backend=backend,
+        )
+        lection_counts = np.zeros( (len(lections_in_system), len(comparison_mss), 4), dtype=np.int64 )
+        for lection_index, lection_in_system in enumerate(lections_in_system):
+            lection_counts[lection_index] = totals[lection_in_system.lection_id]
+    else:
+        lection_counts = lections_gotoh_totals(
+            base_ms,
+            [lection_in_system.lection for lection_in_system in lections_in_system],
+            comparison_mss,
+            alignment_mode=alignment_mode,
+            gotoh_param=gotoh_param,
+            ignore_incipits=ignore_incipits,
+            n_jobs=n_jobs,
+            cache=cache,
+            progress=progress,
+            backend=backend,
+            lection_verses=lection_verses,
+        )
+    return lections_in_system, lection_counts
+
+
+def score_lection_counts( lections_in_system, comparison_mss, lection_counts, weights=None, prior_log_odds=0.0 ):
+    """ Returns a DataFrame with the similarity and probability for each comparison manuscript from the counts of `similarity_lection_counts`. """
+    similarity, probability = similarity_and_probability_arrays( lection_counts, weights, prior_log_odds )
+    return similarity_dataframe( lections_in_system, comparison_mss, np.arange( len(lections_in_system) ), similarity, probability )
+
+
+def labelled_affiliations( df ):
+    """
+    Finds the manuscripts and lections in a DataFrame of labelled affiliations for fitting and evaluating the similarity weights.
+
+    The DataFrame has the columns 'lection' (the description), 'base' and 'comparison' (sigla) and 'affiliated' (1 or 0).
+    Returns a list with a tuple for each base manuscript of the manuscript, the comparison manuscripts, the lections
+    and a list with the index of the lection and of the comparison manuscript for each of its rows, and an array of the labels of the rows in the same order.
+    Raises a ValueError if a column, manuscript or lection cannot be found.
+    """
+    missing_columns = {'lection', 'base', 'comparison', 'affiliated'} - set(df.columns)
+    if missing_columns:
+        raise ValueError( f"The CSV file is missing the columns: {', '.join(sorted(missing_columns))}" )
+
+    groups = []
+    labels = []
+    for base_siglum, base_df in df.groupby( 'base', sort=False ):
+        base_ms = Manuscript.find( str(base_siglum) )
+        if base_ms is None:
+            raise ValueError( f"Cannot find manuscript '{base_siglum}'." )
+
+        comparison_sigla = list(base_df['comparison'].astype(str).unique())
+        comparison_mss = [Manuscript.find( siglum ) for siglum in comparison_sigla]
+        for siglum, ms in zip(comparison_sigla, comparison_mss):
+            if ms is None:
+                raise ValueError( f"Cannot find manuscript '{siglum}'." )
+
+        descriptions = list(base_df['lection'].astype(str).unique())
+        lections = [Lection.objects.filter( description=description ).first() for description in descriptions]
+        for description, lection in zip(descriptions, lections):
+            if lection is None:
+                raise ValueError( f"Cannot find lection '{description}'." )
+
+        positions = []
+        for _, row in base_df.iterrows():
+            positions.append( (descriptions.index( str(row['lection']) ), comparison_sigla.index( str(row['comparison']) )) )
+            labels.append( int(row['affiliated']) )
+        groups.append( (base_ms, comparison_mss, lections, positions) )
+
+    return groups, np.array( labels )
+
+
+def similarity_probabilities_df(
+    system,
+    base_ms,
+    comparison_mss,
+    min_verses=2,
+    weights=None,
+    gotoh_param=None,
+    prior_log_odds=0.0,
+    ignore_incipits=False,
+    n_jobs=1,
+    cache=None,
+    progress=None,
+    backend=None,
+    materialized=None,
+    alignment_mode='verses',
+    bootstrap=0,
+    confidence=0.95,
+    seed=0,
+):
+    """
+    Returns a DataFrame with the similarity and probability for each comparison manuscript in each lection of the system with at least `min_verses` verses.
+
+    If `materialized` is True (the default comes from `use_materialized`) then the totals are read from the LectionGotohTotals table
+    and only the comparison manuscripts which have not been materialized are aligned. The materialized totals are aligned verse by verse
+    so they are not used if `alignment_mode` is 'lections', in which case whole lections are aligned (see `lections_gotoh_totals`).
+
+    If `bootstrap` is a number of resamples then there are also columns for the bounds of the `confidence` intervals of each manuscript
+    from resampling the verses of each lection with the random `seed`. These need the counts of each verse so the materialized totals are not used.
+    """
+    if bootstrap and alignment_mode != 'verses':
+        raise ValueError( "Bootstrap confidence intervals need the verses to be aligned separately." )
+    cache = resolve_cache( cache )
+    if not bootstrap and (alignment_mode != 'verses' or use_materialized( materialized )):
+        lections_in_system, lection_counts = similarity_lection_counts(
+            system,
+            base_ms,
+            comparison_mss,
+            min_verses=min_verses,
+            gotoh_param=gotoh_param,
+            ignore_incipits=ignore_incipits,
+            n_jobs=n_jobs,
+            cache=cache,
+            progress=progress,
+            backend=backend,
+            materialized=materialized,
+            alignment_mode=alignment_mode,
+        )
+        return score_lection_counts( lections_in_system, comparison_mss, lection_counts, weights=weights, prior_log_odds=prior_log_odds )
+
+    counts = similarity_counts(
+        system,
+        base_ms,
+        comparison_mss,
+        min_verses=min_verses,
+        gotoh_param=gotoh_param,
+        ignore_incipits=ignore_incipits,
+        n_jobs=n_jobs,
+        cache=cache,
+        progress=progress,
+        backend=backend,
+    )
+    df = score_similarity_counts( counts, weights=weights, prior_log_odds=prior_log_odds, bootstrap=bootstrap, confidence=confidence, seed=seed )
+
+    print('similarity_probabilities_df indexes:', len(df.index))
+    if cache:
+        logger.debug( "similarity_probabilities_df cache: %s", cache )
+    return df
+
+
+def similarity_dict( base_ms, comparison_mss, system=None, min_verses = 2, ignore_unstranscribed=True, ignore_incipits=False, gotoh_param=None, n_jobs=1, cache=None, progress=None, backend=None, materialized=None, alignment_mode='verses' ):
+    """
+    Returns a dictionary keyed by LectionInSystem with a dictionary of the similarity percentage for each comparison manuscript.
+
+    Only the lections with at least `min_verses` verses transcribed in the base manuscript are included.
+    The totals are read from the LectionGotohTotals table if `materialized` is True (only when aligning verse by verse)
+    and otherwise they are aligned with `lections_gotoh_totals` using `alignment_mode`.
+    """
     if system is None:
         system = get_system(base_ms, comparison_mss)
+    cache = resolve_cache( cache )
+
+    lection_verses = LectionVerses( system )
+    transcription_counts = lection_verses.transcription_counts( base_ms )
+    lections_in_system = [
+        lection_in_system for lection_in_system in system.lections_in_system().select_related( 'lection' )
+        if lection_verses.verse_count( lection_in_system.lection ) >= min_verses
+        and transcription_counts.get( lection_in_system.lection_id, 0 ) >= min_verses
+    ]
+
+    if alignment_mode == 'verses' and use_materialized( materialized ):
+        totals = materialized_lection_counts(
+            system, base_ms, comparison_mss, gotoh_param=gotoh_param, ignore_incipits=ignore_incipits, n_jobs=n_jobs, cache=cache, progress=progress, backend=backend,
+        )
+        lections_totals = [totals[lection_in_system.lection_id] for lection_in_system in lections_in_system]
+    else:
+        lections_totals = lections_gotoh_totals(
+            base_ms,
+            [lection_in_system.lection for lection_in_system in lections_in_system],
+            comparison_mss,
+            alignment_mode=alignment_mode,
+            gotoh_param=gotoh_param,
+            ignore_incipits=ignore_incipits,
+            n_jobs=n_jobs,
+            cache=cache,
+            progress=progress,
+            backend=backend,
+            lection_verses=lection_verses,
+        )
 
     similarity_dict = dict()
-    for lection_in_system in system.lections_in_system().all():
+    for lection_in_system, totals in zip(lections_in_system, lections_totals):
+        results = similarity_probabilities_from_totals( totals, include_probabilities=False )
+        similarity_dict[ lection_in_system ] = dict(zip( comparison_mss, results ))
+    return similarity_dict
 
-        lection = lection_in_system.lection
-        if lection.verses.count() < min_verses:
-            continue
-            
-        if isinstance(base_ms,Lectionary):
-            verses = lection.verses.all()
-        else:
-            verse_ids = lection.verses.exclude(bible_verse=None).values_list('bible_verse__id', flat=True)
-            verses = BibleVerse.objects.filter(id__in=verse_ids)
 
-        if VerseTranscriptionBase.objects.filter(manuscript=base_ms, verse__in=verses).count() < min_verses:
-            continue
+def similarity_preview(
+    base_ms,
+    comparison_mss,
+    system=None,
+    fraction=0.25,
+    seed=0,
+    confidence=0.95,
+    min_verses=2,
+    ignore_incipits=False,
+    gotoh_param=None,
+    backend=None,
+):
+    """
+    Returns an approximate `similarity_dict` from aligning a random sample of the verses in each lection (see `sampling.SampledSimilarity`).
 
-        results = similarity_lection( base_ms, lection, comparison_mss, **kwargs )
-        similarity_dict[ lection_in_system ] = dict(zip( comparison_mss, results ))
+    Verses are sampled with probability weighted by their mass until at least `fraction` of the mass of each lection has been aligned.
+    The sample of each lection depends only on `seed` and the lection so a larger fraction with the same seed aligns the same verses and more,
+    and a fraction of 1 gives the exact similarities.
+    The values are tuples of the estimated similarity and the bounds of the confidence interval (with None where there is no text to compare).
+    """
+    if system is None:
+        system = get_system(base_ms, comparison_mss)
+    gotoh_param = gotoh_param or DEFAULT_GOTOH_PARAM
+
+    lection_verses = LectionVerses( system )
+    transcription_counts = lection_verses.transcription_counts( base_ms )
+    lections_in_system = [
+        lection_in_system for lection_in_system in system.lections_in_system().select_related( 'lection' )
+        if lection_verses.verse_count( lection_in_system.lection ) >= min_verses
+        and transcription_counts.get( lection_in_system.lection_id, 0 ) >= min_verses
+    ]
+
+    def optional( value ):
+        return None if np.isnan( value ) else float(value)
+
+    similarity_dict = dict()
+    for lection_in_system in lections_in_system:
+        verses = lection_verses.verses[lection_in_system.lection_id]
+        sampled = sampling.SampledSimilarity(
+            lection_transcriptions( base_ms, lection_in_system.lection, comparison_mss, ignore_incipits, verses=verses ),
+            len(comparison_mss),
+            gotoh_param,
+            masses=[verse.mass for verse in verses],
+            seed=(seed, lection_in_system.lection_id),
+            backend=backend,
+        )
+        sampled.refine_to_fraction( fraction )
+        estimates = zip(*sampled.estimate( confidence ))
+        similarity_dict[ lection_in_system ] = {
+            ms: tuple( optional( value ) for value in estimate )
+            for ms, estimate in zip(comparison_mss, estimates)
+        }
     return similarity_dict
 
 
 def similarity_lection( base_ms, lection, comparison_mss, ignore_incipits=False ):
     return similarity_probabilities_lection(base_ms, lection, comparison_mss, ignore_incipits=ignore_incipits, include_probabilities=False)
+
+
+def best_match_lection( base_ms, lection, comparison_mss, threshold=None, gotoh_param=None, ignore_incipits=False, prune=True ):
+    """
+    Finds the comparison manuscript which is most similar to the base manuscript in a lection.
+
+    With `prune` the manuscripts which cannot beat the best so far (or the threshold) are not aligned. See `alignment.best_match`.
+    Returns a tuple with the index of the best manuscript (or None), its similarity and the number of manuscripts aligned.
+    """
+    gotoh_param = gotoh_param or DEFAULT_GOTOH_PARAM
+    transcriptions = lection_transcriptions( base_ms, lection, comparison_mss, ignore_incipits=ignore_incipits )
+    return alignment.best_match( transcriptions, len(comparison_mss), gotoh_param, threshold=threshold, prune=prune )
+
+
+def lection_families( lection_similarities, threshold ):
+    """
+    Returns the family of each lection from an array of similarities with shape (lections, manuscripts).
+
+    The family is the closest manuscript (ties go to the earlier manuscript) if its similarity is above the threshold,
+    FAMILY_UNCERTAIN if the closest similarity is not above the threshold and FAMILY_NONE if nothing could be aligned.
+    """
+    lection_similarities = np.asarray( lection_similarities, dtype=float )
+    if lection_similarities.shape[1] == 0:
+        return np.full( (len(lection_similarities),), FAMILY_NONE, dtype=np.int64 )
+
+    masked = np.where( np.isnan(lection_similarities), -np.inf, lection_similarities )
+    best_index = masked.argmax( axis=1 )
+    best_similarity = masked[np.arange(len(masked)), best_index]
+
+    families = np.where( best_similarity > threshold, best_index + FAMILY_OFFSET, FAMILY_UNCERTAIN )
+    return np.where( best_similarity > 0.0, families, FAMILY_NONE )
+
+
+def families_by_rank( families, rank_indexes, rank_count ):
+    """
+    Combines the families of verses onto an axis of verse ranks.
+
+    `families` and `rank_indexes` give the family and the index along the axis for each verse in a lection.
+    A rank gets a family if every lection with a family covering it agrees, FAMILY_MIXED if they disagree
+    and FAMILY_UNCERTAIN if the lections covering it are all uncertain.
+    Verses with FAMILY_NONE or outside the axis are ignored.
+
+    Returns the smallest integer array which can hold the families.
+    """
+    families = np.asarray( families )
+    rank_indexes = np.asarray( rank_indexes )
+    mask = (families != FAMILY_NONE) & (rank_indexes >= 0) & (rank_indexes < rank_count)
+    families = families[mask]
+    rank_indexes = rank_indexes[mask]
+
+    certain = families >= FAMILY_OFFSET
+    lowest = np.full( (rank_count,), np.iinfo(np.int64).max, dtype=np.int64 )
+    highest = np.zeros( (rank_count,), dtype=np.int64 )
+    np.minimum.at( lowest, rank_indexes[certain], families[certain] )
+    np.maximum.at( highest, rank_indexes[certain], families[certain] )
+    uncertain = np.zeros( (rank_count,), dtype=bool )
+    uncertain[rank_indexes[~certain]] = True
+
+    result = np.where( uncertain, FAMILY_UNCERTAIN, FAMILY_NONE )
+    result = np.where( highest >= FAMILY_OFFSET, np.where( lowest == highest, highest, FAMILY_MIXED ), result )
+    return result.astype( np.min_scalar_type( max(FAMILY_MIXED, result.max( initial=0 )) ) )
+
+
+def pruned_lection_similarities( system, base_ms, comparison_mss, gotoh_param=None, ignore_incipits=False ):
+    """
+    Returns the similarity of the closest comparison manuscript in each lection of a system in an array of shape (lections, manuscripts)
+    where the other manuscripts are NaN, with the IDs of the verses of the lections and the index of the lection of each verse.
+
+    The closest manuscript is found with `alignment.best_match` so that the manuscripts whose upper bound cannot beat the best so far are not aligned.
+    The array gives the same families with `lection_families` as the similarities of every manuscript.
+    """
+    gotoh_param = gotoh_param or DEFAULT_GOTOH_PARAM
+    lection_verses = LectionVerses( system )
+    lections_in_system = list( system.lections_in_system().select_related( 'lection' ) )
+
+    similarities = np.full( (len(lections_in_system), len(comparison_mss)), np.nan )
+    for lection_index, lection_in_system in enumerate(lections_in_system):
+        lection = lection_in_system.lection
+        transcriptions = lection_transcriptions( base_ms, lection, comparison_mss, ignore_incipits=ignore_incipits, verses=lection_verses.verses[lection.id] )
+        best_index, best_similarity, _ = alignment.best_match( transcriptions, len(comparison_mss), gotoh_param, prune=True )
+        if best_index is not None:
+            similarities[lection_index, best_index] = best_similarity
+
+    verse_ids = [lection_verses.verse_ids.get( lection_in_system.lection_id, np.zeros( (0,), dtype=np.int64 ) ) for lection_in_system in lections_in_system]
+    lection_index = np.repeat( np.arange( len(lections_in_system) ), [len(ids) for ids in verse_ids] )
+    return similarities, np.concatenate( [np.zeros( (0,), dtype=np.int64 )] + verse_ids ), lection_index
+
+
+def similarity_families_array( base_ms, comparison_mss, start_verse, end_verse, threshold, system=None, prune=False, gotoh_param=None, ignore_incipits=False, **kwargs ):
+    """
+    Returns an integer array with the family of each Bible verse from `start_verse` to `end_verse` according to which comparison manuscript is closest to the base manuscript.
+
+    The lections of the system are aligned in a single pass with `similarity_counts` (which takes the remaining keyword arguments).
+    If `prune` is True then instead only the manuscripts which can be the closest in each lection are aligned (see `pruned_lection_similarities`)
+    which gives the same families.
+    The values in the array are explained in `lection_families` and `families_by_rank`. Verses which are not mapped to a Bible verse with a rank are skipped.
+    """
+    system = system or get_system( base_ms, comparison_mss )
+    if prune:
+        similarities, verse_ids, lection_index = pruned_lection_similarities( system, base_ms, comparison_mss, gotoh_param=gotoh_param, ignore_incipits=ignore_incipits )
+    else:
+        counts = similarity_counts(
+            system,
+            base_ms,
+            comparison_mss,
+            gotoh_param=gotoh_param,
+            ignore_incipits=ignore_incipits,
+            lections_in_system=system.lections_in_system().select_related( 'lection' ),
+            **kwargs,
+        )
+        similarities = alignment.similarity_percentages( counts.lection_counts() )
+        verse_ids, lection_index = counts.verse_ids, counts.lection_index
+    families = lection_families( similarities, threshold )
+
+    ranks = dict( LectionaryVerse.objects.filter( id__in=np.unique(verse_ids).tolist() ).values_list( 'id', 'bible_verse__rank' ) )
+    rank_indexes = np.array( [-1 if ranks.get( verse_id ) is None else ranks[verse_id] - start_verse.rank for verse_id in verse_ids.tolist()], dtype=np.int64 )
+
+    return families_by_rank( families[lection_index], rank_indexes, end_verse.rank - start_verse.rank + 1 )
+
+
+def transcriptions_version( ms_id ):
+    """ Returns the version number for the transcriptions of a manuscript which is stored in the database (see `TranscriptionsVersion`). """
+    return TranscriptionsVersion.get_version( ms_id )
+
+
+def bump_transcriptions_version( ms_id ):
+    """ Changes the version number for the transcriptions of a manuscript so that cached results which include it are no longer used. """
+    TranscriptionsVersion.bump( ms_id )
+
+
+def transcriptions_fingerprint( ms ):
+    """
+    Returns a cheap fingerprint of the transcriptions of a manuscript.
+
+    It combines the number of transcriptions and the largest ID (which catch bulk changes) with the version number which changes whenever a transcription is saved or deleted.
+    """
+    aggregates = VerseTranscriptionBase.objects.filter( manuscript=ms ).aggregate( count=Count('id'), max_id=Max('id') )
+    return (ms.id, aggregates['count'], aggregates['max_id'], transcriptions_version( ms.id ))
+
+
+def similarity_cache_key( name, system, base_ms, comparison_mss, **kwargs ):
+    """ Returns a key for the Django cache for the result of a similarity function with these manuscripts and parameters. """
+    components = [
+        name,
+        system.id,
+        [transcriptions_fingerprint( ms ) for ms in [base_ms] + list(comparison_mss)],
+        sorted( (key, repr(value)) for key, value in kwargs.items() ),
+    ]
+    digest = hashlib.sha1( repr(components).encode("utf-8") ).hexdigest()
+    return f"dcodex_lectionary:{name}:{digest}"
+
+
+def similarity_cache_timeout():
+    return getattr( settings, "DCODEX_LECTIONARY_SIMILARITY_CACHE_TIMEOUT", None )
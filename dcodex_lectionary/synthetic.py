@@ -0,0 +1,122 @@
+"""
+Synthetic lectionary texts with controlled variation for benchmarks and tests.
+
+The texts imitate normalized Greek transcriptions (lowercase letters without spaces or accents) and the variation imitates
+common scribal changes: itacisms and other spelling changes, omitted and added words and transposed words.
+Nothing in this module imports Django.
+"""
+import numpy as np
+
+# Approximate frequencies of the letters in the Greek New Testament (final sigma is normalized to sigma)
+GREEK_LETTER_FREQUENCIES = {
+    'α': 8.8, 'β': 0.5, 'γ': 1.8, 'δ': 2.0, 'ε': 7.9, 'ζ': 0.2, 'η': 4.0, 'θ': 1.4,
+    'ι': 7.4, 'κ': 3.9, 'λ': 3.0, 'μ': 3.2, 'ν': 8.9, 'ξ': 0.2, 'ο': 9.9, 'π': 3.0,
+    'ρ': 3.6, 'σ': 7.0, 'τ': 8.0, 'υ': 4.7, 'φ': 1.0, 'χ': 1.2, 'ψ': 0.1, 'ω': 2.3,
+}
+GREEK_LETTERS = np.array( list(GREEK_LETTER_FREQUENCIES) )
+GREEK_LETTER_PROBABILITIES = np.array( list(GREEK_LETTER_FREQUENCIES.values()) )/sum(GREEK_LETTER_FREQUENCIES.values())
+
+# Pairs of spellings which scribes often confuse
+SPELLING_CHANGES = [('ει', 'ι'), ('αι', 'ε'), ('ο', 'ω'), ('η', 'ι'), ('οι', 'υ'), ('ν', '')]
+
+
+def greek_like_word( rng, mean_length=5 ):
+    """ Returns a random word with Greek letter frequencies. """
+    length = max( 1, int(rng.poisson( mean_length )) )
+    return "".join( rng.choice( GREEK_LETTERS, size=length, p=GREEK_LETTER_PROBABILITIES ) )
+
+
+def greek_like_verse( rng, mean_words=15 ):
+    """ Returns a list of random words for a verse. """
+    return [greek_like_word( rng ) for _ in range(max( 1, int(rng.poisson( mean_words )) ))]
+
+
+def change_spelling( rng, word ):
+    """ Returns a word with one of the common spelling changes (or a random letter substituted if none apply). """
+    options = [(before, after) for before, after in SPELLING_CHANGES if before in word]
+    options += [(after, before) for before, after in SPELLING_CHANGES if after and after in word]
+    if options:
+        before, after = options[rng.integers( len(options) )]
+        return word.replace( before, after, 1 )
+    position = rng.integers( len(word) )
+    return word[:position] + rng.choice( GREEK_LETTERS, p=GREEK_LETTER_PROBABILITIES ) + word[position+1:]
+
+
+def vary_words( rng, words, rate ):
+    """
+    Returns a copy of a list of words where each word is changed with probability `rate`.
+
+    A change is a spelling change (60%), an omission (15%), an added word (15%) or a transposition with the next word (10%).
+    """
+    words = list(words)
+    varied = []
+    index = 0
+    while index < len(words):
+        word = words[index]
+        if rng.random() >= rate:
+            varied.append( word )
+            index += 1
+            continue
+
+        kind = rng.random()
+        if kind < 0.6:
+            varied.append( change_spelling( rng, word ) )
+        elif kind < 0.75:
+            pass
+        elif kind < 0.9:
+            varied += [word, greek_like_word( rng )]
+        elif index + 1 < len(words):
+            varied += [words[index+1], word]
+            index += 1
+        else:
+            varied.append( word )
+        index += 1
+    return varied
+
+
+class SyntheticTradition():
+    """
+    The texts of a set of synthetic manuscripts for the verses of a set of lections.
+
+    The manuscripts are divided into `family_count` families. The text of each family is varied from an original text at `variation_rate`
+    and the text of each manuscript is varied from its family text at half that rate. Each verse of a manuscript is missing with probability `lacuna_rate`.
+
+    `texts[ms_index][lection_index][verse_index]` is the normalized text of a verse (None if it is missing)
+    and `families[ms_index]` is the family of each manuscript. The same seed always gives the same texts.
+    """
+    def __init__( self, lection_count, verses_per_lection, manuscript_count, variation_rate=0.05, family_count=2, lacuna_rate=0.0, seed=0 ):
+        self.lection_count = lection_count
+        self.verses_per_lection = verses_per_lection
+        self.manuscript_count = manuscript_count
+        self.variation_rate = variation_rate
+        self.family_count = family_count
+        self.lacuna_rate = lacuna_rate
+        self.seed = seed
+
+        rng = np.random.default_rng( seed )
+        original = [[greek_like_verse( rng ) for _ in range(verses_per_lection)] for _ in range(lection_count)]
+        family_texts = [
+            [[vary_words( rng, words, variation_rate ) for words in lection] for lection in original]
+            for _ in range(family_count)
+        ]
+
+        self.families = [ms_index % family_count for ms_index in range(manuscript_count)]
+        self.texts = []
+        for family in self.families:
+            self.texts.append( [
+                [
+                    None if rng.random() < lacuna_rate else "".join( vary_words( rng, words, 0.5 * variation_rate ) )
+                    for words in lection
+                ]
+                for lection in family_texts[family]
+            ] )
+
+    def lection_transcriptions( self, base_index, lection_index, comparison_indexes ):
+        """ Returns the transcriptions of a lection in the same format as `similarity.lection_transcriptions`. """
+        transcriptions = []
+        for verse_index, base_transcription in enumerate(self.texts[base_index][lection_index]):
+            if not base_transcription:
+                transcriptions.append( (None, []) )
+                continue
+            transcriptions.append( (base_transcription, [self.texts[ms_index][lection_index][verse_index] for ms_index in comparison_indexes]) )
+        return transcriptions
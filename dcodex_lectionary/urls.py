@@ -11,6 +11,7 @@ urlpatterns = [
     path('ajax/toggle_affiliation_lection', views.toggle_affiliation_lection, name='dcodex-lectionary-toggle-affiliation-lection'),
     
     path('ajax/lection-suggestions/', views.lection_suggestions, name='dcodex-lectionary-lection-suggestions'),    
+    path('ajax/similarity-job/<int:job_id>/', views.similarity_job_progress, name='dcodex-lectionary-similarity-job-progress'),    
     
     path('ms/<str:request_siglum>/count/', views.count, name='dcodex-lectionary-count'),    
     path('ms/<str:request_siglum>/<str:comparison_sigla_string>/similarity/', views.similarity, name='dcodex-lectionary-similarity'),    
@@ -1,4 +1,4 @@
-from django.http import HttpResponse
+from django.http import HttpResponse, HttpResponseBadRequest
 from django.http import Http404
 from django.shortcuts import get_object_or_404, render
 from django.contrib.auth.decorators import login_required
@@ -8,8 +8,12 @@ from dcodex_lectionary.models import *
 from dcodex.util import get_request_dict
 import logging
 import json
+import math
 
-from .similarity import similarity_dict
+from django.core.cache import cache as django_cache
+
+from .similarity import get_system, similarity_cache_key, similarity_preview, cached_suggest_comparison_mss, score_lection_counts
+from .jobs import submit_similarity_job
 
 @login_required
 def lection_verses(request):
@@ -181,6 +185,75 @@ def complete(request, request_sigla, request_lections):
 
 
 
+def similarity_job_result( kind, manuscript, comparison_mss, **parameters ):
+    """
+    Returns a tuple with the similarity result and the background job which computes it.
+
+    The result comes from the cache or from a finished job. If the job has not finished then the result is None.
+    """
+    system = get_system( manuscript, comparison_mss )
+    result = django_cache.get( similarity_cache_key( kind, system, manuscript, comparison_mss, **parameters ) )
+    if result is not None:
+        return result, None
+
+    job = submit_similarity_job( kind, system, manuscript, comparison_mss, **parameters )
+    if job.status != SimilarityJob.DONE:
+        return None, job
+    if kind == SimilarityJob.SIMILARITY_DICT:
+        return job.similarity_dict(), job
+    return job.lection_counts(), job
+
+
+MIN_PREVIEW_FRACTION = 0.01
+
+# The parameters which change the alignments and those which only change how the aligned counts are scored
+ALIGNMENT_PARAMETERS = ['gotoh_param', 'ignore_incipits']
+SCORING_PARAMETERS = ['weights', 'prior_log_odds']
+
+
+def similarity_parameters( request, keys=None ):
+    """
+    Returns the keyword arguments from the SimilarityParameters named in the 'parameters' GET variable.
+
+    Without a parameter set only `ignore_incipits` is given (True, the same as the default for a parameter set).
+    If `keys` is given then only those keyword arguments are included.
+    """
+    parameters = dict( ignore_incipits=True )
+    name = request.GET.get('parameters')
+    if name:
+        parameters.update( get_object_or_404(SimilarityParameters, name=name).parameters() )
+    return {key: value for key, value in parameters.items() if keys is None or key in keys}
+
+
+def preview_parameters( request ):
+    """
+    Returns the fraction of the text to sample for a preview (or None for the full result) and the random seed from the GET variables 'preview' and 'seed'.
+
+    The fraction is clamped between MIN_PREVIEW_FRACTION and 1 so that refining a preview always samples more of the text.
+    Raises a ValueError if either variable is not a number.
+    """
+    preview = request.GET.get('preview')
+    seed = request.GET.get('seed', 0)
+    try:
+        seed = int(seed)
+    except ValueError:
+        raise ValueError( f"The seed '{seed}' is not an integer." )
+    if not preview:
+        return None, seed
+    try:
+        preview = float(preview)
+    except ValueError:
+        raise ValueError( f"The preview fraction '{preview}' is not a number." )
+    if not math.isfinite( preview ):
+        raise ValueError( f"The preview fraction '{preview}' is not a finite number." )
+    return min( max( preview, MIN_PREVIEW_FRACTION ), 1.0 ), seed
+
+
+def render_similarity_job( request, manuscript, job ):
+    title = "%s Similarity" % (str(manuscript.siglum))
+    return render(request, 'dcodex_lectionary/similarity_job.html', {'manuscript': manuscript, 'job': job, 'title': title} )
+
+
 @login_required
 def similarity(request, request_siglum, comparison_sigla_string):
     if request_siglum.isdigit():
@@ -194,10 +267,35 @@ def similarity(request, request_siglum, comparison_sigla_string):
         comparison_ms = Manuscript.objects.filter(siglum=comparison_siglum).first()
         if comparison_ms:
             comparison_mss.append( comparison_ms )
-    
-    data = similarity_dict( manuscript, comparison_mss, ignore_incipits=True )
+
+    # The nearest manuscripts from the MinHash index are compared if none of the comparison sigla were found
+    suggested = not comparison_mss
+    if suggested:
+        comparison_mss = [ms for ms, _ in cached_suggest_comparison_mss( manuscript )]
+        comparison_sigla_string = ",".join( ms.siglum for ms in comparison_mss ) or comparison_sigla_string
+
+    # An approximate preview from a sample of the verses is computed in the request rather than in a background job
+    try:
+        preview, seed = preview_parameters( request )
+    except ValueError as error:
+        return HttpResponseBadRequest( str(error) )
+    if preview:
+        data = similarity_preview( manuscript, comparison_mss, fraction=preview, seed=seed, **similarity_parameters( request, keys=ALIGNMENT_PARAMETERS ) )
+    else:
+        data, job = similarity_job_result( SimilarityJob.SIMILARITY_DICT, manuscript, comparison_mss, **similarity_parameters( request, keys=ALIGNMENT_PARAMETERS ) )
+        if data is None:
+            return render_similarity_job( request, manuscript, job )
     threshold = 76.4    
 
+    # Other manuscripts to add to the comparison are only looked up in the MinHash index for the final table (not for previews or while the job runs)
+    # and the suggestions are cached until the stored sketches change
+    suggestions = []
+    if not preview and not suggested:
+        suggestions = [
+            (ms, similarity, ",".join( [comparison_ms.siglum for comparison_ms in comparison_mss] + [ms.siglum] ))
+            for ms, similarity in cached_suggest_comparison_mss( manuscript, exclude=comparison_mss )
+        ]
+
     context = dict(
         manuscript=manuscript,
         data=data,
@@ -206,6 +304,10 @@ def similarity(request, request_siglum, comparison_sigla_string):
         bible_mss=BibleManuscript.objects.all(),
         comparison_sigla_string=comparison_sigla_string,
         threshold=threshold,
+        preview=preview,
+        refined_preview=min( 2.0 * preview, 1.0 ) if preview else None,
+        seed=seed,
+        suggestions=suggestions,
     )
     return render(request, 'dcodex_lectionary/similarity.html', context )
 
@@ -224,7 +326,12 @@ def similarity_probabilities(request, request_siglum, comparison_sigla_string):
         if comparison_ms:
             comparison_mss.append( comparison_ms )
     
-    df = manuscript.similarity_probabilities_df(comparison_mss, ignore_incipits=True)
+    # The job only aligns the texts so that changing the weights or the prior of the parameter set rescores the same counts
+    counts, job = similarity_job_result( SimilarityJob.LECTION_COUNTS, manuscript, comparison_mss, **similarity_parameters( request, keys=ALIGNMENT_PARAMETERS ) )
+    if counts is None:
+        return render_similarity_job( request, manuscript, job )
+    lections_in_system, lection_counts = counts
+    df = score_lection_counts( lections_in_system, comparison_mss, lection_counts, **similarity_parameters( request, keys=SCORING_PARAMETERS ) )
     title = "%s Similarity" % (str(manuscript.siglum))
     threshold = 76.4    
     styled_df = df.style.apply( lambda x: ['font-weight: bold; background-color: yellow' if value and value > threshold else '' for value in x],
@@ -232,6 +339,12 @@ def similarity_probabilities(request, request_siglum, comparison_sigla_string):
     return render(request, 'dcodex/table.html', {'table': styled_df.render(), 'title':title} )
 
 
+@login_required
+def similarity_job_progress(request, job_id):
+    job = get_object_or_404(SimilarityJob, id=job_id)
+    return JsonResponse( job.progress_dict() )
+
+
 @login_required
 def affiliation_lections(request, affiliation_id, system_id):
     affiliation = get_object_or_404(AffiliationLections, id=affiliation_id)   
@@ -0,0 +1,95 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import gotoh
+import numpy as np
+
+from dcodex_lectionary import alignment
+
+GOTOH_PARAM = [6.6995597099885345, -0.9209875054657459, -5.097397327423096, -1.3005714416503906]
+
+LECTIONS_TRANSCRIPTIONS = [
+    [
+        ("εναρχηηνολογος", ["εναρχηηνολογος", "εναρχηνολογος", None]),
+        (None, []),
+        ("καιολογοςηνπροςτονθν", ["καιολογοςηνπροςτονθεον", "", "καιολογοςην"]),
+    ],
+    [
+        ("ουτοςηνεναρχηπροςτονθν", ["ουτοςηνενα", "ουτοςηνεναρχηπροςτονθν", "ουτοςεναρχηπροςτονθεον"]),
+    ],
+]
+
+
+def test_verse_counts():
+    counts = alignment.verse_counts( LECTIONS_TRANSCRIPTIONS[0], 3, GOTOH_PARAM )
+    assert counts.shape == (3, 3, 4)
+    assert tuple(counts[0,0]) == gotoh.counts( "εναρχηηνολογος", "εναρχηηνολογος", *GOTOH_PARAM )
+    assert tuple(counts[0,1]) == gotoh.counts( "εναρχηηνολογος", "εναρχηνολογος", *GOTOH_PARAM )
+    assert counts[0,2].sum() == 0
+    assert counts[1].sum() == 0
+    assert counts[2,1].sum() == 0
+
+
+def test_lections_verse_counts_process_pool():
+    serial = alignment.lections_verse_counts( LECTIONS_TRANSCRIPTIONS, 3, GOTOH_PARAM )
+    with ProcessPoolExecutor( max_workers=2 ) as executor:
+        futures = [executor.submit( alignment.lections_verse_counts, [transcriptions], 3, GOTOH_PARAM ) for transcriptions in LECTIONS_TRANSCRIPTIONS]
+        parallel = [counts for future in futures for counts in future.result()]
+
+    assert len(serial) == len(parallel)
+    for serial_counts, parallel_counts in zip(serial, parallel):
+        np.testing.assert_array_equal( serial_counts, parallel_counts )
+
+
+def test_resolve_n_jobs():
+    assert alignment.resolve_n_jobs( None ) == 1
+    assert alignment.resolve_n_jobs( 1 ) == 1
+    assert alignment.resolve_n_jobs( 4 ) == 4
+    assert alignment.resolve_n_jobs( -1 ) >= 1
+
+
+def test_best_match_pruning():
+    rng = np.random.default_rng( 7 )
+    alphabet = list("αβγδεηικλμνοπρστυω")
+    for _ in range(20):
+        transcriptions = []
+        for _ in range(3):
+            base = "".join( rng.choice( alphabet, size=rng.integers(5, 25) ) )
+            comparisons = []
+            for _ in range(5):
+                text = list(base)
+                for _ in range(rng.integers(0, 6)):
+                    text[rng.integers(0, len(text))] = rng.choice( alphabet )
+                comparisons.append( "".join(text) if rng.random() > 0.1 else None )
+            transcriptions.append( (base, comparisons) )
+
+        for threshold in [None, 80.0]:
+            exact = alignment.best_match( transcriptions, 5, GOTOH_PARAM, threshold=threshold, prune=False )
+            pruned = alignment.best_match( transcriptions, 5, GOTOH_PARAM, threshold=threshold, prune=True )
+            assert pruned[0] == exact[0]
+            if exact[0] is not None:
+                assert pruned[1] == exact[1]
+            assert pruned[2] <= exact[2]
+
+        bounds = alignment.similarity_upper_bounds( transcriptions, 5 )
+        counts = alignment.verse_counts( transcriptions, 5, GOTOH_PARAM ).sum( axis=0 )
+        similarities = alignment.similarity_percentages( counts )
+        assert np.all( np.isnan(similarities) | (similarities <= bounds) )
+
+
+def test_lections_counts():
+    pairs = alignment.concatenated_pairs( LECTIONS_TRANSCRIPTIONS[0], 3 )
+    assert pairs[0] == ("εναρχηηνολογος καιολογοςηνπροςτονθν", "εναρχηηνολογος\u0120καιολογοςηνπροςτονθεον")
+    assert pairs[1] == ("εναρχηηνολογος", "εναρχηνολογος")
+    assert pairs[2] == ("καιολογοςηνπροςτονθν", "καιολογοςην")
+
+    counts = alignment.lections_counts( LECTIONS_TRANSCRIPTIONS, 3, GOTOH_PARAM )
+    assert counts.shape == (2, 3, 4)
+
+    # The separators are aligned in the same way but are not counted as a match
+    matches, mismatches, gap_openings, gap_extensions = gotoh.counts( "εναρχηηνολογος καιολογοςηνπροςτονθν", "εναρχηηνολογος καιολογοςηνπροςτονθεον", *GOTOH_PARAM )
+    assert tuple(counts[0,0]) == (matches - 1, mismatches, gap_openings, gap_extensions)
+    assert tuple(counts[1,1]) == gotoh.counts( "ουτοςηνεναρχηπροςτονθν", "ουτοςηνεναρχηπροςτονθν", *GOTOH_PARAM )
+
+    results = alignment.benchmark_alignment_modes( LECTIONS_TRANSCRIPTIONS, 3, GOTOH_PARAM )
+    assert set(results) == {'verses', 'lections', 'mean_difference', 'max_difference'}
+    assert results['max_difference'] >= results['mean_difference'] >= 0.0
@@ -0,0 +1,22 @@
+import numpy as np
+import pytest
+
+from dcodex_lectionary import backends
+
+GOTOH_PARAM = [6.6995597099885345, -0.9209875054657459, -5.097397327423096, -1.3005714416503906]
+
+
+def test_get_backend():
+    assert isinstance( backends.get_backend(), backends.GotohBackend )
+    backend = backends.GotohBackend()
+    assert backends.get_backend( backend ) is backend
+    with pytest.raises( ValueError ):
+        backends.get_backend( 'unknown' )
+
+
+def test_gotoh_backend():
+    pairs = [("abc", "abd"), ("abc", ""), ("", "")]
+    counts = backends.GotohBackend().counts( pairs, GOTOH_PARAM )
+    assert counts.shape == (3, 4)
+    assert counts[0].tolist() == [2, 1, 0, 0]
+    assert counts[2].tolist() == [0, 0, 0, 0]
@@ -0,0 +1,63 @@
+import numpy as np
+
+from dcodex_lectionary import changepoints
+
+
+def brute_force_segmentation( cost, length, penalty, min_size ):
+    """ Finds the optimal segmentation by trying every set of change points (only for short series). """
+    from itertools import combinations
+    best_total = np.inf
+    best_points = []
+    for count in range(length):
+        for points in combinations( range(1, length), count ):
+            boundaries = [0, *points, length]
+            if any( end - start < min_size for start, end in zip(boundaries[:-1], boundaries[1:]) ):
+                continue
+            total = sum( cost.cost( start, end ) + penalty for start, end in zip(boundaries[:-1], boundaries[1:]) )
+            if total < best_total - 1e-9:
+                best_total = total
+                best_points = list(points)
+    return best_points
+
+
+def test_pelt_is_optimal():
+    rng = np.random.default_rng( 4 )
+    series = np.concatenate( [rng.normal( 0, 1, (5, 2) ), rng.normal( 3, 1, (4, 2) ), rng.normal( -1, 1, (3, 2) )] )
+    series[2,0] = np.nan
+    cost = changepoints.MeanChangeCost( series )
+    for penalty in [1.0, 5.0, 20.0]:
+        assert changepoints.pelt( cost, len(series), penalty, min_size=2 ) == brute_force_segmentation( cost, len(series), penalty, 2 )
+
+
+def test_detect_change_points():
+    rng = np.random.default_rng( 0 )
+    series = np.concatenate( [rng.normal( 90, 2, (60, 3) ), rng.normal( 80, 2, (40, 3) )] )
+    series[rng.random( series.shape ) < 0.1] = np.nan
+
+    change_points = changepoints.detect_change_points( series )
+    assert [change_point['index'] for change_point in change_points] == [60]
+    assert change_points[0]['score'] > 0
+    np.testing.assert_allclose( change_points[0]['before'], 90, atol=1.5 )
+    np.testing.assert_allclose( change_points[0]['after'], 80, atol=1.5 )
+
+    assert changepoints.detect_change_points( rng.normal( 90, 2, (100, 3) ) ) == []
+
+
+def test_normalized_ranks():
+    ranks = changepoints.normalized_ranks( [3.0, np.nan, 1.0, 3.0, 2.0] )
+    np.testing.assert_allclose( ranks, [3.5/4, np.nan, 1/4, 3.5/4, 2/4] )
+
+
+def test_no_false_positives():
+    rng = np.random.default_rng( 1 )
+
+    # Per verse: most verses agree exactly and the rest are spread out
+    series = np.where( rng.random( (1500, 3) ) < 0.7, 100.0, rng.uniform( 80, 100, (1500, 3) ) )
+    assert changepoints.detect_change_points( series, min_size=5 ) == []
+    assert changepoints.detect_change_points( series[:,0] ) == []
+
+    # Per lection with a few outlier lections
+    series = rng.normal( 92, 2, (300, 3) )
+    outliers = rng.random( series.shape ) < 0.05
+    series[outliers] = rng.uniform( 20, 60, outliers.sum() )
+    assert changepoints.detect_change_points( series ) == []
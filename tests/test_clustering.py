@@ -0,0 +1,90 @@
+import time
+
+import numpy as np
+import pytest
+
+from dcodex_lectionary import clustering
+
+
+def nan_rms_distance( a, b ):
+    present = ~np.isnan( a ) & ~np.isnan( b )
+    if not present.any():
+        return np.nan
+    return np.sqrt( np.mean( (a[present] - b[present])**2 ) )
+
+
+def test_profile_distances_match_pairwise_loop():
+    rng = np.random.default_rng( 1 )
+    profiles = rng.uniform( 50, 100, (7, 30) )
+    profiles[rng.random( profiles.shape ) < 0.3] = np.nan
+    profiles[6,:] = np.nan
+    profiles[6,0] = 80.0
+
+    distances = clustering.profile_distances( profiles )
+    expected = [nan_rms_distance( profiles[i], profiles[j] ) for i in range(7) for j in range(i+1, 7)]
+    np.testing.assert_allclose( distances, expected, rtol=1e-9, atol=1e-6 )
+
+
+def test_profile_distances_min_overlap():
+    profiles = np.array( [
+        [1.0, 2.0, np.nan],
+        [1.0, np.nan, 3.0],
+        [2.0, 2.0, 3.0],
+    ] )
+    distances = clustering.profile_distances( profiles, min_overlap=2 )
+    assert np.isnan( distances[0] )
+    np.testing.assert_allclose( distances[1:], [np.sqrt( 0.5 ), np.sqrt( 0.5 )] )
+
+
+def test_clusters_recover_groups():
+    rng = np.random.default_rng( 2 )
+    centres = rng.uniform( 60, 100, (3, 40) )
+    profiles = np.concatenate( [centre + rng.normal( 0, 1, (5, 40) ) for centre in centres] )
+    profiles[rng.random( profiles.shape ) < 0.2] = np.nan
+    labels = [f"L{index}" for index in range(len(profiles))]
+
+    result = clustering.ProfileClustering( profiles, labels )
+    assignments = result.assignments( cluster_count=3 ).set_index( 'label' )['cluster']
+    for group in range(3):
+        assert assignments[labels[5*group:5*group+5]].nunique() == 1
+    assert assignments.nunique() == 3
+
+    newick = result.newick()
+    assert newick.endswith( ";" )
+    assert all( f"'{label}':" in newick for label in labels )
+    assert newick.count( "(" ) == len(labels) - 1
+
+    dendrogram = result.dendrogram( no_plot=True )
+    assert sorted( dendrogram['ivl'] ) == sorted( labels )
+
+
+def test_missing_distances_join_last():
+    profiles = np.array( [
+        [1.0, 1.0, np.nan, np.nan],
+        [1.2, 1.1, np.nan, np.nan],
+        [np.nan, np.nan, 5.0, 5.0],
+    ] )
+    result = clustering.ProfileClustering( profiles, ["A", "B", "C"] )
+    assignments = result.assignments( cluster_count=2 ).set_index( 'label' )['cluster']
+    assert assignments["A"] == assignments["B"] != assignments["C"]
+
+
+def test_assignments_need_a_cut():
+    result = clustering.ProfileClustering( np.array( [[1.0], [2.0]] ), ["A", "B"] )
+    with pytest.raises( ValueError ):
+        result.assignments()
+
+
+def test_hundred_manuscripts_are_fast():
+    rng = np.random.default_rng( 3 )
+    profiles = rng.uniform( 50, 100, (100, 100, 500) )
+    profiles[rng.random( profiles.shape ) < 0.3] = np.nan
+    start = time.perf_counter()
+    clustering.ProfileClustering( profiles, range(100) )
+    assert time.perf_counter() - start < 10.0
+
+
+def test_newick_label():
+    assert clustering.newick_label( "L1" ) == "'L1'"
+    assert clustering.newick_label( "Lect 1 (A):2" ) == "'Lect 1 (A):2'"
+    assert clustering.newick_label( "O'Brien" ) == "'O''Brien'"
@@ -0,0 +1,114 @@
+import numpy as np
+
+from dcodex_lectionary import consensus
+
+GOTOH_PARAM = [6.6995597099885345, -0.9209875054657459, -5.097397327423096, -1.3005714416503906]
+
+
+def optimal_score( a, b, gotoh_param ):
+    """ The best score of an alignment with affine gaps from a dynamic programme with a state for each kind of column. """
+    match, mismatch, gap_open, gap_extend = gotoh_param
+    n, m = len(a), len(b)
+    diagonal = np.full( (n+1, m+1), -np.inf )
+    up = np.full( (n+1, m+1), -np.inf )
+    left = np.full( (n+1, m+1), -np.inf )
+    diagonal[0,0] = 0.0
+    for i in range(n+1):
+        for j in range(m+1):
+            if i and j:
+                diagonal[i,j] = max( diagonal[i-1,j-1], up[i-1,j-1], left[i-1,j-1] ) + (match if a[i-1] == b[j-1] else mismatch)
+            if i:
+                up[i,j] = max( diagonal[i-1,j] + gap_open, up[i-1,j] + gap_extend, left[i-1,j] + gap_open )
+            if j:
+                left[i,j] = max( diagonal[i,j-1] + gap_open, left[i,j-1] + gap_extend, up[i,j-1] + gap_open )
+    return max( diagonal[n,m], up[n,m], left[n,m] )
+
+
+def alignment_columns( pivot, readings, insertions ):
+    columns = []
+    for position, character in enumerate(pivot):
+        columns.extend( (None, inserted) for inserted in insertions[position] )
+        columns.append( (character, chr(readings[position]) if readings[position] != consensus.GAP else None) )
+    columns.extend( (None, inserted) for inserted in insertions[-1] )
+    return columns
+
+
+def alignment_score( columns, gotoh_param ):
+    match, mismatch, gap_open, gap_extend = gotoh_param
+    score = 0.0
+    previous = None
+    for a, b in columns:
+        kind = 'diagonal' if a and b else ('up' if a else 'left')
+        if kind == 'diagonal':
+            score += match if a == b else mismatch
+        else:
+            score += gap_extend if kind == previous else gap_open
+        previous = kind
+    return score
+
+
+def test_align_to_pivot_is_optimal():
+    rng = np.random.default_rng( 0 )
+    for _ in range(50):
+        pivot = "".join( rng.choice( list("abcd"), rng.integers( 1, 12 ) ) )
+        witnesses = ["".join( rng.choice( list("abcdx"), rng.integers( 1, 12 ) ) ) for _ in range(3)]
+        readings, insertions = consensus.align_to_pivot( pivot, witnesses, GOTOH_PARAM )
+        for witness, witness_readings, witness_insertions in zip(witnesses, readings, insertions):
+            columns = alignment_columns( pivot, witness_readings, witness_insertions )
+            assert "".join( b for _, b in columns if b ) == witness
+            assert np.isclose( alignment_score( columns, GOTOH_PARAM ), optimal_score( pivot, witness, GOTOH_PARAM ) )
+
+
+def test_align_to_pivot_insertions():
+    readings, insertions = consensus.align_to_pivot( "καιολογος", ["xxκαιολογοςyy", "ολογος"], GOTOH_PARAM )
+    assert insertions[0][0] == "xx"
+    assert insertions[0][-1] == "yy"
+    assert "".join( chr(code) for code in readings[0] ) == "καιολογος"
+    assert list(readings[1,:3]) == [consensus.GAP] * 3
+
+
+def test_majority_readings_tie_breaker():
+    readings = np.array( [[1, 2], [3, 2], [3, 4], [1, 4]] )
+    majority, votes = consensus.majority_readings( readings, tie_breaker=0 )
+    assert list(majority) == [1, 2]
+    assert list(votes) == [2, 2]
+
+
+def test_verse_consensus():
+    texts = ["εν αρχη ην ο λογος", "εν αρχη ην λογος", "εν αρχη ην ο λογοσ", None, "εναρχη ην ο λογος και"]
+    verse = consensus.verse_consensus( texts, GOTOH_PARAM )
+    assert verse.text == "εν αρχη ην ο λογος"
+    assert verse.witness_count == 4
+    assert np.isnan( verse.witness_agreement[3] )
+    assert verse.witness_agreement[0] == 1.0
+    assert 0.0 < verse.unanimity < verse.agreement < 1.0
+
+
+def test_verse_consensus_recovers_base_text():
+    rng = np.random.default_rng( 1 )
+    base = "".join( rng.choice( list("αβγδεζηθικλμνξοπρστυφχψω "), 80 ) )
+
+    def corrupt( text ):
+        characters = list(text)
+        for _ in range(4):
+            position = rng.integers( 0, len(characters) )
+            kind = rng.integers( 0, 3 )
+            if kind == 0:
+                characters[position] = "ς"
+            elif kind == 1:
+                del characters[position]
+            else:
+                characters.insert( position, "ϛ" )
+        return "".join( characters )
+
+    texts = [corrupt( base ) for _ in range(9)]
+    assert consensus.verse_consensus( texts, GOTOH_PARAM ).text == base
+    assert consensus.verse_consensus( texts, GOTOH_PARAM, iterations=2 ).text == base
+
+
+def test_lection_consensus():
+    lection = consensus.lection_consensus( [["abc", "abc", "abd"], [None, None, None], ["xyz", None, "xyz"]], GOTOH_PARAM )
+    assert lection.text == "abc xyz"
+    assert lection.witness_count == 3
+    assert lection.verses[1].text is None
+    np.testing.assert_allclose( lection.witness_agreement, [1.0, 1.0, 5/6] )
@@ -0,0 +1,59 @@
+import pickle
+
+import gotoh
+import numpy as np
+
+from dcodex_lectionary import alignment, synthetic
+from dcodex_lectionary.encoding import EncodedTexts
+
+GOTOH_PARAM = [6.6995597099885345, -0.9209875054657459, -5.097397327423096, -1.3005714416503906]
+
+
+def test_round_trip():
+    texts = ["εναρχηηνολογος", None, "καιολογος", ""]
+    encoded = EncodedTexts.from_texts( texts )
+    assert encoded.codes.dtype == np.uint8
+    assert len(encoded) == 4
+    assert encoded.texts() == ["εναρχηηνολογος", None, "καιολογος", None]
+    assert encoded.lengths().tolist() == [14, 0, 9, 0]
+
+    assert encoded.decoded() == encoded.texts()
+    assert pickle.loads( pickle.dumps( encoded ) )._decoded is None
+
+    sliced = encoded.slice( 2, 4 )
+    assert np.shares_memory( sliced[0], encoded.codes )
+    assert sliced.texts() == ["καιολογος", None]
+    assert sliced.decoded() == ["καιολογος", None]
+
+
+def test_equality_across_alphabets():
+    encoded = EncodedTexts.from_texts( ["αβγ", "γδ"] )
+    assert encoded == EncodedTexts.from_texts( ["αβγ", "γδ"], alphabet="δγβαε" )
+    assert encoded != EncodedTexts.from_texts( ["αβγ", "γε"] )
+    assert encoded != EncodedTexts.from_texts( ["αβ", "γγδ"] )
+
+
+def test_save_and_memory_map(tmp_path):
+    encoded = EncodedTexts.from_texts( ["αβγ", None, "γδ"] )
+    encoded.slice( 1, 3 ).save( tmp_path )
+    loaded = EncodedTexts.load( tmp_path )
+    assert isinstance( loaded.codes, np.memmap )
+    assert loaded.texts() == [None, "γδ"]
+
+
+def test_encoded_lection_counts():
+    tradition = synthetic.SyntheticTradition( 3, 4, 2, lacuna_rate=0.2, seed=6 )
+    lection_offsets = np.array( [0, 4, 8, 12] )
+    encoded_a, encoded_b = (EncodedTexts.from_texts( [text for lection in texts for text in lection] ) for texts in tradition.texts)
+
+    counts = alignment.encoded_pair_lection_counts( encoded_a, encoded_b, lection_offsets, GOTOH_PARAM )
+    for lection_index, (texts_a, texts_b) in enumerate(zip(*tradition.texts[:2])):
+        expected = np.zeros( (4,), dtype=np.int64 )
+        for text_a, text_b in zip(texts_a, texts_b):
+            if text_a and text_b:
+                expected += gotoh.counts( text_a, text_b, *GOTOH_PARAM )
+        np.testing.assert_array_equal( counts[lection_index], expected )
+
+    self_counts = alignment.encoded_self_lection_counts( encoded_a, lection_offsets )
+    np.testing.assert_array_equal( self_counts[:,0], [sum( len(text) for text in texts if text ) for texts in tradition.texts[0]] )
+    assert self_counts[:,1:].sum() == 0
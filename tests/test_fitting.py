@@ -0,0 +1,60 @@
+import numpy as np
+from scipy.optimize import check_grad
+from scipy.special import expit
+
+from dcodex_lectionary import fitting
+
+
+def test_logistic_loss_gradient():
+    rng = np.random.default_rng( 3 )
+    counts = rng.integers( 0, 50, size=(30, 4) ).astype(float)
+    labels = rng.integers( 0, 2, size=30 ).astype(float)
+    parameters = rng.normal( scale=0.05, size=5 )
+
+    error = check_grad(
+        lambda x: fitting.logistic_loss( x, counts, labels, 0.5, True )[0],
+        lambda x: fitting.logistic_loss( x, counts, labels, 0.5, True )[1],
+        parameters,
+    )
+    assert error < 1e-3
+
+
+def test_fit_logistic_weights():
+    rng = np.random.default_rng( 5 )
+    true_weights = np.array([0.08, -0.3, -0.6, -0.05])
+    counts = np.column_stack([
+        rng.integers( 50, 200, size=2000 ),
+        rng.integers( 0, 40, size=2000 ),
+        rng.integers( 0, 6, size=2000 ),
+        rng.integers( 0, 20, size=2000 ),
+    ]).astype(float)
+    labels = (rng.random( 2000 ) < expit( counts @ true_weights )).astype(float)
+
+    weights, prior_log_odds, result = fitting.fit_logistic_weights( counts, labels )
+    assert result.success
+    assert prior_log_odds == 0.0
+    assert fitting.logistic_loss( weights, counts, labels )[0] <= fitting.logistic_loss( true_weights, counts, labels )[0]
+    np.testing.assert_array_equal( np.sign(weights), np.sign(true_weights) )
+
+
+def test_roc_auc():
+    assert fitting.roc_auc( [0.1, 0.4, 0.35, 0.8], [0, 0, 1, 1] ) == 0.75
+    assert fitting.roc_auc( [1.0, 1.0], [0, 1] ) == 0.5
+    assert np.isnan( fitting.roc_auc( [1.0, 2.0], [1, 1] ) )
+
+
+def test_labelled_counts_and_separation():
+    gotoh_param = [6.6995597099885345, -0.9209875054657459, -5.097397327423096, -1.3005714416503906]
+    groups = [
+        ([[("εναρχηηνολογος", ["εναρχηηνολογος", "ουτοςηνεναρχη"])]], 2),
+        ([[("καιολογοςηνπροςτονθν", ["καιολογοςηνπροςτονθεον"])]], 1),
+    ]
+    positions = [(0, 0, 0), (0, 0, 1), (1, 0, 0)]
+    counts, seconds = fitting.labelled_counts( groups, positions, gotoh_param )
+    assert counts.shape == (3, 4)
+    assert counts[0,0] == len("εναρχηηνολογος")
+    assert seconds >= 0.0
+
+    metrics = fitting.separation_metrics( counts, [1, 0, 1], [0.07, -0.27, -0.63, -0.05] )
+    assert metrics['similarity_auc'] == 1.0
+    assert metrics['separation'] > 0
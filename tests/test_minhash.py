@@ -0,0 +1,61 @@
+import numpy as np
+
+from dcodex_lectionary import minhash
+
+
+def jaccard( a, b, shingle_size ):
+    shingles_a = {a[index:index+shingle_size] for index in range(len(a) - shingle_size + 1)}
+    shingles_b = {b[index:index+shingle_size] for index in range(len(b) - shingle_size + 1)}
+    return len(shingles_a & shingles_b)/len(shingles_a | shingles_b)
+
+
+def test_shingle_hashes():
+    assert len(minhash.shingle_hashes( "abcabcabc", 3 )) == 3
+    assert len(minhash.shingle_hashes( "ab", 5 )) == 1
+    assert len(minhash.shingle_hashes( None )) == 0
+
+
+def test_estimated_jaccard():
+    hasher = minhash.MinHasher( permutation_count=256 )
+    a = "εν αρχη ην ο λογος και ο λογος ην προς τον θεον και θεος ην ο λογος"
+    b = "εν αρχη ην ο λογος και ο λογος ην προς τον θεον και θεος ην λογος"
+    c = "τη ημερα τη τριτη γαμος εγενετο εν κανα της γαλιλαιας"
+    sketches = hasher.sketches( [a, b, c, ""] )
+    estimates = minhash.estimated_jaccard( sketches[0], sketches )
+    assert estimates[0] == 1.0
+    assert abs( estimates[1] - jaccard( a, b, 5 ) ) < 0.1
+    assert estimates[2] < 0.1
+    assert estimates[3] == 0.0
+    assert minhash.is_empty( sketches[3] )
+
+    # The same parameters give the same sketches
+    np.testing.assert_array_equal( minhash.MinHasher( permutation_count=256 ).sketch( a ), sketches[0] )
+
+
+def test_lsh_index_query():
+    rng = np.random.default_rng( 0 )
+    alphabet = list("αβγδεζηθικλμνξοπρστυφχψω ")
+    lections = ["".join( rng.choice( alphabet, 300 ) ) for _ in range(5)]
+    hasher = minhash.MinHasher()
+    index = minhash.LSHIndex( band_count=32 )
+
+    def variant( text, changes ):
+        characters = list(text)
+        for position in rng.choice( len(characters), changes, replace=False ):
+            characters[position] = "ϛ"
+        return "".join( characters )
+
+    for ms_id in range(25):
+        for lection_id, text in enumerate(lections):
+            sketch = hasher.sketch( variant( text, 4 * ms_id ) )
+            index.add( ms_id, lection_id, sketch, minhash.band_hashes( sketch, 32 )[0] )
+    index.add( "empty", 0, hasher.sketch( "" ) )
+    assert len(index) == 125
+
+    query = hasher.sketch( lections[2] )
+    nearest = index.query( 2, query, count=3, exclude=[0] )
+    assert {ms_id for ms_id, _ in nearest} == {1, 2, 3}
+    assert all( similarity > 0.5 for _, similarity in nearest )
+
+    # Sketches from other lections are not candidates
+    assert index.query( 3, hasher.sketch( lections[2] ) ) == []
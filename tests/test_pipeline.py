@@ -0,0 +1,83 @@
+import threading
+import time
+
+import pytest
+
+from dcodex_lectionary import pipeline
+
+
+def run( batches, fetch=None, align=sorted, **kwargs ):
+    results = []
+    fetch = fetch or (lambda batch: (([batch, -batch],), batch))
+    stats = pipeline.run_pipeline( batches, fetch, align, lambda context, result: results.append( (context, result) ), **kwargs )
+    return results, stats
+
+
+@pytest.mark.parametrize( "threaded", [False, True] )
+def test_results_in_order( threaded ):
+    results, stats = run( range(10), threaded=threaded )
+    assert results == [(batch, sorted( [batch, -batch] )) for batch in range(10)]
+    assert stats.batches == 10
+    assert stats.threaded == threaded
+
+
+def test_process_pool():
+    results, stats = run( range(20), n_jobs=2, queue_size=3 )
+    assert [context for context, _ in results] == list(range(20))
+    assert results[5][1] == [-5, 5]
+    assert stats.align_seconds >= 0.0
+
+
+def test_fetch_runs_in_thread():
+    threads = set()
+
+    def fetch( batch ):
+        threads.add( threading.current_thread().name )
+        return ([batch],), batch
+
+    exited = []
+    run( range(3), fetch=fetch, on_thread_exit=lambda: exited.append( threading.current_thread().name ) )
+    assert threads == {"dcodex-lectionary-fetch"}
+    assert exited == ["dcodex-lectionary-fetch"]
+
+
+def test_backpressure():
+    def slow_align( values ):
+        time.sleep( 0.02 )
+        return values
+
+    _, stats = run( range(8), align=slow_align, queue_size=1 )
+    assert stats.backpressure_count > 0
+    assert stats.backpressure_seconds > 0.0
+    assert max( stats.queue_depths ) <= 1
+
+
+def test_starvation():
+    def slow_fetch( batch ):
+        time.sleep( 0.02 )
+        return ([batch],), batch
+
+    _, stats = run( range(5), fetch=slow_fetch, queue_size=4 )
+    assert stats.starvation_seconds >= 0.05
+    assert stats.fetch_seconds >= 0.1
+    assert stats.backpressure_count == 0
+
+
+@pytest.mark.parametrize( "threaded", [False, True] )
+def test_fetch_error( threaded ):
+    def fetch( batch ):
+        if batch == 3:
+            raise KeyError( batch )
+        return ([batch],), batch
+
+    with pytest.raises( KeyError ):
+        run( range(10), fetch=fetch, threaded=threaded )
+
+
+def test_align_error_stops_fetch_thread():
+    def align( values ):
+        raise ValueError( "bad batch" )
+
+    with pytest.raises( ValueError ):
+        run( range(100), align=align, queue_size=1 )
+    assert not any( thread.name == "dcodex-lectionary-fetch" for thread in threading.enumerate() )
@@ -0,0 +1,66 @@
+import numpy as np
+
+from dcodex_lectionary import alignment, sampling, synthetic
+
+GOTOH_PARAM = [6.6995597099885345, -0.9209875054657459, -5.097397327423096, -1.3005714416503906]
+
+
+def make_sampled_similarity( seed ):
+    tradition = synthetic.SyntheticTradition( 1, 40, 4, variation_rate=0.15, lacuna_rate=0.1, seed=3 )
+    transcriptions = tradition.lection_transcriptions( 0, 0, [1, 2, 3] )
+    exact = alignment.similarity_percentages( alignment.verse_counts( transcriptions, 3, GOTOH_PARAM ).sum( axis=0 ) )
+    return sampling.SampledSimilarity( transcriptions, 3, GOTOH_PARAM, seed=seed ), exact
+
+
+def test_reproducible_and_progressive():
+    sampled, _ = make_sampled_similarity( seed=5 )
+    again, _ = make_sampled_similarity( seed=5 )
+    assert np.array_equal( sampled.order, again.order )
+
+    sampled.refine_to_fraction( 0.2 )
+    first_sample = sampled.order[:sampled.aligned_count].copy()
+    assert 0.2 <= sampled.aligned_mass_fraction() < 1.0
+    sampled.refine( 5 )
+    assert np.array_equal( sampled.order[:len(first_sample)], first_sample )
+
+
+def test_converges_to_exact():
+    sampled, exact = make_sampled_similarity( seed=1 )
+    sampled.refine_to_fraction( 1.0 )
+    assert sampled.is_exact
+    similarity, lower, upper = sampled.estimate()
+    np.testing.assert_allclose( similarity, exact )
+    np.testing.assert_allclose( lower, exact )
+    np.testing.assert_allclose( upper, exact )
+
+
+def test_interval_coverage():
+    covered = 0
+    for seed in range(40):
+        sampled, exact = make_sampled_similarity( seed )
+        sampled.refine_to_fraction( 0.3 )
+        _, lower, upper = sampled.estimate( confidence=0.95 )
+        covered += np.sum( (lower <= exact) & (exact <= upper) )
+    assert covered/(40*3) > 0.8
+
+
+def test_bootstrap_lection_intervals():
+    rng = np.random.default_rng( 2 )
+    verse_counts = rng.integers( 0, 40, size=(30, 2, 4) )
+    lection_index = np.repeat( [0, 1, 3], [10, 15, 5] )
+    weights = [0.07, -0.27, -0.63, -0.05]
+
+    intervals = sampling.bootstrap_lection_intervals( verse_counts, lection_index, 4, weights, resamples=200, seed=1, max_elements=1000 )
+    assert intervals['similarity_lower'].shape == (4, 2)
+    assert np.isnan( intervals['similarity_lower'][2] ).all()
+
+    totals = np.zeros( (4, 2, 4), dtype=np.int64 )
+    np.add.at( totals, lection_index, verse_counts )
+    similarity = alignment.similarity_percentages( totals )
+    present = [0, 1, 3]
+    assert np.all( intervals['similarity_lower'][present] <= similarity[present] )
+    assert np.all( similarity[present] <= intervals['similarity_upper'][present] )
+    assert np.all( intervals['probability_lower'][present] <= intervals['probability_upper'][present] )
+
+    again = sampling.bootstrap_lection_intervals( verse_counts, lection_index, 4, weights, resamples=200, seed=1 )
+    np.testing.assert_allclose( again['similarity_upper'], intervals['similarity_upper'] )
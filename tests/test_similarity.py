@@ -0,0 +1,525 @@
+from datetime import timedelta
+from unittest import mock
+
+import numpy as np
+import pytest
+from django.db import transaction
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from dcodex_lectionary import alignment
+from dcodex_lectionary.models import GotohCounts, Lectionary, LectionaryVerse, LectionarySystem, SimilarityJob, NormalizedTranscription, NORMALIZATION_VERSION, LectionGotohTotals, MinHashSketch
+from tests.test_models import make_easter_lection, make_great_saturday_lection
+from dcodex_lectionary.jobs import submit_similarity_job, run_pending_jobs, is_stale
+from dcodex_lectionary.views import preview_parameters, MIN_PREVIEW_FRACTION
+from dcodex_lectionary.similarity import (
+    GotohCountsCache,
+    LectionVerses,
+    lection_transcriptions,
+    similarity_dict,
+    DEFAULT_GOTOH_PARAM,
+    similarity_and_probability_arrays,
+    rolling_window_counts,
+    lection_families,
+    families_by_rank,
+    FAMILY_MIXED,
+    FAMILY_UNCERTAIN,
+    FAMILY_OFFSET,
+    similarity_probabilities_from_totals,
+    similarity_cache_key,
+    bump_transcriptions_version,
+    build_minhash_sketches,
+    nearest_manuscripts,
+    suggest_comparison_mss,
+    cached_suggest_comparison_mss,
+    score_lection_counts,
+    lections_verse_counts,
+    pipeline_options,
+)
+from dcodex_lectionary.pipeline import PipelineStats
+from dcodex_lectionary.pairwise import PairwiseSimilarity
+
+
+class GotohCountsCacheTests(TestCase):
+    def setUp(self):
+        self.transcriptions = [
+            [("εναρχηηνολογος", ["εναρχηνολογος", None]), (None, [])],
+            [("καιολογοςην", ["καιολογοςην", "καιολογος"])],
+        ]
+
+    def test_lookup_and_store(self):
+        cache = GotohCountsCache()
+        known_counts = cache.lookup( self.transcriptions, DEFAULT_GOTOH_PARAM )
+        self.assertEqual( known_counts, {} )
+        self.assertEqual( cache.misses, 3 )
+
+        counts = alignment.lections_verse_counts( self.transcriptions, 2, DEFAULT_GOTOH_PARAM, known_counts )
+        cache.store( self.transcriptions, counts, known_counts, DEFAULT_GOTOH_PARAM )
+        self.assertEqual( GotohCounts.objects.count(), 3 )
+
+        known_counts = cache.lookup( self.transcriptions, DEFAULT_GOTOH_PARAM )
+        self.assertEqual( cache.hits, 3 )
+        self.assertEqual( known_counts[("εναρχηηνολογος", "εναρχηνολογος")], tuple(counts[0][0,0]) )
+
+        cached_counts = alignment.lections_verse_counts( self.transcriptions, 2, DEFAULT_GOTOH_PARAM, known_counts )
+        for lection_counts, lection_cached_counts in zip(counts, cached_counts):
+            self.assertEqual( lection_counts.tolist(), lection_cached_counts.tolist() )
+
+    def test_parameters_in_key(self):
+        cache = GotohCountsCache()
+        known_counts = cache.lookup( self.transcriptions, DEFAULT_GOTOH_PARAM )
+        counts = alignment.lections_verse_counts( self.transcriptions, 2, DEFAULT_GOTOH_PARAM, known_counts )
+        cache.store( self.transcriptions, counts, known_counts, DEFAULT_GOTOH_PARAM )
+
+        self.assertEqual( cache.lookup( self.transcriptions, [1.0, -1.0, -1.0, -1.0] ), {} )
+
+    def test_prune(self):
+        cache = GotohCountsCache()
+        known_counts = cache.lookup( self.transcriptions, DEFAULT_GOTOH_PARAM )
+        counts = alignment.lections_verse_counts( self.transcriptions, 2, DEFAULT_GOTOH_PARAM, known_counts )
+        cache.store( self.transcriptions, counts, known_counts, DEFAULT_GOTOH_PARAM )
+
+        current = {GotohCounts.text_hash( text ) for text in ["εναρχηηνολογος", "εναρχηνολογος", "καιολογος"]}
+        self.assertEqual( GotohCounts.prune( current ), 2 )
+        self.assertEqual( GotohCounts.objects.count(), 1 )
+
+        # Without any normalized transcriptions nothing in the cache is current
+        self.assertEqual( GotohCounts.prune(), 1 )
+        self.assertEqual( GotohCounts.objects.count(), 0 )
+
+
+class SimilarityCacheKeyTests(TestCase):
+    def setUp(self):
+        self.system = LectionarySystem.objects.create(name="Test Lectionary System")
+        self.base_ms = Lectionary.objects.create(name="Test Lectionary 1", siglum="L1", system=self.system)
+        self.comparison_ms = Lectionary.objects.create(name="Test Lectionary 2", siglum="L2", system=self.system)
+        self.other_ms = Lectionary.objects.create(name="Test Lectionary 3", siglum="L3", system=self.system)
+
+    def key(self, comparison_mss, **kwargs):
+        return similarity_cache_key( "similarity_dict", self.system, self.base_ms, comparison_mss, **kwargs )
+
+    def test_key_is_stable(self):
+        self.assertEqual( self.key([self.comparison_ms], ignore_incipits=True), self.key([self.comparison_ms], ignore_incipits=True) )
+        self.assertNotEqual( self.key([self.comparison_ms], ignore_incipits=True), self.key([self.comparison_ms], ignore_incipits=False) )
+
+    def test_bump_invalidates_only_affected(self):
+        key = self.key([self.comparison_ms])
+        other_key = self.key([self.other_ms])
+
+        bump_transcriptions_version( self.comparison_ms.id )
+        self.assertNotEqual( key, self.key([self.comparison_ms]) )
+        self.assertEqual( other_key, self.key([self.other_ms]) )
+
+
+def test_similarity_and_probability_arrays():
+    rng = np.random.default_rng(0)
+    counts = rng.integers( 0, 50, size=(6, 3, 4) )
+    counts[2,1] = 0
+
+    similarity, probability = similarity_and_probability_arrays( counts, prior_log_odds=0.5 )
+    assert similarity.shape == (6, 3)
+    assert np.isnan( similarity[2,1] )
+    for lection_index in range(len(counts)):
+        results = similarity_probabilities_from_totals( counts[lection_index], prior_log_odds=0.5 )
+        np.testing.assert_allclose( similarity[lection_index], np.array(results[0::2], dtype=float) )
+        np.testing.assert_allclose( probability[lection_index], results[1::2] )
+
+
+
+def test_rolling_window_counts():
+    verse_counts = np.arange( 7*2*4 ).reshape( 7, 2, 4 )
+    expected = np.array( [verse_counts[max(0, index-1):index+2].sum( axis=0 ) for index in range(7)] )
+    np.testing.assert_array_equal( rolling_window_counts( verse_counts, 3 ), expected )
+
+    masses = np.array([10, 20, 5, 5, 30, 10, 10])
+    positions = np.cumsum( masses ) - 0.5 * masses
+    rolling = rolling_window_counts( verse_counts, 30, positions )
+    np.testing.assert_array_equal( rolling[1], verse_counts[0:3].sum( axis=0 ) )
+
+def test_families_by_rank():
+    similarities = np.array([[90.0, 50.0], [40.0, 60.0], [np.nan, np.nan], [70.0, 95.0], [95.0, 95.0]])
+    families = lection_families( similarities, threshold=80.0 )
+    np.testing.assert_array_equal( families, [3, FAMILY_UNCERTAIN, 0, 4, 3] )
+
+    families_array = families_by_rank( [3, 3, 1, 1, 0, 4, 3, 3], [0, 1, 1, 2, 3, 4, 4, 9], 6 )
+    np.testing.assert_array_equal( families_array, [3, 3, FAMILY_UNCERTAIN, 0, FAMILY_MIXED, 0] )
+    assert families_array.dtype == np.uint8
+
+def test_preview_parameters():
+    factory = RequestFactory()
+    assert preview_parameters( factory.get( "/" ) ) == (None, 0)
+    assert preview_parameters( factory.get( "/", {'preview': "0.25", 'seed': "3"} ) ) == (0.25, 3)
+    assert preview_parameters( factory.get( "/", {'preview': "0"} ) ) == (MIN_PREVIEW_FRACTION, 0)
+    assert preview_parameters( factory.get( "/", {'preview': "5"} ) ) == (1.0, 0)
+    for parameters in [{'seed': "x"}, {'preview': "half"}, {'preview': "nan"}]:
+        with pytest.raises( ValueError ):
+            preview_parameters( factory.get( "/", parameters ) )
+
+
+class SimilarityJobTests(TestCase):
+    def setUp(self):
+        self.system = LectionarySystem.objects.create(name="Test Lectionary System")
+        self.base_ms = Lectionary.objects.create(name="Test Lectionary 1", siglum="L1", system=self.system)
+        self.comparison_ms = Lectionary.objects.create(name="Test Lectionary 2", siglum="L2", system=self.system)
+
+    @override_settings(DCODEX_LECTIONARY_SIMILARITY_JOB_THREADS=0)
+    def test_submit_and_run(self):
+        job = submit_similarity_job( SimilarityJob.SIMILARITY_DICT, self.system, self.base_ms, [self.comparison_ms], ignore_incipits=True )
+        self.assertEqual( job.status, SimilarityJob.PENDING )
+        self.assertEqual( job.comparison_mss(), [self.comparison_ms] )
+
+        same_job = submit_similarity_job( SimilarityJob.SIMILARITY_DICT, self.system, self.base_ms, [self.comparison_ms], ignore_incipits=True )
+        self.assertEqual( job.id, same_job.id )
+
+        self.assertEqual( run_pending_jobs(), 1 )
+        job.refresh_from_db()
+        self.assertEqual( job.status, SimilarityJob.DONE )
+        self.assertEqual( job.similarity_dict(), {} )
+        self.assertEqual( job.progress_dict()['finished'], True )
+
+    @override_settings(DCODEX_LECTIONARY_SIMILARITY_JOB_THREADS=0)
+    def test_lection_counts_rescored(self):
+        job = submit_similarity_job( SimilarityJob.LECTION_COUNTS, self.system, self.base_ms, [self.comparison_ms], ignore_incipits=True )
+        self.assertEqual( run_pending_jobs(), 1 )
+        job.refresh_from_db()
+        self.assertEqual( job.status, SimilarityJob.DONE )
+
+        lections_in_system, lection_counts = job.lection_counts()
+        self.assertEqual( lection_counts.shape, (len(lections_in_system), 1, 4) )
+        default_df = score_lection_counts( lections_in_system, [self.comparison_ms], lection_counts )
+        weighted_df = score_lection_counts( lections_in_system, [self.comparison_ms], lection_counts, weights=[1.0, -1.0, -1.0, -1.0], prior_log_odds=2.0 )
+        self.assertEqual( list(default_df.columns), list(weighted_df.columns) )
+        self.assertEqual( list(weighted_df.columns), ['Lection','Lection_Membership__id','Lection_Membership__order', 'L2_similarity', 'L2_probability'] )
+
+    @override_settings(DCODEX_LECTIONARY_SIMILARITY_JOB_THREADS=1)
+    def test_stale_pending(self):
+        job = SimilarityJob.objects.create( kind=SimilarityJob.SIMILARITY_DICT, key="key", system=self.system, base_ms=self.base_ms, comparison_sigla="L2", parameters={} )
+        self.assertFalse( is_stale( job ) )
+
+        SimilarityJob.objects.filter( id=job.id ).update( updated=timezone.now() - timedelta(hours=1) )
+        job.refresh_from_db()
+        self.assertTrue( is_stale( job ) )
+
+        # Pending jobs wait for the management command when there is no thread pool
+        with override_settings(DCODEX_LECTIONARY_SIMILARITY_JOB_THREADS=0):
+            self.assertFalse( is_stale( job ) )
+
+    @override_settings(DCODEX_LECTIONARY_SIMILARITY_JOB_THREADS=0, DCODEX_LECTIONARY_FINISHED_JOB_SECONDS=60)
+    def test_prune_finished(self):
+        old = timezone.now() - timedelta(hours=1)
+        jobs = {
+            status: SimilarityJob.objects.create( kind=SimilarityJob.SIMILARITY_DICT, key=f"key-{status}", system=self.system, base_ms=self.base_ms, comparison_sigla="L2", status=status )
+            for status in [SimilarityJob.PENDING, SimilarityJob.DONE, SimilarityJob.FAILED]
+        }
+        SimilarityJob.objects.update( updated=old )
+        recent = SimilarityJob.objects.create( kind=SimilarityJob.SIMILARITY_DICT, key="key-recent", system=self.system, base_ms=self.base_ms, comparison_sigla="L2", status=SimilarityJob.DONE )
+
+        # Submitting a new job deletes the old finished jobs but not pending or recent ones
+        job = submit_similarity_job( SimilarityJob.SIMILARITY_DICT, self.system, self.base_ms, [self.comparison_ms] )
+        remaining = set( SimilarityJob.objects.values_list( 'id', flat=True ) )
+        self.assertEqual( remaining, {jobs[SimilarityJob.PENDING].id, recent.id, job.id} )
+
+        with override_settings(DCODEX_LECTIONARY_FINISHED_JOB_SECONDS=None):
+            SimilarityJob.objects.update( updated=old )
+            self.assertEqual( run_pending_jobs(), 2 )
+        self.assertEqual( SimilarityJob.objects.count(), 3 )
+
+
+class LectionVersesTests(TestCase):
+    def setUp(self):
+        self.system = LectionarySystem.objects.create(name="Test Lectionary System")
+        self.lection = make_easter_lection()
+        self.system.lections.add( self.lection )
+        self.ms = Lectionary.objects.create(name="Test Lectionary", siglum="L1", system=self.system)
+
+    def test_verses(self):
+        lection_verses = LectionVerses( self.system )
+        self.assertEqual( lection_verses.verse_count( self.lection ), 17 )
+        self.assertEqual( lection_verses.verses[self.lection.id], list(self.lection.verses.all()) )
+        self.assertEqual( lection_verses.verse_ids[self.lection.id].tolist(), list(self.lection.verses.values_list('id', flat=True)) )
+        self.assertEqual( lection_verses.bible_verse_ids[self.lection.id].tolist(), list(self.lection.verses.values_list('bible_verse__id', flat=True)) )
+
+    def test_transcription_counts(self):
+        lection_verses = LectionVerses( self.system )
+        self.assertEqual( lection_verses.transcription_counts( self.ms ), {self.lection.id: 0} )
+
+
+class NormalizedTranscriptionTests(TestCase):
+    def setUp(self):
+        self.system = LectionarySystem.objects.create(name="Test Lectionary System")
+        self.lection = make_easter_lection()
+        self.system.lections.add( self.lection )
+        self.ms = Lectionary.objects.create(name="Test Lectionary", siglum="L1", system=self.system)
+        self.verse = self.lection.verses.first()
+
+    def test_stored_on_save(self):
+        transcription = self.ms.transcription_class().objects.create( manuscript=self.ms, verse=self.verse, transcription="Ἐν ἀρχῇ ἦν ὁ λόγος" )
+        normalized = NormalizedTranscription.objects.get( transcription=transcription )
+        self.assertEqual( normalized.text, self.ms.normalized_transcription( self.verse ) )
+        self.assertEqual( normalized.version, NORMALIZATION_VERSION )
+
+        transcription.transcription = "Ἐν ἀρχῇ ἦν ὁ θεός"
+        transcription.save()
+        normalized.refresh_from_db()
+        self.assertEqual( normalized.text, self.ms.normalized_transcription( self.verse ) )
+
+    def test_outdated_version_refreshed(self):
+        transcription = self.ms.transcription_class().objects.create( manuscript=self.ms, verse=self.verse, transcription="Ἐν ἀρχῇ ἦν ὁ λόγος" )
+        NormalizedTranscription.objects.filter( transcription=transcription ).update( text="outdated", version=NORMALIZATION_VERSION - 1 )
+
+        transcriptions = lection_transcriptions( self.ms, self.lection, [self.ms] )
+        self.assertEqual( transcriptions[0][0], self.ms.normalized_transcription( self.verse ) )
+        self.assertEqual( NormalizedTranscription.objects.get( transcription=transcription ).version, NORMALIZATION_VERSION )
+
+
+class SimilarityFamiliesTests(TestCase):
+    def setUp(self):
+        self.system = LectionarySystem.objects.create(name="Test Lectionary System")
+        self.lections = [make_great_saturday_lection(), make_easter_lection()]
+        for lection in self.lections:
+            self.system.lections.add( lection )
+        self.base_ms = Lectionary.objects.create(name="Base Lectionary", siglum="L1", system=self.system)
+        self.comparison_mss = [
+            Lectionary.objects.create(name="Comparison Lectionary A", siglum="L2", system=self.system),
+            Lectionary.objects.create(name="Comparison Lectionary B", siglum="L3", system=self.system),
+        ]
+        close = ["Ὀψὲ δὲ σαββάτων ἦλθεν Μαριὰμ", "καὶ ἰδοὺ σεισμὸς ἐγένετο μέγας", "ἦν δὲ ἡ εἰδέα αὐτοῦ ὡς ἀστραπή"]
+        far = ["Ἐν ἀρχῇ ἦν ὁ λόγος", "οὗτος ἦν ἐν ἀρχῇ πρὸς τὸν θεόν", "πάντα δι᾽ αὐτοῦ ἐγένετο"]
+        texts = [
+            (self.base_ms, [close, far]),
+            (self.comparison_mss[0], [close, [text[::-1] for text in far]]),
+            (self.comparison_mss[1], [[text[::-1] for text in close], far]),
+        ]
+        for ms, lection_texts in texts:
+            for lection, verse_texts in zip(self.lections, lection_texts):
+                for verse, text in zip(lection.verses.all(), verse_texts):
+                    ms.transcription_class().objects.create( manuscript=ms, verse=verse, transcription=text )
+
+        bible_verses = [verse.bible_verse for lection in self.lections for verse in lection.verses.all()]
+        self.start_verse = min( bible_verses, key=lambda verse: verse.rank )
+        self.end_verse = max( bible_verses, key=lambda verse: verse.rank )
+
+    def baseline_families_array(self, threshold):
+        """ The families from aligning each lection separately as the original per-verse implementation did. """
+        families_array = np.zeros( (self.end_verse.rank - self.start_verse.rank + 1,) )
+        for lection in self.lections:
+            averages = self.base_ms.similarity_lection( lection, self.comparison_mss )
+            max_index, max_average = None, 0.0
+            for ms_index, average in enumerate( averages ):
+                if average is not None and average > max_average:
+                    max_index, max_average = ms_index, average
+            if max_index is None:
+                continue
+            family = max_index + FAMILY_OFFSET if max_average > threshold else FAMILY_UNCERTAIN
+            for lectionary_verse in lection.verses.all():
+                if lectionary_verse.bible_verse is None:
+                    continue
+                array_index = lectionary_verse.bible_verse.rank - self.start_verse.rank
+                if families_array[array_index] <= FAMILY_UNCERTAIN:
+                    families_array[array_index] = family
+                elif families_array[array_index] != family:
+                    families_array[array_index] = FAMILY_MIXED
+        return families_array.astype( int )
+
+    def test_similarity_families_array(self):
+        for threshold in [50.0, 100.0]:
+            expected = self.baseline_families_array( threshold )
+            for prune in [False, True]:
+                families = self.base_ms.similarity_families_array( self.comparison_mss, self.start_verse, self.end_verse, threshold, prune=prune )
+                np.testing.assert_array_equal( families.astype( int ), expected )
+
+        # The families of the verses of the lections follow the closest manuscript
+        families = self.base_ms.similarity_families_array( self.comparison_mss, self.start_verse, self.end_verse, 50.0 )
+        ranks = [[verse.bible_verse.rank - self.start_verse.rank for verse in lection.verses.all()] for lection in self.lections]
+        self.assertTrue( np.all( families[ranks[0]] == FAMILY_OFFSET ) )
+        self.assertTrue( np.all( families[ranks[1]] == FAMILY_OFFSET + 1 ) )
+
+    def test_verse_without_bible_verse(self):
+        verse = self.lections[1].verses.all().last()
+        LectionaryVerse.objects.filter( id=verse.id ).update( bible_verse=None )
+        expected = self.baseline_families_array( 50.0 )
+        families = self.base_ms.similarity_families_array( self.comparison_mss, self.start_verse, self.end_verse, 50.0 )
+        np.testing.assert_array_equal( families.astype( int ), expected )
+
+    def test_lections_agreeing_with(self):
+        for prune in [False, True]:
+            agreeing = self.base_ms.lections_agreeing_with( self.comparison_mss, 50.0, prune=prune )
+            self.assertEqual( agreeing['L2'], [self.lections[0]] )
+            self.assertEqual( agreeing['L3'], [self.lections[1]] )
+
+
+class PairwiseSimilarityTests(TestCase):
+    def setUp(self):
+        self.system = LectionarySystem.objects.create(name="Test Lectionary System")
+        for lection in [make_great_saturday_lection(), make_easter_lection()]:
+            self.system.lections.add( lection )
+        self.mss = [
+            Lectionary.objects.create(name=f"Lectionary {siglum}", siglum=siglum, system=self.system)
+            for siglum in ["L1", "L2", "L3", "L4"]
+        ]
+        lection_texts = [["Ὀψὲ δὲ σαββάτων ἦλθεν Μαριὰμ", "καὶ ἰδοὺ σεισμὸς ἐγένετο μέγας"], ["Ἐν ἀρχῇ ἦν ὁ λόγος", "οὗτος ἦν ἐν ἀρχῇ πρὸς τὸν θεόν"]]
+        for ms_index, ms in enumerate(self.mss):
+            for lection_in_system, texts in zip(self.system.lections_in_system(), lection_texts):
+                for verse, text in zip(lection_in_system.lection.verses.all(), texts):
+                    ms.transcription_class().objects.create( manuscript=ms, verse=verse, transcription=text[ms_index:] )
+
+    def change_transcription(self, ms, text):
+        transcription = ms.transcription_class().objects.filter( manuscript=ms ).first()
+        transcription.transcription = text
+        transcription.save()
+
+    def aligned_pairs(self, pairwise, mock_counts):
+        """ Returns the pairs of manuscript indexes which were aligned from the calls to the mock of `encoded_pair_lection_counts`. """
+        indexes = {id(texts): ms_index for ms_index, texts in enumerate(pairwise.texts)}
+        return sorted( (indexes[id(call.args[0])], indexes[id(call.args[1])]) for call in mock_counts.call_args_list )
+
+    def test_update(self):
+        for mss, text in [(None, "πάντα δι᾽ αὐτοῦ ἐγένετο"), (["L2"], "χωρὶς αὐτοῦ ἐγένετο οὐδὲ ἕν")]:
+            pairwise = PairwiseSimilarity( self.system, self.mss ).compute()
+            previous_counts = pairwise.counts.copy()
+            self.change_transcription( self.mss[1], text )
+
+            with mock.patch.object( alignment, 'encoded_pair_lection_counts', wraps=alignment.encoded_pair_lection_counts ) as mock_counts:
+                self.assertEqual( pairwise.update( mss ), [1] )
+            self.assertEqual( self.aligned_pairs( pairwise, mock_counts ), [(0, 1), (1, 2), (1, 3)] )
+
+            # Only the row and column of the changed manuscript are different
+            others = [0, 2, 3]
+            np.testing.assert_array_equal( pairwise.counts[np.ix_( others, others )], previous_counts[np.ix_( others, others )] )
+            self.assertFalse( np.array_equal( pairwise.counts[1], previous_counts[1] ) )
+
+            rebuilt = PairwiseSimilarity( self.system, self.mss ).compute()
+            np.testing.assert_array_equal( pairwise.counts, rebuilt.counts )
+
+    def test_update_unchanged(self):
+        pairwise = PairwiseSimilarity( self.system, self.mss ).compute()
+        with mock.patch.object( alignment, 'encoded_pair_lection_counts', wraps=alignment.encoded_pair_lection_counts ) as mock_counts:
+            self.assertEqual( pairwise.update(), [] )
+        mock_counts.assert_not_called()
+
+
+@override_settings(DCODEX_LECTIONARY_SIMILARITY_JOB_THREADS=0) # The derived data is updated in the saving thread
+class LectionGotohTotalsTests(TestCase):
+    def setUp(self):
+        self.system = LectionarySystem.objects.create(name="Test Lectionary System")
+        self.lection = make_easter_lection()
+        self.system.lections.add( self.lection )
+        self.base_ms = Lectionary.objects.create(name="Base Lectionary", siglum="L1", system=self.system)
+        self.comparison_ms = Lectionary.objects.create(name="Comparison Lectionary", siglum="L2", system=self.system)
+        self.verses = list(self.lection.verses.all()[:2])
+        for ms, texts in [(self.base_ms, ["Ἐν ἀρχῇ ἦν ὁ λόγος", "οὗτος ἦν ἐν ἀρχῇ"]), (self.comparison_ms, ["Ἐν ἀρχῇ ἦν λόγος", "οὗτος ἦν ἐν ἀρχῇ"])]:
+            for verse, text in zip(self.verses, texts):
+                ms.transcription_class().objects.create( manuscript=ms, verse=verse, transcription=text )
+
+    def similarities(self, **kwargs):
+        return similarity_dict( self.base_ms, [self.comparison_ms], system=self.system, **kwargs )
+
+    def test_materialized_matches_alignment(self):
+        self.assertEqual( self.similarities( materialized=True ), self.similarities( materialized=False ) )
+        self.assertEqual( LectionGotohTotals.objects.count(), 1 )
+
+    def test_updated_on_save(self):
+        self.similarities( materialized=True )
+        transcription = self.comparison_ms.transcription_class().objects.get( manuscript=self.comparison_ms, verse=self.verses[1] )
+        transcription.transcription = "ἐκεῖνος ἦν ἐν ἀρχῇ"
+        with self.captureOnCommitCallbacks( execute=True ):
+            transcription.save()
+
+        self.assertEqual( LectionGotohTotals.objects.count(), 1 )
+        self.assertEqual( self.similarities( materialized=True ), self.similarities( materialized=False ) )
+
+
+class FetchThreadTests(TransactionTestCase):
+    """ The fetch thread has its own database connection so these tests commit their data rather than running in a transaction. """
+    def setUp(self):
+        self.system = LectionarySystem.objects.create(name="Test Lectionary System")
+        self.lection = make_easter_lection()
+        self.system.lections.add( self.lection )
+        self.base_ms = Lectionary.objects.create(name="Base Lectionary", siglum="L1", system=self.system)
+        self.comparison_ms = Lectionary.objects.create(name="Comparison Lectionary", siglum="L2", system=self.system)
+        for ms, texts in [(self.base_ms, ["Ἐν ἀρχῇ ἦν ὁ λόγος", "οὗτος ἦν ἐν ἀρχῇ"]), (self.comparison_ms, ["Ἐν ἀρχῇ ἦν λόγος", "οὗτος ἦν ἐν ἀρχῇ"])]:
+            for verse, text in zip(self.lection.verses.all()[:2], texts):
+                ms.transcription_class().objects.create( manuscript=ms, verse=verse, transcription=text )
+
+    def test_threaded_matches_inline(self):
+        stats = PipelineStats()
+        threaded = lections_verse_counts( self.base_ms, [self.lection], [self.comparison_ms], threaded=True, stats=stats )
+        inline = lections_verse_counts( self.base_ms, [self.lection], [self.comparison_ms], threaded=False )
+        self.assertTrue( stats.threaded )
+        self.assertEqual( [counts.tolist() for counts in threaded], [counts.tolist() for counts in inline] )
+        self.assertGreater( threaded[0].sum(), 0 )
+
+    def test_inline_in_transaction(self):
+        self.assertTrue( pipeline_options( threaded=True )[1] )
+        with transaction.atomic():
+            self.assertFalse( pipeline_options( threaded=True )[1] )
+
+
+@override_settings(DCODEX_LECTIONARY_SIMILARITY_JOB_THREADS=0) # The derived data is updated in the saving thread
+class MinHashSketchTests(TestCase):
+    def setUp(self):
+        self.system = LectionarySystem.objects.create(name="Test Lectionary System")
+        self.lection = make_easter_lection()
+        self.system.lections.add( self.lection )
+        self.verses = list(self.lection.verses.all()[:2])
+        self.mss = []
+        texts = [
+            ["Ἐν ἀρχῇ ἦν ὁ λόγος", "οὗτος ἦν ἐν ἀρχῇ πρὸς τὸν θεόν"],
+            ["Ἐν ἀρχῇ ἦν λόγος", "οὗτος ἦν ἐν ἀρχῇ πρὸς τὸν θεόν"],
+            ["Τῇ ἡμέρᾳ τῇ τρίτῃ γάμος ἐγένετο", "ἐν Κανᾷ τῆς Γαλιλαίας"],
+        ]
+        for index, ms_texts in enumerate(texts):
+            ms = Lectionary.objects.create(name=f"Lectionary {index}", siglum=f"L{index}", system=self.system)
+            for verse, text in zip(self.verses, ms_texts):
+                ms.transcription_class().objects.create( manuscript=ms, verse=verse, transcription=text )
+            self.mss.append( ms )
+
+    def test_nearest_manuscripts(self):
+        self.assertEqual( build_minhash_sketches( self.system, self.mss ), 3 )
+        self.assertEqual( build_minhash_sketches( self.system, self.mss ), 0 )
+
+        nearest = nearest_manuscripts( self.mss[0], self.lection )
+        self.assertEqual( nearest[0][0].id, self.mss[1].id )
+        self.assertNotIn( self.mss[0].id, [ms.id for ms, _ in nearest] )
+
+        suggestions = suggest_comparison_mss( self.mss[0], count=1 )
+        self.assertEqual( [ms.id for ms, _ in suggestions], [self.mss[1].id] )
+
+    def test_cached_suggestions(self):
+        build_minhash_sketches( self.system, self.mss )
+        expected = [(ms.id, similarity) for ms, similarity in suggest_comparison_mss( self.mss[0], exclude=[self.mss[1]] )]
+        self.assertEqual( [(ms.id, similarity) for ms, similarity in cached_suggest_comparison_mss( self.mss[0], exclude=[self.mss[1]] )], expected )
+        with mock.patch( 'dcodex_lectionary.similarity.suggest_comparison_mss' ) as mock_suggest:
+            self.assertEqual( [(ms.id, similarity) for ms, similarity in cached_suggest_comparison_mss( self.mss[0], exclude=[self.mss[1]] )], expected )
+        mock_suggest.assert_not_called()
+
+        # Changing a sketch changes the key of the cached suggestions
+        transcription = self.mss[2].transcription_class().objects.get( manuscript=self.mss[2], verse=self.verses[0] )
+        transcription.transcription = "Ἐν ἀρχῇ ἦν ὁ λόγος"
+        with self.captureOnCommitCallbacks( execute=True ):
+            transcription.save()
+        suggestions = cached_suggest_comparison_mss( self.mss[0], exclude=[self.mss[1]] )
+        self.assertEqual( [(ms.id, similarity) for ms, similarity in suggestions], [(ms.id, similarity) for ms, similarity in suggest_comparison_mss( self.mss[0], exclude=[self.mss[1]] )] )
+        self.assertGreater( dict( (ms.id, similarity) for ms, similarity in suggestions )[self.mss[2].id], dict(expected).get( self.mss[2].id, 0.0 ) )
+
+    def test_updated_on_save(self):
+        build_minhash_sketches( self.system, self.mss )
+        row = MinHashSketch.objects.get( manuscript=self.mss[2], lection=self.lection )
+        transcription = self.mss[2].transcription_class().objects.get( manuscript=self.mss[2], verse=self.verses[0] )
+        transcription.transcription = "Ἐν ἀρχῇ ἦν ὁ λόγος"
+        with self.captureOnCommitCallbacks( execute=True ):
+            transcription.save()
+        self.assertNotEqual( bytes(MinHashSketch.objects.get( id=row.id ).sketch), bytes(row.sketch) )
+
+    def test_created_on_save(self):
+        build_minhash_sketches( self.system, self.mss )
+        ms = Lectionary.objects.create(name="Lectionary 3", siglum="L3", system=self.system)
+        with self.captureOnCommitCallbacks( execute=True ):
+            ms.transcription_class().objects.create( manuscript=ms, verse=self.verses[0], transcription="Ἐν ἀρχῇ ἦν ὁ λόγος" )
+        self.assertTrue( MinHashSketch.objects.filter( manuscript=ms, lection=self.lection ).exists() )
+
+    def test_build_missing_lections(self):
+        build_minhash_sketches( self.system, self.mss )
+        MinHashSketch.objects.filter( manuscript=self.mss[1] ).delete()
+        self.assertEqual( build_minhash_sketches( self.system, self.mss ), 1 )
+        self.assertTrue( MinHashSketch.objects.filter( manuscript=self.mss[1], lection=self.lection ).exists() )
@@ -0,0 +1,32 @@
+import numpy as np
+
+from dcodex_lectionary import synthetic, alignment
+
+GOTOH_PARAM = [6.6995597099885345, -0.9209875054657459, -5.097397327423096, -1.3005714416503906]
+
+
+def test_tradition_is_reproducible():
+    tradition = synthetic.SyntheticTradition( 3, 4, 5, seed=2 )
+    assert tradition.texts == synthetic.SyntheticTradition( 3, 4, 5, seed=2 ).texts
+    assert tradition.texts != synthetic.SyntheticTradition( 3, 4, 5, seed=3 ).texts
+    assert len(tradition.texts) == 5
+    assert all( len(lection) == 4 for ms_texts in tradition.texts for lection in ms_texts )
+    assert set("".join( tradition.texts[0][0] )) <= set(synthetic.GREEK_LETTERS)
+
+
+def test_families_are_closer():
+    tradition = synthetic.SyntheticTradition( 20, 5, 4, variation_rate=0.2, family_count=2, seed=4 )
+    transcriptions = [tradition.lection_transcriptions( 0, lection_index, [1, 2, 3] ) for lection_index in range(20)]
+    counts = sum( counts.sum( axis=0 ) for counts in alignment.lections_verse_counts( transcriptions, 3, GOTOH_PARAM ) )
+    similarity = alignment.similarity_percentages( counts )
+
+    # Manuscript 2 is in the same family as the base manuscript 0
+    assert tradition.families == [0, 1, 0, 1]
+    assert similarity[1] > similarity[0]
+    assert similarity[1] > similarity[2]
+
+
+def test_lacunae():
+    tradition = synthetic.SyntheticTradition( 10, 10, 2, lacuna_rate=0.5, seed=1 )
+    missing = np.mean( [text is None for ms_texts in tradition.texts for lection in ms_texts for text in lection] )
+    assert 0.3 < missing < 0.7